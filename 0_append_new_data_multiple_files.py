@@ -15,8 +15,21 @@
 import pandas as pd
 # import numpy as np
 import os
+import glob
 import time
 import datetime
+import layout_helper_scripts as layout
+import read_helper_scripts as read
+import cache_helper_scripts as cache
+import lookup_helper_scripts as lookup
+import validate_helper_scripts as validate
+import compress_helper_scripts as compress
+import memory_helper_scripts as memory
+import append_helper_scripts as append
+import store_helper_scripts as store
+import diff_helper_scripts as diff
+import dates_helper_scripts as dates
+import checkpoint_helper_scripts as checkpoint
 # import _log_helper_scripts as log
 # import shutil
 # import RUN_PARAMETERS as params
@@ -47,188 +60,376 @@ printLogHeader()
 
 ### Set parameters
 old_file = 'FirstHealth_4800_20221201_20230131.txt'
-new_file1 = 'FirstHealth_4800_20230101_20230228.txt'
-new_file2 = 'FirstHealth_4800_20230201_20230331.txt'
-new_file3 = 'FirstHealth_4800_20230301_20230430.txt'
+# the new monthly files, oldest first - a list of files, or a glob pattern
+#  (e.g. 'FirstHealth_4800_2023*.txt') whose files are taken in name order.
+#  A later file wins the PCN dedupe.
+new_files = ['FirstHealth_4800_20230101_20230228.txt',
+             'FirstHealth_4800_20230201_20230331.txt',
+             'FirstHealth_4800_20230301_20230430.txt']
 final_file = 'FirstHealth_4800_20221201_20230430_test.txt'
 client_path = 'C:/PHI/Projects/FirstHealth/12th Refresh 202303/Client Data/Preprocessing'
-# new_file_name = new_file.split(client_path+'/raw/')[1]
+# any of the files above may be gzip (.gz) or zstd (.zst) compressed,
+#  the compression is picked from the file extension
+# csv parser engine for reading 4800 files: 'c' (pandas), 'pyarrow' or
+#  'polars'. pyarrow and polars read on all cores if they are installed.
+read_engine = 'c'
 
-### Read in old data
-# first count the number of rows in the old file.
-with open(f'{client_path}/{old_file}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
-print()
-print(f'''The old file, {old_file},
-located in {client_path}
-contains {num_lines:,.0f} lines including a header row.
-''')
-del num_lines
+# parsed file cache folder: a file already parsed by any program is
+#  loaded from here instead of parsed again (needs pyarrow).  The entries
+#  hold PHI, so the ones not used for a month are deleted (see
+#  cache_helper_scripts.py).  Set to None to turn the cache off.
+cache_dir = 'C:/PHI/Projects/CQD/ParsedFileCache'
 
-old_df = pd.read_csv(f'{client_path}/{old_file}', sep='|', dtype=str)
-print('')
-print(f'Total records in old_df = {old_df.shape[0]:,.0f}',"",sep='\n')
+# write a PCN offset index next to the output file so single encounters can
+#  be looked up with lookup_helper_scripts.fetch without loading the file
+build_offset_index = True
 
-# print the record count in the dataframe extract
-print(f"Total records imported into old_df from client file = {old_df.shape[0]:,.0f}")
-print()
+# columns used by the dedupe and date checks - only these are read from
+#  each file.  The other 4800 columns are read for the surviving rows just
+#  before the final file is written, or with the updated records of the
+#  change report (see read_helper_scripts.fill_4800).
+append_columns = ['PCN', 'DISDATE']
+# source id of each input file, in "later file wins" order
+if isinstance(new_files, str):
+    new_files = [os.path.basename(path) for path
+                 in sorted(glob.glob(f'{client_path}/{new_files}'))
+                 if os.path.basename(path) not in (old_file, final_file)]
+source_files = {0: old_file}
+source_files.update(enumerate(new_files, start=1))
+print(f'Appending {len(new_files)} new files to {old_file}:',
+      *[f'   {file}' for file in new_files],'',sep='\n')
+# number of files checked and read at the same time, None for one per file
+#  (up to the number of cpu cores)
+read_workers = None
+# how the full records are written: 'memory' fills them into df and writes
+#  it with to_csv, 'out_of_core' streams them with polars (see
+#  read_helper_scripts.sink_4800) and 'auto' lets the memory planner pick
+#  from the estimated size of the full records and memory_budget.
+#  'passthrough' copies the files line by line without parsing any record
+#  (see append_helper_scripts.py) - fastest and flat memory, but there
+#  are no date distribution reports, and the records are only sorted by
+#  DISDATE with sort_passthrough.
+#  'store' upserts the new files into the client's history store (see
+#  store_helper_scripts.py) and writes final_file from the store, so only
+#  the months in the new files are rewritten.  The old file is only read
+#  to start a store that is still empty.
+append_mode = 'auto'
+# sort the passthrough output by DISDATE with an external merge sort of its
+#  lines, in runs sized from memory_budget (see
+#  append_helper_scripts.sort_file)
+sort_passthrough = True
+# The monthly files overlap by a month, so only the old records in the
+#  discharge months of the new files are checked for duplicate PCNs and
+#  the older records pass straight through (see
+#  append_helper_scripts.merge_append).  Set to False to check every old
+#  record, e.g. when a resubmission can move an encounter's DISDATE to
+#  another month.
+overlap_window = True
+# report which records of the new files are inserted, updated or unchanged
+#  against the old file, and the changed fields of the updated records
+#  (see diff_helper_scripts.py).  Not used by the passthrough and store
+#  modes.
+report_changes = True
+# pipe file of the inserted records and the changed fields of the updated
+#  records, for later stages that only redo the changed records.  None for
+#  no file.
+changes_file = None
+# history store folder for append_mode 'store', one Parquet file per
+#  discharge month keyed by PROVNUM + PCN (needs pyarrow)
+store_dir = 'C:/PHI/Projects/FirstHealth/HistoryStore'
+# discharge months (YYYYMM) written to final_file from the store, None for
+#  no limit on that side
+store_start = None
+store_end = None
+# checkpoint folder: the QA counts of each input file are checkpointed as
+#  it is read (or upserted in append_mode 'store'), and the merged records
+#  once the files are merged, so a run that stops part way is started again
+#  from the steps it finished (see checkpoint_helper_scripts.py).  Files
+#  already read come back from cache_dir, so set both.  The checkpoints are
+#  deleted when the run finishes.  Not used by the passthrough mode.  None
+#  for no checkpoints (needs pyarrow).
+checkpoint_dir = 'C:/PHI/Projects/FirstHealth/AppendCheckpoints'
+# memory the append may use in bytes (e.g. 8 * 2**30 for 8 GB), None for
+#  half of the memory free when the program starts
+memory_budget = None
+# new_file_name = new_file.split(client_path+'/raw/')[1]
 
-### Read in new data file1
-print('','New data:',sep='\n')
-# first count the number of rows in the new file.
-with open(f'{client_path}/{new_file1}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
-print()
-print(f'''The new file, {new_file1},
-located in {client_path}
-contains {num_lines:,.0f} lines including a header row.
-''')
-del num_lines
+if append_mode == 'passthrough':
+    # Raw line append: no record is parsed.  The PCNs of the new files are
+    #  collected, the old file is copied line by line leaving out the
+    #  records a new file replaces, and then the new files are copied.
+    print('Appending the files line by line without parsing them.','',sep='\n')
+    stats = append.passthrough_append(
+        {i: f'{client_path}/{file}' for i, file in source_files.items()},
+        f'{client_path}/{final_file}')
+    for i, file in source_files.items():
+        print(f'{file}:',
+              f"   {stats[i]['records']:,} records",
+              f"   {stats[i]['duplicates']:,} duplicate PCNs in the same file",
+              f"   {stats[i]['superseded']:,} replaced by a later file",
+              f"   {stats[i]['written']:,} written",'',sep='\n')
+    records_in = sum(stat['records'] for stat in stats.values())
+    records_out = sum(stat['written'] for stat in stats.values())
+    del stats
+    if sort_passthrough:
+        # runs of as many records as the memory planner allows a chunk
+        plan = memory.plan_stage(f'{client_path}/{final_file}',
+                                 budget=memory_budget,
+                                 modes=('memory', 'chunked'), rows=records_out)
+        print('Sorting the final file by DISDATE.',
+              memory.report(plan),'',sep='\n')
+        stats = append.sort_file(f'{client_path}/{final_file}',
+                                 chunksize=plan['chunksize'] or max(records_out, 1))
+        print(f"Sorted {stats['records']:,} records in {stats['runs']:,} runs.",'',sep='\n')
+        del plan, stats
+elif append_mode == 'store':
+    # Upsert each new file into the history store with keep-last on
+    #  PROVNUM + PCN; only the discharge month partitions in the file are
+    #  rewritten.  An empty store is started from the old file.
+    upsert_files = dict(source_files)
+    if store.stored_months(store_dir):
+        del upsert_files[0]
+        print(f'The history store {store_dir} already holds the old data,',
+              f'{old_file} is not read.','',sep='\n')
+    # files upserted by an earlier run that stopped part way are not
+    #  upserted again
+    done = checkpoint.resume(
+        checkpoint_dir,
+        {i: f'{client_path}/{file}' for i, file in upsert_files.items()},
+        store_dir=store_dir)
+    for i, file in upsert_files.items():
+        if i in done:
+            print(f'{file} was upserted by an earlier run (checkpoint).')
+            stats = done[i]
+        else:
+            print(f'Upserting {file} into the history store.')
+            new_df = read.read_4800(f'{client_path}/{file}', engine=read_engine,
+                                    categorical=False, cache_dir=cache_dir)
+            stats = store.upsert(store_dir, new_df)
+            del new_df
+            if checkpoint_dir and checkpoint.available():
+                checkpoint.save(checkpoint_dir, i, f'{client_path}/{file}',
+                                stats, store_dir=store_dir)
+        print(f"   {stats['records']:,} records",
+              f"   {stats['duplicates']:,} duplicate PROVNUM/PCNs in the same file",
+              f"   {stats['inserted']:,} new encounters",
+              f"   {stats['updated']:,} replaced stored encounters",
+              f"   {stats['unchanged']:,} unchanged encounters skipped",
+              f"   {stats['moved']:,} of them moved to another discharge month",
+              f"   discharge months rewritten: {stats['months']}",'',sep='\n')
+    del stats, upsert_files, done
 
-new_df = pd.read_csv(f'{client_path}/{new_file1}', sep='|', dtype=str)
-print('')
-print(f'Total records in new_df = {new_df.shape[0]:,.0f}',"",sep='\n')
-
-
-### Report date distributions for the old & new data
-print('','','-'*27,'Date distribution of previous data:',
-      pd.to_datetime(old_df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      '','','-'*27,'Date distribution of new data:',
-      pd.to_datetime(new_df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      sep='\n')
-
-### Combine old & new
-df = pd.concat([old_df, new_df], ignore_index=True, sort=False)
-
-### Check for and drop duplicates
-dupe_count = df.duplicated(subset="PCN").sum()
-print('','Checking for duplicate records:',
-      f'   {df.duplicated(subset="PCN").sum():,} duplicate PCNs',
-      sep='\n')
-print('',f'Dropping {df.duplicated(subset="PCN").sum():,} duplicates of PCN, keeping last','',sep='\n')
-df.drop_duplicates(subset="PCN", keep='last', inplace=True)
-print(f'Total records in df = {df.shape[0]:,.0f}')
-#QA check new file 1
-print('\nRecord Count QA Check - file1:')
-print('Subsetted previous file record count: ', len(old_df))
-print('New file record count: ', len(new_df))
-print('Total dupes to remove: ',dupe_count)
-print('Final file record count: ', len(df))
-print('QA Check Passed? ', len(df)==len(old_df)+len(new_df)-dupe_count)
-print()
+    print('The number of stored records by discharge month is:',
+          store.report(store_dir),'',sep='\n')
+    print(f'Exporting discharge months {store_start or "first"} to '
+          f'{store_end or "last"} from the history store.','',sep='\n')
+    records_out = store.extract(store_dir, f'{client_path}/{final_file}',
+                                start=store_start, end=store_end)
+else:
+    ### Read in all input files at the same time
+    # Each file gets its delimiter check and its read on a thread pool, so the
+    #  wall clock time is about that of the largest file.  The dfs come back
+    #  keyed by source id and are combined below in source_files order, so the
+    #  later file still wins the dedupe.
+    # only append_columns are read, each row is tagged with its source file
+    #  and row number so the rest of the record can be added at output
+    # Files checkpointed by an earlier run that stopped part way keep their
+    #  QA counts from checkpoint_dir and are read back from the parsed file
+    #  cache, and only the others are checked.  The counts of each file
+    #  read are checkpointed straight away.
+    paths = {i: f'{client_path}/{file}' for i, file in source_files.items()}
+    # the change report compares the whole records, so they are hashed
+    #  from their raw lines and not from the append_columns read
+    options = {'usecols': append_columns,
+               'fingerprint': 'line' if report_changes else False}
+    done = checkpoint.resume(checkpoint_dir, paths, **options)
+    for i in done:
+        print(f'{source_files[i]} was read by an earlier run (checkpoint).')
+    if checkpoint_dir and checkpoint.available():
+        def save_checkpoint(i, check, df):
+            checkpoint.save(checkpoint_dir, i, paths[i], {'check': check},
+                            **options)
+    else:
+        save_checkpoint = None
+    print('Checking and reading all input files.','',sep='\n')
+    frames, checks = read.read_4800_files(
+        {i: path for i, path in paths.items() if i not in done},
+        max_workers=read_workers, on_read=save_checkpoint, engine=read_engine,
+        cache_dir=cache_dir, **options)
+    frames.update({i: read.read_4800(paths[i], source=i, engine=read_engine,
+                                     cache_dir=cache_dir, **options)
+                   for i in done})
+    checks.update({i: counts['check'] for i, counts in done.items()})
+    # back in source_files order, so the later file still wins the dedupe
+    frames = {i: frames[i] for i in source_files}
+    checks = {i: checks[i] for i in source_files}
+    del done, save_checkpoint
 
-# copy df into old_df
-old_df = df.copy()
-print(f'After copying df into old_df, total records in old_df = {old_df.shape[0]:,.0f}',"",sep='\n')
+    ### Plan the memory use of the output
+    # the full records are only held in memory when the final file is written,
+    #  so that is the step the planner picks the mode for
+    if append_mode == 'auto':
+        modes = ('memory', 'out_of_core') if 'polars' in read.available_engines() \
+            else ('memory',)
+        plan = memory.plan_stage(
+            {i: f'{client_path}/{file}' for i, file in source_files.items()},
+            budget=memory_budget, modes=modes,
+            rows={i: check['records'] for i, check in checks.items()})
+        print('','Memory plan for writing the final file:',
+              memory.report(plan),'',sep='\n')
+        append_mode = plan['mode']
+        del modes, plan
 
-#%%
-### Read in new data file2
-print('','New data:',sep='\n')
-# first count the number of rows in the new file.
-with open(f'{client_path}/{new_file2}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
-print()
-print(f'''The new file, {new_file2},
-located in {client_path}
-contains {num_lines:,.0f} lines including a header row.
-''')
-del num_lines
+    ### Report each input file
+    # the delimiter check, row count and dates of the old file and each new
+    #  file, in source_files order
+    date_stats = {}
+    for i, file in source_files.items():
+        check = checks[i]
+        print('',f"{'Old' if i == 0 else 'New'} data:",sep='\n')
+        print()
+        print(f"The {'old' if i == 0 else 'new'} file, {file},",
+              f'located in {client_path}',
+              f"contains {check['lines']:,.0f} lines including a header row.",
+              '',sep='\n')
+        print(validate.report(check),'',sep='\n')
+        print(f'Total records imported from {file} = {frames[i].shape[0]:,.0f}',"",sep='\n')
+        # the file's date statistics are kept to report the final data
+        date_stats[i] = dates.date_stats(frames[i]['DISDATE'])
+        print('-'*27,'Date distribution:',
+              dates.describe_stats(date_stats[i]),'',sep='\n')
+    del check
 
-new_df = pd.read_csv(f'{client_path}/{new_file2}', sep='|', dtype=str)
-print(f'Total records in new_df = {new_df.shape[0]:,.0f}',"",sep='\n')
-print()
+    ### Combine all files and check for and drop duplicates
+    # The files are concatenated once and the PCNs hashed once, the later
+    #  file winning, so each new file costs its own size and not a copy of
+    #  the whole history (only the old records in the new files' discharge
+    #  months are checked with overlap_window)
+    # The merged records are checkpointed with the merge counts, so a run
+    #  that stops after the merge does not merge again.
+    records_in = {i: frame.shape[0] for i, frame in frames.items()}
+    old_records = frames[0]
+    state = checkpoint.load_state(checkpoint_dir, paths, **options)
+    if state is None:
+        df, dups = append.merge_append(frames, 'PCN', window=overlap_window)
+        dups['dropped_stats'] = dates.date_stats(
+            dups.pop('dropped_rows')['DISDATE'])
+        if checkpoint_dir and checkpoint.available():
+            checkpoint.save_state(checkpoint_dir, paths, df, dups, **options)
+    else:
+        print('The files were merged by an earlier run (checkpoint).')
+        df, dups = state
+    del frames, paths, options, state
+    dupe_count = dups['count']
+    # the final dates are those of the files less the duplicates dropped
+    date_stats = dates.remove_stats(
+        dates.merge_stats(*date_stats.values()), dups['dropped_stats'])
+    print('','Checking for duplicate records:',
+          f'   {dupe_count:,} duplicate PCNs',
+          f"   in {dups['window_rows']:,} records checked"
+          + (f" from {dups['first']:%m/%d/%Y} to {dups['last']:%m/%d/%Y}"
+             if dups['first'] is not None else ''),
+          sep='\n')
+    print('',f'Dropping {dupe_count:,} duplicates of PCN, keeping last','',sep='\n')
+    # Winner matrix: each row of df keeps its source file id in the 2 byte
+    #  _SOURCE column through the concat and dedupe, so the records each
+    #  file contributed and replaced can be counted.  Rows are the winning
+    #  file, columns the file whose record was replaced.
+    names = {i: os.path.basename(file) for i, file in source_files.items()}
+    winners = dups['winners'].rename(index=names, columns=names)
+    winners.insert(0, 'records', pd.Series(records_in).rename(names))
+    winners.insert(1, 'kept', dups['kept'].rename(names))
+    winners.insert(2, 'replaced', dups['dropped'].rename(names))
+    print('Records kept and replaced by source file (the file columns count',
+          ' the records of that file each row file replaced):',
+          winners.to_string(),'',sep='\n')
+    # every surviving record traced back to its source file
+    sources = df[read.SOURCE_COLUMN].value_counts().reindex(dups['kept'].index,
+                                                            fill_value=0)
+    print('Provenance QA Check Passed? ', (sources == dups['kept']).all())
+    print()
+    del dups, names, winners, sources
+    print(f'Total records in df = {df.shape[0]:,.0f}')
 
-### Report date distributions for the old & new data
-print('','','-'*27,'Date distribution of previous data:',
-      pd.to_datetime(old_df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      '','','-'*27,'Date distribution of new data:',
-      pd.to_datetime(new_df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      sep='\n')
-
-### Combine old & new
-df = pd.concat([old_df, new_df], ignore_index=True, sort=False)
-
-### Check for and drop duplicates
-dupe_count = df.duplicated(subset="PCN").sum()
-print('','Checking for duplicate records:',
-      f'   {df.duplicated(subset="PCN").sum():,} duplicate PCNs',
-      sep='\n')
-print('',f'Dropping {df.duplicated(subset="PCN").sum():,} duplicates of PCN, keeping last','',sep='\n')
-df.drop_duplicates(subset="PCN", keep='last', inplace=True)
-# QA check new file 2
-print(f'Total records in df = {df.shape[0]:,.0f}')
-print('\nRecord Count QA Check - file2:')
-print('Subsetted previous file record count: ', len(old_df))
-print('New file record count: ', len(new_df))
-print('Total dupes to remove: ',dupe_count)
-print('Final file record count: ', len(df))
-print('QA Check Passed? ', len(df)==len(old_df)+len(new_df)-dupe_count)
-print()
+    ### Changes against the old file
+    # the new files' records that won the dedupe are matched to the old
+    #  file's record with the same PCN on their raw line fingerprints, and
+    #  only the updated records are read in full for their changed fields.
+    #  In memory mode the rest of df's columns are read in the same pass,
+    #  so each source file is parsed once for both.
+    if report_changes:
+        new_records = df[df[read.SOURCE_COLUMN].to_numpy() != 0]
+        changed = diff.compare(old_records, new_records, 'PCN')
+        print('','Changes in the new files against the old file:',
+              changed['counts'].to_string(),'',sep='\n')
+        paths = {i: f'{client_path}/{file}' for i, file in source_files.items()}
+        updated = [old_records.take(changed['old_positions'][changed['updated']]),
+                   new_records[changed['updated']]]
+        if append_mode == 'memory':
+            print('Adding the rest of the 4800 columns from the source files.','',sep='\n')
+            old_updated, new_updated, df = read.fill_4800_frames(
+                updated + [df], paths, engine=read_engine, categorical=True,
+                cache_dir=cache_dir)
+        else:
+            old_updated, new_updated = read.fill_4800_frames(
+                updated, paths, engine=read_engine, cache_dir=cache_dir)
+        deltas = diff.field_deltas(old_updated, new_updated)
+        if len(deltas):
+            print('The number of updated records by changed field is:',
+                  deltas.groupby('FIELD', sort=False)['PCN'].count().to_string(),
+                  '',sep='\n')
+        if changes_file:
+            print(f'Writing the changes to {changes_file}.','',sep='\n')
+            diff.changes(new_records, changed, deltas).to_csv(
+                f'{client_path}/{changes_file}', index=False, sep='|',
+                na_rep='', compression=compress.csv_compression(changes_file))
+        del new_records, changed, paths, updated, old_updated, new_updated, deltas
+    del old_records
 
-# copy df into old_df
-old_df = df.copy()
-print(f'After copying df into old_df, total records in old_df = {old_df.shape[0]:,.0f}',"",sep='\n')
+    ### Report date distributions for final df data
+    # from the running date statistics, without converting df's dates again
+    print('','','-'*27,'Date distribution of final data:',
+          dates.describe_stats(date_stats),
+          '','The number of records by discharge month is:',
+          dates.month_counts(date_stats).to_string(),
+          sep='\n')
+    del date_stats
 #%%
-### Read in new data file3
-print('','New data:',sep='\n')
-# first count the number of rows in the new file.
-with open(f'{client_path}/{new_file3}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
-print()
-print(f'''The new file, {new_file3},
-located in {client_path}
-contains {num_lines:,.0f} lines including a header row.
-''')
-del num_lines
+    ### Output
+    # sort the df by DISDATE - by date, not by the MMDDYYYY string, with a
+    #  linear sort on the day numbers (see dates_helper_scripts.sort_order)
+    print('Sorting df by DISDATE.','',sep='\n')
+    df = df.take(dates.sort_order(df['DISDATE']))
 
-new_df = pd.read_csv(f'{client_path}/{new_file3}', sep='|', dtype=str)
-print(f'Total records in new_df = {new_df.shape[0]:,.0f}',"",sep='\n')
-print()
+    if append_mode == 'out_of_core':
+        # stream the full records of the surviving rows straight from the
+        #  source files to the final file
+        print('Exporting the full records of df to a 4800 pipe-delimited text',
+              'file out-of-core with polars.',sep='\n')
+        read.sink_4800(df, {i: f'{client_path}/{file}'
+                            for i, file in source_files.items()},
+                       f'{client_path}/{final_file}')
+    else:
+        # read the columns that were not used above for the surviving rows,
+        #  unless they were read with the updated records.  The code columns
+        #  are held as categoricals, about a third of the memory of strings,
+        #  and turned back into strings for the export.
+        if read.SOURCE_COLUMN in df.columns:
+            print('Adding the rest of the 4800 columns from the source files.','',sep='\n')
+            df = read.fill_4800(df, {i: f'{client_path}/{file}'
+                                     for i, file in source_files.items()},
+                                engine=read_engine, categorical=True,
+                                cache_dir=cache_dir)
 
-### Report date distributions for the old & new data
-print('','','-'*27,'Date distribution of previous data:',
-      pd.to_datetime(old_df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      '','','-'*27,'Date distribution of new data:',
-      pd.to_datetime(new_df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      sep='\n')
-
-### Combine old & new
-df = pd.concat([old_df, new_df], ignore_index=True, sort=False)
-
-### Check for and drop duplicates
-dupe_count = df.duplicated(subset="PCN").sum()
-print('','Checking for duplicate records:',
-      f'   {df.duplicated(subset="PCN").sum():,} duplicate PCNs',
-      sep='\n')
-print('',f'Dropping {df.duplicated(subset="PCN").sum():,} duplicates of PCN, keeping last','',sep='\n')
-df.drop_duplicates(subset="PCN", keep='last', inplace=True)
-# QA check new file 3
-print(f'Total records in df = {df.shape[0]:,.0f}')
-print('\nRecord Count QA Check - file3:')
-print('Subsetted previous file record count: ', len(old_df))
-print('New file record count: ', len(new_df))
-print('Total dupes to remove: ',dupe_count)
-print('Final file record count: ', len(df))
-print('QA Check Passed? ', len(df)==len(old_df)+len(new_df)-dupe_count)
-print()
-
-### Report date distributions for final df data
-print('','','-'*27,'Date distribution of final data:',
-      pd.to_datetime(df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      sep='\n')
-#%%
-### Output
-# sort the df by DISDATE
-print('Sorting df by DISDATE.','',sep='\n')
-df = df.sort_values('DISDATE')
-
-# export the final file
-print('Exporting df to a 4800 pipe-delimited text file.')
-df.to_csv(f'{client_path}/{final_file}', index=False, sep='|', na_rep='')
+        # export the final file
+        print('Exporting df to a 4800 pipe-delimited text file.')
+        # a final_file ending in .gz or .zst is written compressed
+        df = layout.decategorize(df)
+        df.to_csv(f'{client_path}/{final_file}', index=False, sep='|', na_rep='',
+                  compression=compress.csv_compression(final_file))
 print()
 # now count the number of rows in the exported 4800 new file.
-with open(f'{client_path}/{final_file}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
+num_lines = validate.scan_pipe_file(f'{client_path}/{final_file}')['lines']
 print()
 print(f'''Using df, the pipe-delimited text file, {final_file},
 located in {client_path}
@@ -236,16 +437,40 @@ has been created and contains {num_lines:,g} lines including a header row.
 Check the file visually before using.''')
 del num_lines
 print()
+
+# index the final file for PCN spot checks and keep-last audits, e.g.
+#  lookup.fetch(f'{client_path}/{final_file}', ['<PCN>'])
+if build_offset_index:
+    num_indexed = lookup.build_index(f'{client_path}/{final_file}')
+    print(f'PCN offset index {lookup.index_path(final_file)} was built for '
+          f'{num_indexed:,g} records.')
+    del num_indexed
+print()
+# the run finished, so the checkpoints are not needed again
+if checkpoint.clear(checkpoint_dir):
+    print(f'The append checkpoints in {checkpoint_dir} were deleted.')
 print()
 print("The temporary FirstHealth concatenation program is complete.")
 
 
-print('\n\nRecord Count QA Check:')
-print('Subsetted previous file record count: ', len(old_df))
-print('New file record count: ', len(new_df))
-print('Total dupes to remove: ',dupe_count)
-print('Final file record count: ', len(df))
-print('QA Check Passed? ', len(df)==len(old_df)+len(new_df)-dupe_count)
+if append_mode in ('passthrough', 'store'):
+    num_lines = validate.scan_pipe_file(f'{client_path}/{final_file}')['records']
+    print('\n\nRecord Count QA Check:')
+    if append_mode == 'passthrough':
+        print('Input file record count: ', records_in)
+    print('Records written: ', records_out)
+    print('Final file record count: ', num_lines)
+    print('QA Check Passed? ', num_lines==records_out)
+    del num_lines
+else:
+    print('\n\nRecord Count QA Check:')
+    print('Previous file record count: ', records_in[0])
+    print('New files record count: ', sum(records_in.values()) - records_in[0])
+    print('Total dupes to remove: ',dupe_count)
+    print('Final file record count: ', len(df))
+    print('QA Check Passed? ', len(df)==sum(records_in.values())-dupe_count)
+print()
+print(cache.summary())
 
 ### End the log
 log.printLogCloser()
@@ -23,6 +23,13 @@ import shutil
 import win32com.client
 import pandas as pd
 import datetime
+import collections
+import layout_helper_scripts as layout
+import read_helper_scripts as read
+import cache_helper_scripts as cache
+import memory_helper_scripts as memory
+import dates_helper_scripts as dates
+import dedupe_helper_scripts as dedupe
 
 
 # 1. set the working directories, import files and export file variables
@@ -48,6 +55,28 @@ file_accdb = '4800.accdb'
 # variable for adding HCO name to 4800
 hosp_name = 'Prime'
 
+# csv parser engine for reading 4800 files: 'c' (pandas), 'pyarrow' or
+#  'polars'. pyarrow and polars read on all cores if they are installed.
+read_engine = 'c'
+
+# parsed file cache folder: a file already parsed by any program is
+#  loaded from here instead of parsed again (needs pyarrow).  The entries
+#  hold PHI, so the ones not used for a month are deleted (see
+#  cache_helper_scripts.py).  Set to None to turn the cache off.
+cache_dir = 'C:/PHI/Projects/CQD/ParsedFileCache'
+
+# memory the DQR may use in bytes (e.g. 8 * 2**30 for 8 GB), None for half
+#  of the memory free when the program starts.  The DQR only runs in
+#  memory, so the planner logs the estimate and warns when it is over.
+memory_budget = None
+
+# 4800 columns this program uses - only these are read from the 4800.
+#  The 100 REVCOD/CHARGE detail charge columns, SPTTYPE, ZIP and CONMD1-3
+#  are never used by the DQR so they are not parsed.
+dqr_columns = ([c for c in layout.ATTRIBUTE_COLUMNS_4800
+                if c not in ['SPTTYPE', 'ZIP', 'CONMD1', 'CONMD2', 'CONMD3']]
+               + layout.DX_COLUMNS_4800 + layout.PX_COLUMNS_4800)
+
 # Start off with some good log information...
 start_time=datetime.datetime.now()
 
@@ -158,15 +187,28 @@ print('*'*80,'',sep='\n')
 
 
 # 2a. Read in the client submitted 4800 file into df4800 & check quality.
-#  Read in only col 1 thru 164 - excludes detail charges
+#  Read in only the dqr_columns - excludes detail charges
 print(f'Importing {path_src}/{file_orig} to df4800.','',sep='\n')
-df4800 = pd.read_csv(f"{path_src}/{file_orig}", sep='|', dtype=str)
+# estimate the memory df4800 and its melted dx/px dfs need before reading
+plan = memory.plan_stage(f"{path_src}/{file_orig}", budget=memory_budget,
+                         usecols=dqr_columns)
+print(memory.report(plan),'',sep='\n')
+del plan
+#  the 4800 code columns are held as categoricals (categorical=True), about
+#  a third of the memory of strings for a fifth more read time (see
+#  layout_helper_scripts.py).  They are turned back into strings with
+#  layout.decategorize before blanks are filled in and the rows inserted.
+# each record gets a _FINGERPRINT hash of its whole raw line (fingerprint=
+#  'line'), so the FULL duplicate check in 2b is on every column like the
+#  full read it replaces, not only on the dqr_columns
+df4800 = read.read_4800(f"{path_src}/{file_orig}", engine=read_engine,
+                        usecols=dqr_columns, cache_dir=cache_dir,
+                        fingerprint='line', categorical=True)
 
 print(f'{df4800.shape[0]:,g} records were imported into df4800.', '', sep='\n')
 # Report date distributions for new data
 print('-'*27, 'Date distribution of df4800:',
-    pd.to_datetime(df4800['DISDATE'], 
-    format='%m%d%Y').describe(datetime_is_numeric=True), '', sep='\n')
+    dates.describe(df4800['DISDATE']), '', sep='\n')
 # List the column names for log and checking
 print('''Use this df4800 info report to check distributins by field.
 Total records should be the same for PROVNUM, PCN, MRN, ADMDATE, DISDATE, TOTALCLM, DOB
@@ -185,20 +227,28 @@ print(f'{df4800.shape[0]:,g} records remain in df4800.', '', sep='\n')
 
 
 # 2b. Check for duplicate PCNs in df4800 as there should be none.
-#  If dups are found, then df4800 is dedupped
-dup_count = df4800.duplicated(subset=["PROVNUM", "PCN"]).sum()
+#  If dups are found, then df4800 is dedupped.  FULL duplicates are judged
+#  on the _FINGERPRINT hash of the whole raw line, so on every column and
+#  not only the dqr_columns that were read, and only for the rows with a
+#  repeated PROVNUM/PCN as a FULL duplicate is also a key duplicate.
+dups = dedupe.find_duplicates(df4800, ["PROVNUM", "PCN"])
+dup_count = dups['count']
 print()
 print('Checking for duplicate PCNs per PROVNUM in df4800')
 if dup_count > 0:
     print(f'df4800 has {dup_count} duplicates')
+    full_dups = dedupe.find_duplicates(df4800, dedupe.FINGERPRINT_COLUMN,
+                                       rows=dups['repeated'])
     print(
-        '', f'Dropping {df4800.duplicated().sum():,} FULL duplicates', sep='\n')
-    df4800.drop_duplicates(inplace=True)
+        '', f'Dropping {full_dups["count"]:,} FULL duplicates', sep='\n')
+    df4800 = dedupe.drop(df4800, full_dups)
+    del full_dups
     print(
         f'df4800 contains {df4800.shape[0]:,g} records after dedupping.', sep='\n')
 else:
     print(f'There were {dup_count} duplicates in df4800 which is expected.')
-del dup_count  # removing the variable after if function finishes
+del dup_count, dups  # removing the variables after if function finishes
+df4800.drop(columns=dedupe.FINGERPRINT_COLUMN, inplace=True)
 print()
 
 
@@ -219,10 +269,10 @@ for field in FieldToPrint:
     print()
 
 #  2e. Replace POA values of 'E' with '1' in all dx poa fields.
-df4800['PRDIAGPOA'] = df4800['PRDIAGPOA'].replace('E', '1', regex=False)
+df4800['PRDIAGPOA'] = layout.recode(df4800['PRDIAGPOA'], {'E': '1'})
 for i in range(1, 41):
-    df4800['SECDX'+str(i)+'POA'] = df4800['SECDX'+str(i) +
-                                          'POA'].replace('E', '1', regex=False)
+    df4800['SECDX'+str(i)+'POA'] = layout.recode(
+        df4800['SECDX'+str(i)+'POA'], {'E': '1'})
 del i  # removing the variable after loop finishes
 print('The PDX and SecDX POA E values have been replaced with 1.', '', sep='\n')
 
@@ -232,7 +282,8 @@ df4800['Facility Name'] = hosp_name
 
 
 #  final df4800 info check
-print('df4800 is now 4800 compliant. Should see 266 columns.', '', sep='\n')
+print(f'df4800 is now 4800 compliant. Should see {len(dqr_columns) + 1} '
+      'columns.', '', sep='\n')
 print(df4800.info(), '', sep='\n')
 print('df4800 sample output:')
 print(df4800.head(), '', sep='\n')
@@ -306,8 +357,9 @@ attrb_pairs = [
 dfAttributes = []
 
 for fac, code, title, attribute in attrb_pairs:
+    # observed=True so only code combinations present in the data are kept
     dfAttribute = df4800.groupby([fac, 
-             code, title]).size().reset_index(name='Cases')
+             code, title], observed=True).size().reset_index(name='Cases')
     total_count = dfAttribute['Cases'].sum()
     dfAttribute['Percent of Cases'] = (dfAttribute['Cases'] / total_count) * 100
     dfAttribute['Attribute'] = attribute
@@ -320,7 +372,7 @@ for fac, code, title, attribute in attrb_pairs:
 # Concatenate all aggregated dataframes
 dfAttributeFinal = pd.concat(dfAttributes, ignore_index=True)
 # replace NaN values with blanks
-dfAttributeFinal = dfAttributeFinal.fillna('')
+dfAttributeFinal = layout.decategorize(dfAttributeFinal).fillna('')
 
 # 2g. Read in the client submitted ref_phy file into dfPhy & check contents.
 print(f'Importing {path_src}/{file_phy} to dfPhy.','',sep='\n')
@@ -374,7 +426,16 @@ dfDisch = dfDisch.rename(columns={
 #  Apply field formats and create additional fields needed for Access tables.
 print('Updating date fields and creating Year, Quarter and Month fields.','',sep='\n')
 date_columns = ['ADMDATE', 'DISDATE', 'DOB']
-dfDisch[date_columns] = dfDisch[date_columns].apply(pd.to_datetime, format='%m%d%Y')
+# LOS and age in days are worked out on the day numbers of the MMDDYYYY
+#  dates before the columns are turned into datetimes
+los = dates.days_between(dfDisch['ADMDATE'], dfDisch['DISDATE'])
+age_in_days = dates.days_between(dfDisch['DOB'], dfDisch['ADMDATE'])
+for col in date_columns:
+    date_counts = collections.Counter()
+    dfDisch[col] = dates.to_datetime(dfDisch[col], date_counts)
+    print(f"{col}: {date_counts['invalid']:,} invalid dates set to null")
+print()
+del col, date_counts
 dfDisch['Disch_Year'] = dfDisch['DISDATE'].dt.year
 dfDisch['Disch_Qtr'] = dfDisch['DISDATE'].dt.quarter
 dfDisch['Disch_Month'] = dfDisch['DISDATE'].dt.month
@@ -390,7 +451,7 @@ num_nulls = dfDisch['ADMDATE'].isnull().sum()
 print(f'The number of null values in date_column is {num_nulls}')
 
 # create LOS column and handle zero values
-dfDisch['LOS'] = (dfDisch['DISDATE'] - dfDisch['ADMDATE']).dt.days
+dfDisch['LOS'] = los
 # Count the number of occurrences that are 0
 LOS_zero = dfDisch['LOS'].eq(0).sum()
 # Print the count
@@ -404,7 +465,8 @@ print('changed records witha nzero LOS to a LOS of 1.')
 print(f'There are now {LOS_zero1} records with a zero LOS.','',sep='\n')
 
 #create age columns
-dfDisch['AGE_IN_DAYS'] = (dfDisch['ADMDATE'] - dfDisch['DOB']).dt.days
+dfDisch['AGE_IN_DAYS'] = age_in_days
+del los, age_in_days
 dfDisch['AGE_IN_YEARS'] = dfDisch['AGE_IN_DAYS']/365.25
 
 # create date check flags
@@ -418,7 +480,8 @@ dfDisch['Disch_Date_Null'] = dfDisch['DISDATE'].isnull().astype(int)
 dfDisch['Died'] = (dfDisch['STATUS'] == '20').astype(int)
 
 # replace NaN values with blank values
-dfDisch = dfDisch.fillna('')
+#  any categorical code columns are turned back into strings first
+dfDisch = layout.decategorize(dfDisch).fillna('')
 
 num_nulls = df[''].isnull().sum()
 print(f'The number of null values in date_column is {num_nulls}')
@@ -605,7 +668,7 @@ print('Expect smaller numbers as the seq number increases.')
 print(dfDxFinal.groupby(['DX Seq'])['PROVNUM'].count(), '', sep='\n')
 
 # format DISDATE to date
-dfDxFinal['DISDATE'] = pd.to_datetime(dfDxFinal['DISDATE'], format='%m%d%Y')
+dfDxFinal['DISDATE'] = dates.to_datetime(dfDxFinal['DISDATE'])
 
 # Rename some columns to match the target Access table TEMP_DX
 dfDxFinal = dfDxFinal.rename(columns={
@@ -614,6 +677,7 @@ dfDxFinal = dfDxFinal.rename(columns={
     'DX POA': 'POA'})
 
 # replace NaN values with blank values
+dfDxFinal = layout.decategorize(dfDxFinal)
 dfDxFinal['POA'] = dfDxFinal['POA'].fillna('')
 
 print('dfDxFinal info after a few col name changes:')
@@ -799,9 +863,9 @@ if null_px_date_count > 0:
 print(dfPxFinal['PX Date'].isnull().sum())
 
 # format date fields from text tp dates
-dfPxFinal['DISDATE'] = pd.to_datetime(dfPxFinal['DISDATE'], format='%m%d%Y')
-dfPxFinal['ADMDATE'] = pd.to_datetime(dfPxFinal['ADMDATE'], format='%m%d%Y')
-dfPxFinal['PX Date'] = pd.to_datetime(dfPxFinal['PX Date'], format='%m%d%Y')
+dfPxFinal['DISDATE'] = dates.to_datetime(dfPxFinal['DISDATE'])
+dfPxFinal['ADMDATE'] = dates.to_datetime(dfPxFinal['ADMDATE'])
+dfPxFinal['PX Date'] = dates.to_datetime(dfPxFinal['PX Date'])
 # dfPxFinal['PX Date'] = dfPxFinal['PX Date'].replace(pd.NaT, None)
 # dfPxFinal['PX Date'] = dfPxFinal['PX Date'].fillna(value=None)
 
@@ -814,6 +878,7 @@ dfPxFinal = dfPxFinal.rename(columns={
     'PX Date': 'PX_DATE'})
 
 # replace NaN values with blank values
+dfPxFinal = layout.decategorize(dfPxFinal)
 dfPxFinal['PX_DATE'] = dfPxFinal['PX_DATE'].fillna('')
 
 
@@ -877,6 +942,8 @@ for table, df, dfname in tables_and_dfs:
     print(f'The number of rows inserted into {table} is {num_rows:,g}')
     print()
 
+print(cache.summary(),'',sep='\n')
+
 # Close the cursor and connection
 print('Closing the cursor connection and the 4800_Python.accdb db.')
 cursor.close()
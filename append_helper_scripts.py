@@ -0,0 +1,288 @@
+##############################################################################
+# 4800 append helper scripts
+# @author: Jim Cheairs
+
+# Appends monthly 4800 files to a history file with "later file wins" on
+#  PCN, the same result as concatenating the files and dropping duplicate
+#  PCNs with keep='last'.
+#  passthrough_append - never parses a record.  It collects the PCNs of the
+#   new files, then copies the old file line by line as raw bytes, leaving
+#   out only the lines a later file replaces, and then copies the new
+#   files the same way.  Memory holds the new files' PCNs only, and the run
+#   time is close to a file copy.  Records keep their file order (old
+#   records first), they are not sorted by DISDATE.
+#  sort_file - external merge sort of a 4800 file by DISDATE (e.g. the
+#   passthrough output) in bounded memory: sorted runs of raw lines are
+#   written to temp files and merged.
+#  Every file must have the same header.  Records are found line by line,
+#  so this is for 4800 files written by these programs (no quoted line
+#  breaks inside a field).
+#  merge_append - the in-memory keep-last append of any number of files in
+#   one concat and one hash pass.  The monthly files overlap by a month,
+#   so the PCN duplicates of the history are only looked for in the
+#   discharge months the new files cover; older rows pass straight
+#   through.  That assumes a resubmitted encounter keeps its discharge
+#   month.
+#
+# Import from a program in the same folder with:
+#   import append_helper_scripts as append
+##############################################################################
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import compress_helper_scripts as compress
+import dates_helper_scripts as dates
+import dedupe_helper_scripts as dedupe
+import layout_helper_scripts as layout
+
+
+def _tmp_path(path):
+    # a temp file next to path, with path's compression extension
+    ext = os.path.splitext(path)[1] if compress.compression_of(path) else ''
+    return f'{path}.{os.getpid()}.tmp{ext}'
+
+
+def _key_position(header, key, encoding):
+    columns = header.rstrip(b'\r\n').decode(encoding).split('|')
+    return columns.index(key)
+
+
+def read_keys(path, key='PCN', encoding='utf-8'):
+    """Return the header line and the key field of every record of a file.
+
+    The keys are the raw bytes of the field, in file order.  Blank lines
+    are not records.
+    """
+    with compress.open_binary(path) as fp:
+        header = fp.readline()
+        pos = _key_position(header, key, encoding)
+        keys = [line.split(b'|', pos + 1)[pos] for line in fp
+                if line.strip()]
+    return header, keys
+
+
+def _last_occurrence(keys):
+    # True for the last line of each key in a file, like keep='last'
+    last = {key: i for i, key in enumerate(keys)}
+    keep = np.zeros(len(keys), dtype=bool)
+    keep[list(last.values())] = True
+    return keep
+
+
+def passthrough_append(paths, path_out, key='PCN', encoding='utf-8'):
+    """Write the keep-last append of 4800 files without parsing them.
+
+    paths maps a source id to a file, in "later file wins" order, with the
+    old (history) file first.  A record is written unless a later file
+    has its key, or the same file has the key again further down.  The
+    old file's repeated keys are not looked for (that would hold all its
+    keys in memory), as it was deduped when it was written.  The header
+    is the old file's.  A .gz / .zst path_out is written compressed.
+
+    Returns a dict keyed by source id with records, duplicates (records
+    replaced later in the same file), superseded (records replaced by a
+    later file) and written counts.
+    """
+    sources = list(paths)
+    stats = {source: {} for source in sources}
+
+    with compress.open_binary(paths[sources[0]]) as fp:
+        old_header = fp.readline()
+
+    # the records to keep in each new file, from the last file back
+    later = set()
+    keep = {}
+    for source in reversed(sources[1:]):
+        header, keys = read_keys(paths[source], key, encoding)
+        if header.rstrip(b'\r\n') != old_header.rstrip(b'\r\n'):
+            raise ValueError(f'{paths[source]} does not have the same header '
+                             f'as {paths[sources[0]]}, append them in memory '
+                             f'instead.')
+        in_later = np.fromiter((k in later for k in keys), dtype=bool,
+                               count=len(keys))
+        last = _last_occurrence(keys)
+        keep[source] = last & ~in_later
+        stats[source] = {'records': len(keys),
+                         'duplicates': int((~last).sum()),
+                         'superseded': int((last & in_later).sum()),
+                         'written': int(keep[source].sum())}
+        later.update(keys)
+        del keys
+
+    tmp_path = _tmp_path(path_out)
+    with compress.open_binary(tmp_path, 'wb') as out:
+        # the old file - only its superseded lines are left out
+        with compress.open_binary(paths[sources[0]]) as fp:
+            fp.readline()
+            pos = _key_position(old_header, key, encoding)
+            out.write(old_header)
+            records = superseded = 0
+            for line in fp:
+                if not line.strip():
+                    continue
+                records += 1
+                if line.split(b'|', pos + 1)[pos] in later:
+                    superseded += 1
+                    continue
+                out.write(line if line.endswith(b'\n') else line + b'\n')
+        stats[sources[0]] = {'records': records, 'duplicates': 0,
+                             'superseded': superseded,
+                             'written': records - superseded}
+        del later
+
+        # then the new files, in order
+        for source in sources[1:]:
+            with compress.open_binary(paths[source]) as fp:
+                fp.readline()
+                wanted = iter(keep[source])
+                for line in fp:
+                    if line.strip() and next(wanted):
+                        out.write(line if line.endswith(b'\n')
+                                  else line + b'\n')
+    os.replace(tmp_path, path_out)
+    return stats
+
+
+def month_window(series):
+    """Return the first and last day numbers of the months a date column covers.
+
+    series is a MMDDYYYY date column.  None when it has no valid date.
+    """
+    days = dates.day_ordinals(series)
+    days = days[days != dates.NULL_DAY]
+    if not len(days):
+        return None
+    first = days.min().astype('datetime64[D]').astype('datetime64[M]')
+    last = days.max().astype('datetime64[D]').astype('datetime64[M]') + 1
+    return (int(first.astype('datetime64[D]').astype(np.int64)),
+            int(last.astype('datetime64[D]').astype(np.int64)) - 1)
+
+
+def merge_append(frames, key='PCN', date='DISDATE', window=True):
+    """Append any number of dfs with keep-last on key in one pass.
+
+    frames maps a source id to a df, in "later file wins" order with the
+    old (history) df first.  The dfs are concatenated once and their keys
+    hashed once, so the work grows with the total rows and not with the
+    history times the number of files.  The same rows and order as
+    concatenating and dropping duplicates of key with keep='last'.
+    With window only the old df's rows with a date in the months the new
+    dfs cover (or no valid date) are checked; window=False checks them all.
+
+    Returns the df and a dict with count (duplicates dropped), dropped (a
+    Series of the duplicates dropped from each source), kept (a Series of
+    the records each source contributed), winners (a df of the records
+    each source, the rows, replaced in each source, the columns - the
+    diagonal is duplicates inside a file), dropped_rows (the records
+    dropped), window_rows (rows checked) and first / last (the window as
+    Timestamps, None when every row was checked).
+    """
+    sources = list(frames)
+    sizes = [len(frames[source]) for source in sources]
+    df = layout.concat_4800([frames[source] for source in sources])
+    spans = [month_window(frames[source][date]) for source in sources[1:]] \
+        if window else [None]
+    if None in spans or not spans:
+        span = rows = None
+    else:
+        # the new files are consecutive months, so one window covers them
+        span = (min(first for first, last in spans),
+                max(last for first, last in spans))
+        old_days = dates.day_ordinals(frames[sources[0]][date])
+        rows = np.concatenate([
+            ((old_days >= span[0]) & (old_days <= span[1]))
+            | (old_days == dates.NULL_DAY),
+            np.ones(len(df) - sizes[0], dtype=bool)])
+    dups = dedupe.find_duplicates(df, key, keep='last', rows=rows)
+    source_of = np.repeat(np.arange(len(sources)), sizes)
+    dropped = np.bincount(source_of[dups['mask']], minlength=len(sources))
+
+    # the source of the record that replaced each dropped one: the kept
+    #  record with its key among the rows checked
+    checked = np.arange(len(df)) if rows is None else np.flatnonzero(rows)
+    checked_mask = dups['mask'][checked]
+    checked_source = source_of[checked]
+    winner_at = pd.Index(dups['hashes'][~checked_mask]).get_indexer(
+        dups['hashes'][checked_mask])
+    winners = np.zeros((len(sources), len(sources)), dtype=np.int64)
+    np.add.at(winners, (checked_source[~checked_mask][winner_at],
+                        checked_source[checked_mask]), 1)
+
+    stats = {'count': dups['count'],
+             'dropped': pd.Series(dropped, index=sources),
+             'kept': pd.Series(np.array(sizes) - dropped, index=sources),
+             'winners': pd.DataFrame(winners, index=sources, columns=sources),
+             'dropped_rows': df.take(np.flatnonzero(dups['mask'])),
+             'window_rows': len(df) if rows is None else int(rows.sum()),
+             'first': None, 'last': None}
+    if span is not None:
+        stats['first'], stats['last'] = (
+            pd.Timestamp(np.datetime64(day, 'D')) for day in span)
+    return dedupe.drop(df, dups), stats
+
+
+# run file lines start with an 8 digit key that sorts by date, nulls last
+_KEY_WIDTH = 8
+_NULL_KEY = 10 ** _KEY_WIDTH - 1
+_KEY_OFFSET = 1_000_000
+
+
+def sort_file(path, date='DISDATE', chunksize=1_000_000, encoding='utf-8'):
+    """Sort a 4800 file by a MMDDYYYY date field in place, in bounded memory.
+
+    An external merge sort: chunksize records at a time are ordered with
+    dates.order_days and written as a run to a temp file next to path,
+    then the runs are merged.  Memory holds one chunk of raw lines.  The
+    sort is stable with null and invalid dates last, and the records are
+    not parsed, so they are written back byte for byte.  A .gz / .zst
+    path stays compressed.  Returns the number of records and of runs.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='sort_4800_',
+                               dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        run_paths = []
+        with compress.open_binary(path) as fp:
+            header = fp.readline()
+            pos = _key_position(header, date, encoding)
+            records = 0
+            while True:
+                lines = [line if line.endswith(b'\n') else line + b'\n'
+                         for line in itertools.islice(fp, chunksize)
+                         if line.strip()]
+                if not lines:
+                    break
+                days = dates.decode_mmddyyyy(
+                    [line.split(b'|', pos + 1)[pos].decode(encoding)
+                     for line in lines])
+                keys = np.where(days == dates.NULL_DAY, _NULL_KEY,
+                                days.astype(np.int64) + _KEY_OFFSET)
+                run_path = os.path.join(tmp_dir, f'run_{len(run_paths):05d}')
+                with open(run_path, 'wb') as out:
+                    for i in dates.order_days(days):
+                        out.write(b'%08d' % keys[i] + lines[i])
+                run_paths.append(run_path)
+                records += len(lines)
+                del lines, days, keys
+
+        # merge the runs, a run ahead of a later one on equal keys
+        runs = [open(run_path, 'rb') for run_path in run_paths]
+        try:
+            tmp_path = _tmp_path(path)
+            with compress.open_binary(tmp_path, 'wb') as out:
+                out.write(header)
+                for line in heapq.merge(*runs,
+                                        key=lambda line: line[:_KEY_WIDTH]):
+                    out.write(line[_KEY_WIDTH:])
+        finally:
+            for fp in runs:
+                fp.close()
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {'records': records, 'runs': len(run_paths)}
@@ -0,0 +1,246 @@
+##############################################################################
+# Parsed file cache helper scripts
+# @author: Jim Cheairs
+
+# Columnar cache of parsed pipe files, used by read_helper_scripts.read_4800.
+#  Each parsed df is saved once as an uncompressed Arrow IPC (feather) file
+#  and later reads of the same file load it instead of a full text parse.
+#  The file is memory mapped while it is read, but the columns are copied
+#  into the df (to_pandas), so a loaded df takes the same memory as a
+#  parsed one.  Categorical code columns are stored as Arrow dictionaries
+#  so they come back as the same categoricals.
+#  The cache is content addressed: an entry is named by a hash of the file
+#  contents and the read options.  A small index maps path, size and mtime
+#  to the content hash so an unchanged file is not hashed again, and a
+#  file that is copied or renamed still hits its old entry.
+#  The entries hold PHI, so they are not kept for good: prune deletes the
+#  entries not used for MAX_AGE_DAYS and the least recently used ones past
+#  MAX_BYTES, and read_cached runs it on every read.  clear deletes them
+#  all.
+#  stats counts the files loaded, parsed and pruned in this run; the
+#  programs print summary() in their log.
+#  Needs pyarrow; without it every read is a normal text parse.
+#
+# Import from a program in the same folder with:
+#   import cache_helper_scripts as cache
+##############################################################################
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# bump when a reader change alters the df returned for the same file, so
+# entries written by the old code are not loaded
+CACHE_VERSION = 1
+INDEX_FILE = 'index.json'
+# prune limits: entries not used for MAX_AGE_DAYS are deleted, then the
+#  least recently used ones until the rest fit in MAX_BYTES.  None turns a
+#  limit off.
+MAX_AGE_DAYS = 31
+MAX_BYTES = 20 * 2**30
+
+# files may be read on a thread pool, so index updates are done one at a time
+_index_lock = threading.Lock()
+
+# files loaded from the cache, parsed and stored, and entries pruned in
+#  this run, for the program's log
+stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+
+def available():
+    """Return True when pyarrow is installed and the cache can be used."""
+    try:
+        import pyarrow.feather  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def file_digest(path, block_size=1 << 20):
+    """Return a hash of a file's contents as a hex string."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _tmp_path(path):
+    # a temp file name no other process or thread is using
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def _load_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE), 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(cache_dir, index):
+    # write to a temp file and swap it in so a crash never leaves half a file
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    tmp_path = _tmp_path(index_path)
+    with open(tmp_path, 'w') as fp:
+        json.dump(index, fp, indent=1, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def content_key(path, cache_dir):
+    """Return the content hash of path, reusing the indexed one if unchanged.
+
+    The file is only hashed when its path, size or mtime is new.
+    """
+    st = os.stat(path)
+    stamp = f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}'
+    index = _load_index(cache_dir)
+    if stamp in index:
+        return index[stamp]
+    digest = file_digest(path)
+    with _index_lock:
+        # reload so entries added by other threads are kept
+        index = _load_index(cache_dir)
+        index[stamp] = digest
+        _save_index(cache_dir, index)
+    return digest
+
+
+def entry_path(path, cache_dir, **options):
+    """Return the cache file for path read with the given read options."""
+    key = json.dumps([CACHE_VERSION, sorted(options.items())], default=list)
+    options_key = hashlib.blake2b(key.encode('utf-8'),
+                                  digest_size=8).hexdigest()
+    return os.path.join(cache_dir,
+                        f'{content_key(path, cache_dir)}_{options_key}.arrow')
+
+
+def load(entry):
+    """Load a cache entry back into a df, or return None if missing."""
+    if not os.path.exists(entry):
+        return None
+    import pyarrow.feather as feather
+
+    table = feather.read_table(entry, memory_map=True)
+    df = table.to_pandas()
+    # the mtime is the last use, so prune keeps the entries still read
+    os.utime(entry)
+    return df
+
+
+def store(df, entry):
+    """Save a parsed df as a cache entry."""
+    import pyarrow.feather as feather
+
+    tmp_path = _tmp_path(entry)
+    # uncompressed so the entry is read without decoding
+    feather.write_feather(df.reset_index(drop=True), tmp_path,
+                          compression='uncompressed')
+    os.replace(tmp_path, entry)
+
+
+def _is_temp(name):
+    # an entry or index temp file left by a write that did not finish
+    return name.endswith('.tmp') and ('.arrow.' in name
+                                      or name.startswith(f'{INDEX_FILE}.'))
+
+
+def clear(cache_dir):
+    """Delete every cache entry and the index.  Returns the files removed."""
+    removed = 0
+    if not os.path.isdir(cache_dir):
+        return removed
+    for name in os.listdir(cache_dir):
+        if name.endswith('.arrow') or name == INDEX_FILE or _is_temp(name):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
+
+
+def prune(cache_dir, max_bytes=MAX_BYTES, max_age_days=MAX_AGE_DAYS):
+    """Delete the old and least recently used cache entries.
+
+    Entries not used (loaded or stored) for max_age_days are deleted, and
+    then the least recently used ones until the rest fit in max_bytes.
+    None turns a limit off.  Temp files older than max_age_days go too, and
+    the index only keeps the files of the entries left.  An entry another
+    program has open is skipped.  Returns the number of entries removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    cutoff = max_age_days is not None and time.time() - max_age_days * 86400
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if name.endswith('.arrow'):
+            entries.append((st.st_mtime, st.st_size, name))
+        elif _is_temp(name) and cutoff and st.st_mtime < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    removed = 0
+    kept_bytes = 0
+    kept = set()
+    # most recently used first
+    for mtime, size, name in sorted(entries, reverse=True):
+        if (not cutoff or mtime >= cutoff) and \
+                (max_bytes is None or kept_bytes + size <= max_bytes):
+            kept_bytes += size
+            kept.add(name.split('_')[0])
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+        except OSError:
+            kept.add(name.split('_')[0])
+    if removed:
+        with _index_lock:
+            index = _load_index(cache_dir)
+            _save_index(cache_dir, {stamp: digest for stamp, digest
+                                    in index.items() if digest in kept})
+    return removed
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        stats[name] += n
+
+
+def summary():
+    """Return this run's use of the cache as a line for the log."""
+    return (f"Parsed file cache: {stats['loaded']:,} files loaded, "
+            f"{stats['parsed']:,} parsed and stored, {stats['pruned']:,} "
+            "old entries deleted.")
+
+
+def read_cached(path, reader, cache_dir, **options):
+    """Return reader() for path, going through the cache in cache_dir.
+
+    options are the read options that change the parsed df (usecols,
+    encoding, ...) and are part of the cache key.  Without cache_dir or
+    pyarrow reader() is just called.  The entries past the prune limits
+    are then deleted, and the read is counted in stats.
+    """
+    if not cache_dir or not available():
+        return reader()
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = entry_path(path, cache_dir, **options)
+    df = load(entry)
+    if df is not None:
+        _count('loaded')
+    else:
+        df = reader()
+        store(df, entry)
+        _count('parsed')
+    _count('pruned', prune(cache_dir, MAX_BYTES, MAX_AGE_DAYS))
+    return df
@@ -0,0 +1,187 @@
+##############################################################################
+# Append checkpoint helper scripts
+# @author: Jim Cheairs
+
+# Checkpoints of the append program, so a run that stops part way (a bad
+#  file, an interrupted session) starts again from the steps it had
+#  finished instead of checking every file and merging them again.
+#  save - records the QA counts (the delimiter check, upsert counts...) of
+#   one append step (one input file) in the checkpoint manifest.  The
+#   columns read from the file are not stored: the parsed file cache
+#   (cache_helper_scripts.py) already holds them, so a finished file is
+#   read back from there.
+#  save_state - writes the merged df of all the steps as a zstd compressed
+#   Parquet file with the merge's counts, so the merge is not done again.
+#  resume / load_state - the step counts and merged state that are still
+#   good: written for the same source ids, the same files (path, size and
+#   mtime) and the same read options.  Anything else is ignored and done
+#   again.
+#  clear - deletes the files the manifest lists once the run has finished,
+#   and nothing else in the folder.
+#  Files are written to a temp file and swapped in, so a run stopped while
+#  writing a checkpoint leaves the last good one.
+#  Needs pyarrow; without it the append runs without checkpoints.
+#
+# Import from a program in the same folder with:
+#   import checkpoint_helper_scripts as checkpoint
+##############################################################################
+import os
+import pickle
+import threading
+
+
+# bump when a change alters what a checkpoint holds, so checkpoints written
+#  by the old code are not loaded
+CHECKPOINT_VERSION = 2
+# the manifest of the steps finished and the files written
+MANIFEST_FILE = 'append_checkpoint.pickle'
+# the merged df of save_state
+STATE_FILE = 'append_state.parquet'
+
+# steps may finish on a thread pool, so manifest updates are done one at a
+#  time
+_manifest_lock = threading.Lock()
+
+
+def available():
+    """Return True when pyarrow is installed and checkpoints can be used."""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def _load_manifest(checkpoint_dir):
+    try:
+        with open(os.path.join(checkpoint_dir, MANIFEST_FILE), 'rb') as fp:
+            manifest = pickle.load(fp)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return manifest if manifest.get('version') == CHECKPOINT_VERSION else None
+
+
+def _save_manifest(checkpoint_dir, manifest):
+    path = os.path.join(checkpoint_dir, MANIFEST_FILE)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as fp:
+        pickle.dump(manifest, fp)
+    os.replace(tmp_path, path)
+
+
+def _update_manifest(checkpoint_dir, update):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with _manifest_lock:
+        manifest = _load_manifest(checkpoint_dir) or {
+            'version': CHECKPOINT_VERSION, 'steps': {}, 'state': None,
+            'files': []}
+        update(manifest)
+        _save_manifest(checkpoint_dir, manifest)
+
+
+def save(checkpoint_dir, step, path, counts, **options):
+    """Record the QA counts of the append step that read path.
+
+    counts is a dict of the step's QA counts (anything that pickles).
+    options are the read options of the step, e.g. usecols; resume only
+    takes the step back with the same options.
+    """
+    def update(manifest):
+        manifest['steps'][step] = {'stamp': _stamp(path), 'options': options,
+                                   'counts': counts}
+    _update_manifest(checkpoint_dir, update)
+
+
+def resume(checkpoint_dir, paths, **options):
+    """Return the counts of the steps of paths an earlier run finished.
+
+    paths maps a step (source id) to its file.  Returns a dict of step to
+    counts in paths order, leaving out a step written for another version
+    of its file or other options.
+    """
+    if not checkpoint_dir or not available():
+        return {}
+    manifest = _load_manifest(checkpoint_dir)
+    if manifest is None:
+        return {}
+    done = {}
+    for step, path in paths.items():
+        entry = manifest['steps'].get(step)
+        if (entry is not None and os.path.exists(path)
+                and entry['stamp'] == _stamp(path)
+                and entry['options'] == options):
+            done[step] = entry['counts']
+    return done
+
+
+def save_state(checkpoint_dir, paths, df, counts, **options):
+    """Write the merged df of the steps of paths and its counts.
+
+    paths maps a step (source id) to its file, as in resume.  load_state
+    only takes the state back for the same files and options.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    entry = os.path.join(checkpoint_dir, STATE_FILE)
+    tmp_path = f'{entry}.{os.getpid()}.tmp'
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path,
+                   compression='zstd')
+
+    def update(manifest):
+        manifest['state'] = {
+            'stamps': {step: _stamp(path) for step, path in paths.items()},
+            'options': options, 'counts': counts}
+        if STATE_FILE not in manifest['files']:
+            manifest['files'].append(STATE_FILE)
+    # the manifest lists the file before it is swapped in, so clear always
+    #  finds it
+    _update_manifest(checkpoint_dir, update)
+    os.replace(tmp_path, entry)
+
+
+def load_state(checkpoint_dir, paths, **options):
+    """Return (df, counts) of the merged state, or None if there is none.
+
+    A state written for other files or other options is None too.
+    """
+    if not checkpoint_dir or not available():
+        return None
+    import pyarrow.parquet as pq
+
+    manifest = _load_manifest(checkpoint_dir)
+    entry = os.path.join(checkpoint_dir, STATE_FILE)
+    if manifest is None or manifest['state'] is None \
+            or not os.path.exists(entry):
+        return None
+    state = manifest['state']
+    if state['options'] != options or list(state['stamps']) != list(paths):
+        return None
+    for step, path in paths.items():
+        if not os.path.exists(path) or state['stamps'][step] != _stamp(path):
+            return None
+    return pq.read_table(entry).to_pandas(), state['counts']
+
+
+def clear(checkpoint_dir):
+    """Delete the checkpoint files.  Returns the number of files removed.
+
+    Only the manifest and the files it lists are removed, so other files in
+    checkpoint_dir are left alone.
+    """
+    removed = 0
+    if not checkpoint_dir or not os.path.isdir(checkpoint_dir):
+        return removed
+    manifest = _load_manifest(checkpoint_dir)
+    for name in (manifest or {}).get('files', []) + [MANIFEST_FILE]:
+        path = os.path.join(checkpoint_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
@@ -0,0 +1,93 @@
+##############################################################################
+# Compressed file helper scripts
+# @author: Jim Cheairs
+
+# Transparent gzip / zstd handling for the 4800, 5200 and split files.
+#  The compression is chosen by the file extension, so any program path
+#  can point at file.txt, file.txt.gz or file.txt.zst:
+#   .gz  - gzip (python's gzip module, single threaded).
+#   .zst - zstandard, compressed on all cores (needs the zstandard package).
+#  Plain files are opened as before.  Everything is streamed, so a
+#  compressed file is never unpacked to disk or into memory in one piece.
+#  pd.read_csv, pyarrow and polars read .gz and .zst files themselves; use
+#  csv_compression for the to_csv compression argument.
+#  zstd is the better choice for big files: it is faster than gzip at a
+#  better ratio and its compression runs on every core.
+#
+# Import from a program in the same folder with:
+#   import compress_helper_scripts as compress
+##############################################################################
+import gzip
+import io
+
+
+# file extension -> compression method
+EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# gzip level 6 (the zlib default) is several times faster than python's
+#  default of 9 for nearly the same size on pipe text
+GZIP_LEVEL = 6
+# zstd level 3 is the zstd default, threads=-1 uses every core
+ZSTD_LEVEL = 3
+
+
+def compression_of(path):
+    """Return 'gzip', 'zstd' or None for a path, from its extension."""
+    for ext, method in EXTENSIONS.items():
+        if str(path).lower().endswith(ext):
+            return method
+    return None
+
+
+def csv_compression(path):
+    """Return the pandas to_csv compression argument for path."""
+    method = compression_of(path)
+    if method == 'gzip':
+        return {'method': 'gzip', 'compresslevel': GZIP_LEVEL, 'mtime': 0}
+    if method == 'zstd':
+        return {'method': 'zstd', 'level': ZSTD_LEVEL, 'threads': -1}
+    return None
+
+
+def decompress_reader(fp, method):
+    """Wrap an open binary file so it is read decompressed as a stream.
+
+    method is 'gzip', 'zstd' or None (fp is returned as it is).  fp.tell()
+    still gives the compressed bytes read so far.
+    """
+    if method == 'gzip':
+        return gzip.GzipFile(fileobj=fp, mode='rb')
+    if method == 'zstd':
+        import zstandard
+
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(fp, closefd=False))
+    return fp
+
+
+def open_binary(path, mode='rb'):
+    """Open path for binary reading ('rb') or writing ('wb').
+
+    Compressed files are decompressed or compressed as a stream.  Files
+    opened for reading support readline and line iteration but a
+    compressed one cannot seek.
+    """
+    method = compression_of(path)
+    if method == 'gzip':
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if method == 'zstd':
+        import zstandard
+
+        if mode.startswith('r'):
+            return io.BufferedReader(zstandard.open(path, 'rb'))
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+        return zstandard.open(path, 'wb', cctx=cctx)
+    return open(path, mode)
+
+
+def open_text(path, mode='r', encoding='utf-8', newline=None):
+    """Open path for text reading ('r') or writing ('w'), see open_binary."""
+    if compression_of(path) is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+    return io.TextIOWrapper(open_binary(path, mode[0] + 'b'),
+                            encoding=encoding, newline=newline)
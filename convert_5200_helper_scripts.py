@@ -0,0 +1,343 @@
+##############################################################################
+# 5200 to 4800 conversion helper scripts
+# @author: Jim Cheairs
+
+# Helpers used by 4800_From_5200_File_Preprocessing_FirstHealth.py.
+#  edit_5200 - the PROVNUM, SEX, ZIP and RACE edits for a 5200 df or chunk.
+#  to_4800 - adds the fields missing from the 5200 in 4800 column order.
+#  collapse_5200 - reads the loaded 5200 fields with pd.read_csv a block of
+#   lines at a time and collapses continuation records into one record
+#   per encounter, with their REVCOD / CHARGE detail, and can fingerprint
+#   each record (dedupe_helper_scripts).  See 5200_Extractor_Benchmark.py.
+#  read_5200 - collapse_5200 of a whole file through the parsed file cache
+#   (cache_helper_scripts).
+#  stream_5200_to_4800 - bounded memory conversion of a whole 5200 file.
+#
+# Import from a program in the same folder with:
+#   import convert_5200_helper_scripts as convert
+##############################################################################
+import collections
+import heapq
+import io
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import cache_helper_scripts as cache
+import compress_helper_scripts as compress
+import dedupe_helper_scripts as dedupe
+import layout_helper_scripts as layout
+
+
+# position of DISDATE in a 4800 output line, used as the sort key
+DISDATE_POS = layout.COLUMNS_4800.index('DISDATE')
+
+
+def _parse_lines(lines, positions, encoding):
+    # the C parser on a block of raw 5200 lines, the same read as the
+    #  read_csv path of the 5200 program
+    return pd.read_csv(io.BytesIO(b''.join(lines)), sep='|', header=None,
+                       usecols=positions, dtype=str, encoding=encoding)
+
+
+def _collapse_block(df, hashes, usecols, names, pcn_pos, revenue_positions,
+                    counts):
+    # one record per run of lines with the same PCN, from the run's first
+    #  line, with the revenue detail of the run's lines in file order
+    pcn = df[pcn_pos].fillna('').to_numpy()
+    first = np.ones(len(df), dtype=bool)
+    first[1:] = pcn[1:] != pcn[:-1]
+    run = np.cumsum(first) - 1
+    counts['continuation_lines'] += int(len(df) - first.sum())
+    out = df.loc[first, usecols].set_axis(names, axis=1) \
+        .reset_index(drop=True)
+    if not revenue_positions:
+        return out
+    # repeated lines of an encounter are not counted twice
+    keep = ~pd.DataFrame({'run': run, 'hash': hashes}).duplicated().to_numpy()
+    parts = []
+    for k, (rev_pos, charge_pos) in enumerate(revenue_positions):
+        where = np.flatnonzero(keep & (df[rev_pos].notna()
+                                       | df[charge_pos].notna()).to_numpy())
+        parts.append(pd.DataFrame({
+            'run': run[where], 'line': where, 'pair': k,
+            'REVCOD': df[rev_pos].to_numpy()[where],
+            'CHARGE': df[charge_pos].to_numpy()[where]}))
+    detail = pd.concat(parts).sort_values(['line', 'pair'], kind='stable')
+    detail['slot'] = detail.groupby('run').cumcount()
+    slots = len(layout.REVCOD_COLUMNS_4800)
+    counts['revenue_overflow'] += int(
+        (detail.groupby('run')['slot'].max() >= slots).sum())
+    detail = detail[detail['slot'] < slots]
+    wide = detail.pivot(index='run', columns='slot',
+                        values=['REVCOD', 'CHARGE'])
+    wide.columns = [f'{name}{slot + 1}' for name, slot in wide.columns]
+    return out.join(wide).reindex(columns=names + layout.CHARGE_COLUMNS_4800)
+
+
+def _iter_collapse_5200(path, usecols, names, encoding, chunksize,
+                        revenue_positions, counts, categorical, fingerprint):
+    pcn_pos = usecols[names.index('PCN')]
+    positions = sorted({pcn_pos, *usecols,
+                        *(pos for pair in revenue_positions for pos in pair)})
+    carry = []
+    with compress.open_binary(path) as fp:
+        while True:
+            block = [line for line in itertools.islice(fp, chunksize)
+                     if line.strip(b'\r\n')]
+            lines = carry + block
+            if not lines:
+                break
+            df = _parse_lines(lines, positions, encoding)
+            hashes = dedupe.fingerprints([line.rstrip(b'\r\n')
+                                          for line in lines])
+            carry = []
+            if block:
+                # the last encounter may go on in the next block, so its
+                #  lines are parsed again with it
+                pcn = df[pcn_pos].fillna('').to_numpy()
+                start = len(pcn) - 1
+                while start and pcn[start - 1] == pcn[-1]:
+                    start -= 1
+                if start:
+                    carry = lines[start:]
+                    df, hashes = df.iloc[:start], hashes[:start]
+                else:
+                    # one encounter so far, read on
+                    carry = lines
+                    continue
+            del lines
+            df = _collapse_block(df.reset_index(drop=True), hashes, usecols,
+                                 list(names), pcn_pos, revenue_positions,
+                                 counts)
+            if categorical:
+                df = layout.categorize_4800(df)
+            if fingerprint:
+                # the record as read - its loaded fields and revenue detail
+                columns = list(df.columns)
+                df[dedupe.FINGERPRINT_COLUMN] = dedupe.key_hashes(df)
+                dedupe.mark_fingerprints(df, columns)
+            yield df
+            if not block:
+                break
+
+
+def collapse_5200(path, usecols, names, revenue_positions,
+                  encoding='windows-1252', chunksize=None, counts=None,
+                  categorical=False, fingerprint=False):
+    """Read a headerless 5200 file with one record per encounter.
+
+    Consecutive lines with the same PCN (an encounter and its continuation
+    records) become one record taken from the first line, so no full-row
+    dedupe is needed.  usecols and names are the loaded 5200 fields and
+    their 4800 names.  revenue_positions are the (revenue code, charge)
+    field position pairs on a 5200 line; their values from all the
+    encounter's lines fill REVCOD1-50 / CHARGE1-50 in file order.
+    Repeated lines are not counted twice and detail past 50 slots is
+    dropped.  Pass () to collapse without the charge detail.
+
+    The lines are parsed chunksize at a time (1,000,000 by default) with
+    pd.read_csv, so the fields read like the plain read_csv path.  With
+    chunksize an iterator of dfs is returned.  counts (a
+    collections.Counter) gets the continuation_lines and revenue_overflow
+    (encounters with more than 50 detail lines) counts.  categorical=True
+    holds the 4800 code columns as categoricals (categorize_4800) and
+    fingerprint=True adds the _FINGERPRINT column, the hash of each
+    record's loaded fields and detail, for the FULL duplicate check.
+    """
+    if revenue_positions is None:
+        raise ValueError('revenue_positions are required to collapse '
+                         'continuation records, as their REVCOD / CHARGE '
+                         'detail is lost otherwise.  Compile them from '
+                         'the mapping doc (layout_helper_scripts), or '
+                         'pass () to collapse without the detail.')
+    if counts is None:
+        counts = collections.Counter()
+    chunks = _iter_collapse_5200(path, usecols, names, encoding,
+                                 chunksize or 1_000_000,
+                                 [tuple(pair) for pair in revenue_positions],
+                                 counts, categorical, fingerprint)
+    if chunksize:
+        return chunks
+    frames = list(chunks)
+    if not frames:
+        columns = list(names) + (layout.CHARGE_COLUMNS_4800
+                                 if revenue_positions else [])
+        return pd.DataFrame({name: pd.Series(dtype=object)
+                             for name in columns})
+    return layout.concat_4800(frames)
+
+
+def read_5200(path, usecols, names, revenue_positions,
+              encoding='windows-1252', cache_dir=None, categorical=False,
+              fingerprint=False):
+    """Return collapse_5200 of a whole file, through the parsed file cache.
+
+    The arguments are those of collapse_5200.  With cache_dir a file
+    already collapsed with the same options is loaded from the cache
+    instead of read again.
+    """
+    # parser keeps these entries apart from read_4800's of the same file
+    df = cache.read_cached(
+        path,
+        lambda: collapse_5200(path, usecols, names, revenue_positions,
+                              encoding, categorical=categorical,
+                              fingerprint=fingerprint),
+        cache_dir, parser='collapse_5200', usecols=usecols, names=names,
+        encoding=encoding, revenue_positions=revenue_positions,
+        categorical=categorical, fingerprint=fingerprint)
+    if fingerprint:
+        dedupe.mark_fingerprints(
+            df, [col for col in df.columns
+                 if col != dedupe.FINGERPRINT_COLUMN])
+    return df
+
+
+def edit_5200(df, provnum_map, sex_map):
+    """Apply the 4800 field edits to a renamed 5200 df (or one chunk of it).
+
+    PROVNUM and SEX are recoded with the given maps, ZIP is cut to
+    5 characters and null or 6 RACE codes become 9.
+    """
+    df['PROVNUM'] = layout.recode(df['PROVNUM'], provnum_map, regex=True)
+    df['SEX'] = layout.recode(df['SEX'], sex_map, regex=True)
+    df['ZIP'] = df['ZIP'].str.slice(0, 5)
+    df['RACE'] = layout.recode(layout.fill_code(df['RACE'], '9'), {'6': '9'})
+    return df
+
+
+def to_4800(df):
+    """Add SPTTYPE and the empty 4800 fields and reorder to 4800 columns."""
+    df['SPTTYPE'] = str(1)
+    return df.reindex(columns=layout.COLUMNS_4800)
+
+
+def _sort_key(line):
+    # sort by DISDATE (blank dates last) then by the whole line so full
+    # duplicate records end up next to each other.  MMDDYYYY -> YYYYMMDD so
+    # the dates sort in date order across years
+    disdate = line.split('|', DISDATE_POS + 1)[DISDATE_POS]
+    return (disdate == '', disdate[4:] + disdate[:4], line)
+
+
+def _add_counts(total, series):
+    # add a value_counts result to a running count Series
+    counts = series.value_counts(dropna=False)
+    counts.index = counts.index.astype(object)
+    return counts if total is None else total.add(counts, fill_value=0)
+
+
+def stream_5200_to_4800(path_in, path_out, usecols, names, chunksize,
+                        provnum_map, sex_map, encoding='windows-1252',
+                        collapse=False, revenue_positions=None):
+    """Convert a headerless 5200 file to a 4800 file in bounded memory.
+
+    The 5200 is read chunksize rows at a time.  Each chunk gets the same
+    edits as the in-memory path, is sorted by DISDATE and written to a
+    temporary run file next to path_out.  The runs are then k-way merged
+    into path_out, dropping full duplicate records as they meet in the
+    merge, so memory depends on chunksize and not on the file size.
+    collapse=True reads the chunks with collapse_5200 and
+    revenue_positions, so each encounter's continuation records become
+    one record.
+    path_in and path_out may be gzip (.gz) or zstd (.zst) files.
+
+    Returns a dict of counts and distributions for the run log.
+    """
+    stats = {'records_read': 0, 'records_written': 0, 'full_duplicates': 0,
+             'chunks': 0}
+    counts = collections.Counter()
+    dists = dict.fromkeys(['provnum_submitted', 'provnum_updated',
+                           'sex_submitted', 'sex_updated', 'zip',
+                           'race_submitted', 'race_updated'])
+    subfacility = collections.Counter()
+    provnum = collections.Counter()
+    month = collections.Counter()
+    date_min = date_max = None
+
+    tmp_dir = tempfile.mkdtemp(prefix='stream_5200_',
+                               dir=os.path.dirname(path_out) or None)
+    try:
+        # pass 1: edit, sort and write each chunk as a run file
+        run_paths = []
+        if collapse:
+            reader = collapse_5200(path_in, usecols, names, revenue_positions,
+                                   encoding, chunksize=chunksize,
+                                   counts=counts)
+        else:
+            reader = pd.read_csv(path_in, sep='|', header=None,
+                                 usecols=usecols,
+                                 dtype=layout.dtype_positional(usecols, names),
+                                 encoding=encoding, chunksize=chunksize)
+        for chunk in reader:
+            # read_csv chunks have positional column names
+            chunk.columns = list(names) + list(chunk.columns[len(names):])
+            stats['records_read'] += len(chunk)
+            stats['chunks'] += 1
+            for field in ['PROVNUM', 'SEX', 'RACE']:
+                key = f'{field.lower()}_submitted'
+                dists[key] = _add_counts(dists[key], chunk[field])
+            chunk = edit_5200(chunk, provnum_map, sex_map)
+            for field in ['PROVNUM', 'SEX', 'RACE']:
+                key = f'{field.lower()}_updated'
+                dists[key] = _add_counts(dists[key], chunk[field])
+            dists['zip'] = _add_counts(dists['zip'], chunk['ZIP'])
+            chunk = to_4800(chunk)
+
+            # split on '\n' only: splitlines would also break a record at
+            #  a form feed or other separator character inside a field
+            lines = chunk.to_csv(sep='|', index=False, header=False,
+                                 na_rep='', lineterminator='\n')
+            lines = [line + '\n' for line in lines.split('\n')[:-1]]
+            del chunk
+            lines.sort(key=_sort_key)
+            run_path = os.path.join(tmp_dir, f'run_{len(run_paths):05d}.txt')
+            with open(run_path, 'w', encoding='utf-8', newline='') as fp:
+                fp.writelines(lines)
+            run_paths.append(run_path)
+            del lines
+
+        # pass 2: merge the sorted runs into the final 4800 file
+        # newline='\n' so only '\n' ends a line when the runs are read back
+        runs = [open(p, 'r', encoding='utf-8', newline='\n')
+                for p in run_paths]
+        try:
+            with compress.open_text(path_out, 'w', encoding='utf-8') as out:
+                out.write('|'.join(layout.COLUMNS_4800) + '\n')
+                previous = None
+                for line in heapq.merge(*runs, key=_sort_key):
+                    if line == previous:
+                        stats['full_duplicates'] += 1
+                        continue
+                    previous = line
+                    out.write(line)
+                    stats['records_written'] += 1
+                    fields = line.split('|', DISDATE_POS + 1)
+                    subfacility[fields[1][:2]] += 1
+                    provnum[fields[0]] += 1
+                    disdate = fields[DISDATE_POS]
+                    month[disdate[:2]] += 1
+                    if disdate:
+                        # MMDDYYYY -> YYYYMMDD so strings compare by date
+                        ymd = disdate[4:] + disdate[:4]
+                        date_min = min(date_min or ymd, ymd)
+                        date_max = max(date_max or ymd, ymd)
+        finally:
+            for fp in runs:
+                fp.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    stats['continuation_lines'] = counts['continuation_lines']
+    stats['revenue_overflow'] = counts['revenue_overflow']
+    stats.update(dists)
+    stats['subfacility'] = pd.Series(subfacility).sort_index()
+    stats['provnum'] = pd.Series(provnum).sort_index()
+    stats['month'] = pd.Series(month).sort_index()
+    stats['disdate_min'] = pd.to_datetime(date_min, format='%Y%m%d')
+    stats['disdate_max'] = pd.to_datetime(date_max, format='%Y%m%d')
+    return stats
@@ -0,0 +1,251 @@
+##############################################################################
+# 4800 date helper scripts
+# @author: Jim Cheairs
+
+# Fast decoding of the 8 character MMDDYYYY 4800 date fields (ADMDATE,
+#  DISDATE, DOB, PRPRDATE, SECDAT1-30).
+#  day_ordinals - turns a date column into int32 day numbers (days since
+#   1970-01-01) with numpy arithmetic on the characters, instead of
+#   pd.to_datetime(format='%m%d%Y').  Only the distinct values are decoded
+#   and they are remembered per column name, so converting DISDATE again
+#   (the next appended file, the melted dx / px dfs) only decodes the dates
+#   not seen before.  Nulls and invalid dates (bad digits, month 13,
+#   Feb 30...) become NULL_DAY and are counted.
+#  With day numbers, LOS, age, sorting and the date distribution reports
+#  are integer math:
+#   to_datetime - the datetime64 column for Access tables and .dt fields.
+#   days_between - LOS / age in days.
+#   describe - the pd.to_datetime(...).describe() report of the programs.
+#   date_stats - running date statistics (null / invalid counts and the
+#    records per day) that are combined across chunks and files with
+#    merge_stats / remove_stats, so describe_stats and month_counts report
+#    a combined file without converting its dates again.
+#   sort_order - a chronological DISDATE sort (sort_values on the MMDDYYYY
+#    strings puts January 2023 before December 2022).  The distinct days
+#    are ranked and the ranks radix sorted, so the sort is linear.
+#
+# Import from a program in the same folder with:
+#   import dates_helper_scripts as dates
+##############################################################################
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+# day number of a null or invalid date
+NULL_DAY = np.iinfo(np.int32).min
+# dates outside these years are invalid - every valid date fits a pandas
+#  Timestamp
+MIN_YEAR = 1678
+MAX_YEAR = 2261
+
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# column name -> {MMDDYYYY string: day number} of every value decoded so far
+_memo = {}
+
+
+def decode_mmddyyyy(values):
+    """Return the int32 day numbers of a list or array of MMDDYYYY strings.
+
+    Invalid strings get NULL_DAY.  The characters are decoded as a 2d
+    array of code points, so no date is parsed in python.
+    """
+    # one spare character so a string longer than 8 is caught
+    chars = np.array(values, dtype='U9')
+    digits = chars.view(np.uint32).reshape(len(chars), 9).astype(np.int64) \
+        - ord('0')
+    valid = ((digits[:, :8] >= 0) & (digits[:, :8] <= 9)).all(axis=1) \
+        & (digits[:, 8] == -ord('0'))
+    digits = np.where(valid[:, None], digits, 0)
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 2] * 10 + digits[:, 3]
+    year = (digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10
+            + digits[:, 7])
+    valid &= (month >= 1) & (month <= 12)
+    valid &= (year >= MIN_YEAR) & (year <= MAX_YEAR)
+    month = np.where(valid, month, 1)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = _DAYS_IN_MONTH[month] + ((month == 2) & leap)
+    valid &= (day >= 1) & (day <= month_days)
+
+    # days since 1970-01-01 of a proleptic Gregorian date, counting years
+    #  from March so the leap day is the last day of the year
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return np.where(valid, days, NULL_DAY).astype(np.int32)
+
+
+def day_ordinals(series, counts=None):
+    """Return a MMDDYYYY date column as an int32 array of day numbers.
+
+    Nulls and invalid dates are NULL_DAY.  Decoded values are remembered
+    under series.name, so only dates not seen before in a column of that
+    name are decoded.  counts (a collections.Counter) gets the number of
+    'null' and 'invalid' dates added.
+    """
+    codes, uniques = pd.factorize(series)
+    uniques = np.asarray(uniques, dtype=object)
+    memo = _memo.setdefault(series.name, {})
+    new = [value for value in uniques if value not in memo]
+    if new:
+        memo.update(zip(new, decode_mmddyyyy(new).tolist()))
+    lookup = np.array([memo[value] for value in uniques] + [NULL_DAY],
+                      dtype=np.int32)
+    # code -1 (null) picks the NULL_DAY on the end of lookup
+    days = lookup[codes]
+    if counts is not None:
+        nulls = int(np.count_nonzero(codes < 0))
+        counts['null'] += nulls
+        counts['invalid'] += int(np.count_nonzero(days == NULL_DAY)) - nulls
+    return days
+
+
+def clear_memo():
+    """Forget the decoded dates of every column."""
+    _memo.clear()
+
+
+def to_datetime(series, counts=None):
+    """Return a MMDDYYYY date column as datetime64, NaT for null / invalid.
+
+    Like pd.to_datetime(series, format='%m%d%Y', errors='coerce').
+    """
+    days = day_ordinals(series, counts).astype(np.int64)
+    days[days == NULL_DAY] = np.iinfo(np.int64).min  # NaT
+    return pd.Series(days.view('datetime64[D]').astype('datetime64[ns]'),
+                     index=series.index, name=series.name)
+
+
+def days_between(start, end):
+    """Return the days from the start to the end date columns (e.g. LOS).
+
+    int64 like (end - start).dt.days, or float64 with NaN where either
+    date is null or invalid.
+    """
+    start_days = day_ordinals(start)
+    end_days = day_ordinals(end)
+    days = end_days.astype(np.int64) - start_days
+    missing = (start_days == NULL_DAY) | (end_days == NULL_DAY)
+    if missing.any():
+        days = np.where(missing, np.nan, days)
+    return pd.Series(days, index=end.index)
+
+
+def order_days(days):
+    """Return the stable sort order of an array of day numbers, NULL_DAY last.
+
+    The distinct days are ranked; up to 65,536 of them (179 years) the
+    uint16 ranks are radix sorted by numpy in linear time.
+    """
+    days = np.where(days == NULL_DAY, np.iinfo(np.int32).max, days)
+    codes, uniques = pd.factorize(days, sort=True)
+    if len(uniques) <= np.iinfo(np.uint16).max + 1:
+        codes = codes.astype(np.uint16)
+    return np.argsort(codes, kind='stable')
+
+
+def sort_order(series):
+    """Return the positions that sort a MMDDYYYY date column by date.
+
+    Stable, with null and invalid dates last, like sort_values on the
+    dates.  Use as df.take(dates.sort_order(df['DISDATE'])).
+    """
+    return order_days(day_ordinals(series))
+
+
+def _timestamp(day):
+    return pd.Timestamp(round(day * 86_400_000_000_000))
+
+
+def date_stats(series):
+    """Return the running date statistics of a MMDDYYYY date column.
+
+    A dict of the column name, the null and invalid date counts and days,
+    the number of records on each valid day (a Series indexed by day
+    number, in day order).  The statistics of chunks or files are combined
+    with merge_stats and remove_stats, and reported with describe_stats
+    and month_counts, without converting the dates again.
+    """
+    counts = collections.Counter()
+    days = day_ordinals(series, counts)
+    days = pd.Series(days[days != NULL_DAY]).value_counts().sort_index()
+    return {'name': series.name, 'null': counts['null'],
+            'invalid': counts['invalid'], 'days': days.astype(np.int64)}
+
+
+def merge_stats(*stats):
+    """Return the date statistics of the records of all the given stats."""
+    days = pd.concat([s['days'] for s in stats])
+    return {'name': stats[0]['name'],
+            'null': sum(s['null'] for s in stats),
+            'invalid': sum(s['invalid'] for s in stats),
+            'days': days.groupby(level=0).sum().astype(np.int64)}
+
+
+def remove_stats(total, part):
+    """Return the date statistics of total without the records of part.
+
+    part must be records counted in total, e.g. the duplicates dropped.
+    """
+    days = total['days'].sub(part['days'], fill_value=0).astype(np.int64)
+    return {'name': total['name'], 'null': total['null'] - part['null'],
+            'invalid': total['invalid'] - part['invalid'],
+            'days': days[days > 0]}
+
+
+def month_counts(stats):
+    """Return the number of records by YYYYMM month of date statistics."""
+    days = stats['days']
+    ym = days.index.to_numpy().astype('datetime64[D]') \
+        .astype('datetime64[M]').astype(np.int64)
+    return days.groupby((ym // 12 + 1970) * 100 + ym % 12 + 1).sum() \
+        .rename_axis('month').rename(stats['name'])
+
+
+def _day_at(values, ends, k):
+    # the day of the k-th (0-based) record in day order
+    return values[np.searchsorted(ends, k, side='right')]
+
+
+def describe_stats(stats):
+    """Return the date distribution of date statistics.
+
+    The same count, mean, min, quartiles (linear interpolation, like
+    np.percentile) and max as pd.to_datetime(...).describe(), plus the
+    number of invalid dates.
+    """
+    values = stats['days'].index.to_numpy().astype(np.int64)
+    weights = stats['days'].to_numpy()
+    count = int(weights.sum())
+    result = {'count': count}
+    if count:
+        ends = np.cumsum(weights)
+        result['mean'] = _timestamp((values * weights).sum() / count)
+        result['min'] = _timestamp(values[0])
+        for q, p in zip(['25%', '50%', '75%'], [0.25, 0.5, 0.75]):
+            position = p * (count - 1)
+            low = int(np.floor(position))
+            value = _day_at(values, ends, low)
+            if low + 1 < count:
+                value += (position - low) \
+                    * (_day_at(values, ends, low + 1) - value)
+            result[q] = _timestamp(value)
+        result['max'] = _timestamp(values[-1])
+    result['invalid'] = stats['invalid']
+    return pd.Series(result, dtype=object, name=stats['name'])
+
+
+def describe(series):
+    """Return the date distribution of a MMDDYYYY date column.
+
+    The same count, mean, min, quartiles and max as
+    pd.to_datetime(series, format='%m%d%Y').describe(), plus the number
+    of invalid dates, worked out on the day numbers.
+    """
+    return describe_stats(date_stats(series))
@@ -0,0 +1,161 @@
+##############################################################################
+# Dedupe helper scripts
+# @author: Jim Cheairs
+
+# One pass duplicate check shared by the append, 5200, split and DQR
+#  programs.
+#  find_duplicates - hashes the key columns of every row once into a
+#   uint64 (pd.util.hash_pandas_object) and works out from those hashes:
+#   the count of duplicate rows, the keep-first / keep-last mask of the rows
+#   to drop, their index labels and the rows whose key is repeated at all.
+#   The same result gives the printed count and the drop, instead of
+#   calling df.duplicated() once for each.
+#  drop / drop_duplicates - the surviving df, keep-first or keep-last.
+#  A FULL duplicate must also be a key duplicate, so the full record check
+#  is limited to the rows with a repeated key (rows=dups['repeated']),
+#  usually a tiny share of the file.
+#  fingerprints / file_fingerprints - a uint64 hash of each raw record
+#   line, added by read_4800 as the _FINGERPRINT column with
+#   fingerprint=True (a read of only some columns, and collapse_5200, hash
+#   the loaded fields with key_hashes instead).  The FULL record check on
+#   that column is an integer check instead of comparing every column, and
+#   records can be compared with a later version of the file the same way.
+#  mark_fingerprints / fingerprint_kind - how the _FINGERPRINT column was
+#   hashed ('line' or the columns hashed), kept in df.attrs, so records
+#   are only compared on fingerprints hashed the same way.
+#  Two different keys with the same 64 bit hash would be taken as
+#  duplicates; for the row counts here that chance is about one in a
+#  million runs.
+#
+# Import from a program in the same folder with:
+#   import dedupe_helper_scripts as dedupe
+##############################################################################
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import compress_helper_scripts as compress
+
+
+# column of raw record fingerprints added by the readers
+FINGERPRINT_COLUMN = '_FINGERPRINT'
+
+
+def fingerprints(records):
+    """Return the uint64 fingerprint of each record of a list.
+
+    records are raw lines (bytes or str, without the line break), or the
+    loaded fields of a line joined with '|'.  Equal records get equal
+    fingerprints.
+    """
+    return pd.util.hash_array(np.array(records, dtype=object),
+                              categorize=False)
+
+
+def mark_fingerprints(df, kind):
+    """Record how df's _FINGERPRINT column was hashed and return df.
+
+    kind is 'line' for the raw lines or the list of columns hashed.  It is
+    kept in df.attrs, which pandas carries through slices and concats (a
+    concat of frames hashed differently drops it) and the parsed file
+    cache keeps.
+    """
+    df.attrs[FINGERPRINT_COLUMN] = kind if kind == 'line' else list(kind)
+    return df
+
+
+def fingerprint_kind(df):
+    """Return how df's _FINGERPRINT column was hashed, None if not known."""
+    return df.attrs.get(FINGERPRINT_COLUMN)
+
+
+def file_fingerprints(path, header=True, chunksize=1_000_000):
+    """Return the fingerprints of the records of a pipe file, in file order.
+
+    One per non-blank line after the header (header=False for a headerless
+    file like the 5200), so they line up with the rows of a read_csv of
+    the file.  The file is hashed chunksize lines at a time.
+    """
+    parts = []
+    with compress.open_binary(path) as fp:
+        if header:
+            fp.readline()
+        while True:
+            lines = [line.rstrip(b'\r\n')
+                     for line in itertools.islice(fp, chunksize)]
+            if not lines:
+                break
+            parts.append(fingerprints([line for line in lines if line]))
+    if not parts:
+        return np.array([], dtype=np.uint64)
+    return np.concatenate(parts)
+
+
+def key_hashes(df, subset=None):
+    """Return a uint64 hash of the subset columns of every row.
+
+    subset is a column or a list of columns, by default every column (a
+    FULL record key).  Categorical and string columns with the same
+    values hash the same.  The _FINGERPRINT column is already a hash and
+    is used as it is.
+    """
+    if subset == FINGERPRINT_COLUMN:
+        return df[FINGERPRINT_COLUMN].to_numpy()
+    if subset is not None:
+        df = df[[subset] if isinstance(subset, str) else list(subset)]
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def find_duplicates(df, subset=None, keep='first', rows=None):
+    """Find the duplicate rows of df on the subset columns.
+
+    keep is 'first', 'last' or False, as in df.duplicated.  rows (a bool
+    array) limits the check to those rows, e.g. dups['repeated'] of a key
+    check for the FULL record check.
+
+    Returns a dict:
+      count - rows that keep drops, df.duplicated(subset, keep).sum().
+      mask - bool array, True for the rows keep drops.
+      dropped - index labels of those rows.
+      repeated - bool array, True for every row whose key is repeated.
+      keys - number of distinct keys.
+      hashes - the uint64 key hash of each row checked.
+    """
+    checked = df if rows is None else df[rows]
+    hashes = key_hashes(checked, subset)
+    codes, uniques = pd.factorize(hashes)
+    repeated = np.bincount(codes, minlength=len(uniques))[codes] > 1
+    mask = pd.Series(codes).duplicated(keep=keep).to_numpy()
+    if rows is not None:
+        # back to the rows of df
+        where = np.flatnonzero(rows)
+        mask, checked_mask = np.zeros(len(df), dtype=bool), mask
+        mask[where[checked_mask]] = True
+        repeated, checked_repeated = np.zeros(len(df), dtype=bool), repeated
+        repeated[where[checked_repeated]] = True
+    return {'count': int(mask.sum()),
+            'mask': mask,
+            'dropped': df.index[mask],
+            'repeated': repeated,
+            'keys': len(uniques),
+            'hashes': hashes}
+
+
+def drop(df, dups):
+    """Return df without the rows a find_duplicates result marks to drop.
+
+    A new df (take), not a view, so it can be edited without a
+    SettingWithCopyWarning.
+    """
+    return df.take(np.flatnonzero(~dups['mask']))
+
+
+def drop_duplicates(df, subset=None, keep='first'):
+    """Return df without its duplicate rows and the find_duplicates result.
+
+    Like df.drop_duplicates(subset, keep=keep), but the result also
+    gives the count and the dropped rows for the run log.
+    """
+    dups = find_duplicates(df, subset, keep)
+    return drop(df, dups), dups
@@ -0,0 +1,113 @@
+##############################################################################
+# 4800 refresh diff helper scripts
+# @author: Jim Cheairs
+
+# Change data capture between two versions of a client's 4800 data, e.g.
+#  the history file and the resubmitted months of a refresh.
+#  compare - matches each new record to the old record with the same key
+#   on the uint64 key hash and compares their row fingerprints
+#   (dedupe_helper_scripts), so every record is classed as inserted,
+#   updated or unchanged with a hash join instead of a column by column
+#   compare.  The two frames must have been fingerprinted the same way
+#   (both from raw lines, or both from the same columns).
+#  field_deltas - the changed fields of the updated records only, as a long
+#   table of key, field, old and new value.
+#  changes - the table of inserted and updated records for the run log
+#   and for later stages that only need to redo the changed records.
+#
+# Import from a program in the same folder with:
+#   import diff_helper_scripts as diff
+##############################################################################
+import numpy as np
+import pandas as pd
+
+import dedupe_helper_scripts as dedupe
+
+
+STATUSES = ['inserted', 'updated', 'unchanged']
+
+
+def compare(old_df, new_df, key='PCN', row=dedupe.FINGERPRINT_COLUMN):
+    """Class each record of new_df against old_df's record with its key.
+
+    row is the column of row fingerprints, or the list of columns (None
+    for every column) to hash on both sides.  Fingerprints hashed in
+    different ways (dedupe_helper_scripts.fingerprint_kind), e.g. raw lines
+    against loaded fields, never match, so they raise a ValueError.
+    A repeated key in old_df is matched to its last record, like the
+    keep-last append.  Returns a dict:
+      status - a categorical of inserted / updated / unchanged per new_df row.
+      counts - the number of new_df rows of each status.
+      old_positions - the old_df row of each new_df row, -1 if inserted.
+      updated - bool array, True for the updated new_df rows.
+    """
+    if row == dedupe.FINGERPRINT_COLUMN:
+        kinds = [dedupe.fingerprint_kind(df) for df in [old_df, new_df]]
+        if kinds[0] is None or kinds[0] != kinds[1]:
+            raise ValueError(
+                f'The old and new fingerprints were hashed from {kinds[0]} '
+                f'and {kinds[1]}, so they cannot be compared.  Read both '
+                "with the same fingerprint option and columns (fingerprint="
+                "'line' for whole records), or pass the columns to hash as "
+                'row.')
+    dups = dedupe.find_duplicates(old_df, key, keep='last')
+    kept = np.flatnonzero(~dups['mask'])
+    old_rows = dedupe.key_hashes(old_df, row)[kept]
+    # -1 (no old record) picks the -1 on the end of kept
+    matched = pd.Index(dups['hashes'][kept]).get_indexer(
+        dedupe.key_hashes(new_df, key))
+    found = matched >= 0
+    old_positions = np.append(kept, -1)[matched]
+    same = found & (np.append(old_rows, 0)[matched]
+                    == dedupe.key_hashes(new_df, row))
+    codes = np.where(~found, 0, np.where(same, 2, 1))
+    status = pd.Categorical.from_codes(codes, categories=STATUSES)
+    return {'status': status,
+            'counts': pd.Series(np.bincount(codes, minlength=3),
+                                index=STATUSES, name='records'),
+            'old_positions': old_positions,
+            'updated': codes == 1}
+
+
+def field_deltas(old_df, new_df, key='PCN'):
+    """Return the changed fields of matched old and new records.
+
+    old_df and new_df hold the two versions of the same records in the
+    same order (e.g. the updated records of compare).  Nulls are equal to
+    nulls.  Returns a long df of key, FIELD, OLD and NEW, one row per
+    changed field, in record order.
+    """
+    old_df = old_df.reset_index(drop=True)
+    new_df = new_df.reset_index(drop=True)
+    parts = []
+    for column in new_df.columns:
+        if column == key or column not in old_df.columns:
+            continue
+        old = old_df[column].astype(object)
+        new = new_df[column].astype(object)
+        changed = ~((old == new) | (old.isna() & new.isna()))
+        if changed.any():
+            parts.append(pd.DataFrame({key: new_df.loc[changed, key],
+                                       'FIELD': column,
+                                       'OLD': old[changed],
+                                       'NEW': new[changed]}))
+    if not parts:
+        return pd.DataFrame(columns=[key, 'FIELD', 'OLD', 'NEW'])
+    deltas = pd.concat(parts)
+    # record order, then field order within a record
+    return deltas.sort_index(kind='stable').reset_index(drop=True)
+
+
+def changes(new_df, result, deltas, key='PCN'):
+    """Return the inserted and updated records with their field deltas.
+
+    One row per inserted record (FIELD empty) and one per changed field of
+    an updated record, with the CHANGE column, for the changes file.
+    Unchanged records are left out.
+    """
+    inserted = pd.DataFrame({key: new_df[key].to_numpy()[
+        np.asarray(result['status'] == 'inserted')]})
+    inserted['CHANGE'] = 'inserted'
+    deltas = deltas.assign(CHANGE='updated')
+    return pd.concat([inserted, deltas], ignore_index=True).reindex(
+        columns=[key, 'CHANGE', 'FIELD', 'OLD', 'NEW'])
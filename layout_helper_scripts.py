@@ -0,0 +1,411 @@
+##############################################################################
+# 4800 layout helper scripts
+# @author: Jim Cheairs
+
+# Shared 4800 record layout used by the 4800 preprocessing and DQR programs.
+#  column lists in 4800 output order.
+#  the read schema (dtypes) for 4800 and 4800-like split files.
+#  small helpers for working with categorical 4800 code columns.  Columns
+#   are read as strings and categorize_4800 converts the code columns
+#   after the read: parsing straight into categoricals (dtype='category')
+#   is about twice as slow as the plain string read.
+#  the compiled 5200 layout: load_layout_5200 reads the field mapping from
+#   NC5200_to_4800_mapping_doc.xlsx once and keeps it pickled, so later runs
+#   skip the spreadsheet.  The one layout dict drives the 5200 read
+#   (usecols, names, revenue positions) and the final 4800 column order.
+#   A spreadsheet that cannot be read as expected, or whose layout is not
+#   well formed (check_layout_5200), is reported and the last good layout
+#   is used.
+#
+# Import from a program in the same folder with:
+#   import layout_helper_scripts as layout
+##############################################################################
+import collections
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+# 4800 column lists in output order
+# patient / encounter attribute fields
+ATTRIBUTE_COLUMNS_4800 = ['PROVNUM', 'PCN', 'MRN', 'SPTTYPE', 'ADMDATE',
+                          'DISDATE', 'TOTALCLM', 'ZIP', 'DOB', 'SEX', 'RACE',
+                          'ADMTYPE', 'ADMSRC', 'STATUS', 'ATTMD', 'OPERMD',
+                          'CONMD1', 'CONMD2', 'CONMD3', 'PAYCODE1']
+# 41 dx code and POA positions
+DX_COLUMNS_4800 = ['PRDIAG', 'PRDIAGPOA'] + [
+    col for i in range(1, 41) for col in (f'SECDX{i}', f'SECDX{i}POA')]
+# 31 px code and date positions
+PX_COLUMNS_4800 = ['PRPROC', 'PRPRDATE'] + [
+    col for i in range(1, 31) for col in (f'SECPRC{i}', f'SECDAT{i}')]
+# 50 revenue code and charge positions
+CHARGE_COLUMNS_4800 = [
+    col for i in range(1, 51) for col in (f'REVCOD{i}', f'CHARGE{i}')]
+# the full 264 column 4800 layout
+COLUMNS_4800 = (ATTRIBUTE_COLUMNS_4800 + DX_COLUMNS_4800 + PX_COLUMNS_4800
+                + CHARGE_COLUMNS_4800)
+
+# groups of code columns inside the layout
+POA_COLUMNS_4800 = [c for c in DX_COLUMNS_4800 if c.endswith('POA')]
+DX_CODE_COLUMNS_4800 = [c for c in DX_COLUMNS_4800 if not c.endswith('POA')]
+PX_CODE_COLUMNS_4800 = ['PRPROC'] + [f'SECPRC{i}' for i in range(1, 31)]
+REVCOD_COLUMNS_4800 = [f'REVCOD{i}' for i in range(1, 51)]
+DATE_COLUMNS_4800 = (['ADMDATE', 'DISDATE', 'DOB', 'PRPRDATE']
+                     + [f'SECDAT{i}' for i in range(1, 31)])
+
+# Low cardinality code columns that can be held as pandas categoricals
+#  (categorical=True in the readers).  Each distinct code is stored once and
+#  every row only holds a small int code, so these columns take 1-2 bytes
+#  per row instead of a python string.  High cardinality fields (PCN, MRN,
+#  dates, ZIP, charges, physicians) stay as plain strings.
+CATEGORICAL_COLUMNS_4800 = (['PROVNUM', 'SPTTYPE', 'SEX', 'RACE', 'ADMTYPE',
+                             'ADMSRC', 'STATUS', 'PAYCODE1']
+                            + POA_COLUMNS_4800 + DX_CODE_COLUMNS_4800
+                            + PX_CODE_COLUMNS_4800 + REVCOD_COLUMNS_4800)
+# a code column is only made categorical when it has at most this share of
+#  distinct values per row, otherwise the categories save little memory
+MAX_CATEGORY_SHARE = 0.5
+
+
+# 5200 layout (legacy NC State PDS format, submitted without headers)
+#  The 5200 field positions that are loaded and the 4800 names they are
+#  given. See NC5200_to_4800_mapping_doc.xlsx for this mapping.
+USECOLS_5200 = [1, 3, 7, 8, 9, 11, 13, 14, 16, 17, 18, 19, 30,
+                336, 337, 338, 339, 340, 341, 342, 343, 344, 345,
+                346, 347, 348, 349, 350, 351, 352, 353, 354, 355,
+                356, 357, 358, 359, 360, 361, 362, 363, 364, 365,
+                366, 367, 368, 369, 370, 371, 372, 373, 374, 375,
+                376, 377, 378, 379, 380, 381, 382, 383, 384, 385,
+                386, 387, 388, 389, 390, 391, 392, 393, 394, 395,
+                396, 397,
+                411, 412, 414, 415, 417, 418, 420, 421, 423, 424,
+                426, 427, 429, 430, 432, 433, 435, 436, 438, 439,
+                441, 442, 444, 445, 447, 448, 450, 451, 453, 454,
+                456, 457, 459, 460, 462, 463, 465, 466, 468, 469,
+                471, 472, 474, 475, 477, 478, 480, 481, 483, 484,
+                486, 487, 489, 490, 492, 493, 495, 496, 498, 499,
+                501, 502,
+                505, 507, 509, 510, 511, 520]
+NAMES_5200 = ['PCN', 'PROVNUM', 'DOB', 'ADMDATE', 'MRN', 'ZIP', 'SEX', 'RACE',
+              'ADMTYPE', 'ADMSRC', 'STATUS', 'DISDATE', 'TOTALCLM',
+              'PRDIAG', 'PRDIAGPOA', 'SECDX1', 'SECDX1POA',
+              'SECDX2', 'SECDX2POA', 'SECDX3', 'SECDX3POA',
+              'SECDX4', 'SECDX4POA', 'SECDX5', 'SECDX5POA',
+              'SECDX6', 'SECDX6POA', 'SECDX7', 'SECDX7POA',
+              'SECDX8', 'SECDX8POA', 'SECDX9', 'SECDX9POA',
+              'SECDX10', 'SECDX10POA', 'SECDX11', 'SECDX11POA',
+              'SECDX12', 'SECDX12POA', 'SECDX13', 'SECDX13POA',
+              'SECDX14', 'SECDX14POA', 'SECDX15', 'SECDX15POA',
+              'SECDX16', 'SECDX16POA', 'SECDX17', 'SECDX17POA',
+              'SECDX18', 'SECDX18POA', 'SECDX19', 'SECDX19POA',
+              'SECDX20', 'SECDX20POA', 'SECDX21', 'SECDX21POA',
+              'SECDX22', 'SECDX22POA', 'SECDX23', 'SECDX23POA',
+              'SECDX24', 'SECDX24POA', 'SECDX25', 'SECDX25POA',
+              'SECDX26', 'SECDX26POA', 'SECDX27', 'SECDX27POA',
+              'SECDX28', 'SECDX28POA', 'SECDX29', 'SECDX29POA',
+              'SECDX30', 'SECDX30POA',
+              'PRPROC', 'PRPRDATE', 'SECPRC1', 'SECDAT1', 'SECPRC2', 'SECDAT2',
+              'SECPRC3', 'SECDAT3', 'SECPRC4', 'SECDAT4', 'SECPRC5', 'SECDAT5',
+              'SECPRC6', 'SECDAT6', 'SECPRC7', 'SECDAT7', 'SECPRC8', 'SECDAT8',
+              'SECPRC9', 'SECDAT9', 'SECPRC10', 'SECDAT10',
+              'SECPRC11', 'SECDAT11', 'SECPRC12', 'SECDAT12',
+              'SECPRC13', 'SECDAT13', 'SECPRC14', 'SECDAT14',
+              'SECPRC15', 'SECDAT15', 'SECPRC16', 'SECDAT16',
+              'SECPRC17', 'SECDAT17', 'SECPRC18', 'SECDAT18',
+              'SECPRC19', 'SECDAT19', 'SECPRC20', 'SECDAT20',
+              'SECPRC21', 'SECDAT21', 'SECPRC22', 'SECDAT22',
+              'SECPRC23', 'SECDAT23', 'SECPRC24', 'SECDAT24',
+              'SECPRC25', 'SECDAT25', 'SECPRC26', 'SECDAT26',
+              'SECPRC27', 'SECDAT27', 'SECPRC28', 'SECDAT28',
+              'SECPRC29', 'SECDAT29', 'SECPRC30', 'SECDAT30',
+              'ATTMD', 'OPERMD', 'CONMD1', 'CONMD2', 'CONMD3', 'PAYCODE1']
+# (revenue code, charge) field position pairs on each 5200 line.  When
+#  continuation records are collapsed (convert_5200_helper_scripts) their
+#  values fill REVCOD1-50 / CHARGE1-50.  compile_layout_5200 reads them
+#  from NC5200_to_4800_mapping_doc.xlsx.  They are not known without it, so
+#  in this fallback layout they are None and the 5200 program does not
+#  collapse continuation records (collapse_5200 will not collapse without
+#  them), rather than leave REVCOD/CHARGE empty.
+REVENUE_POSITIONS_5200 = None
+
+# NC5200_to_4800_mapping_doc.xlsx columns read by compile_layout_5200: the
+#  5200 field number and the 4800 field it is loaded into (blank when the
+#  field is not loaded).  Fields mapped to REVCOD and CHARGE (no slot
+#  number) are the revenue detail pairs of REVENUE_POSITIONS_5200.
+MAPPING_SHEET = 0
+MAPPING_POSITION_COLUMN = '5200 Position'
+MAPPING_FIELD_COLUMN = '4800 Field'
+# number of the first 5200 field in the mapping doc (usecols count from 0)
+MAPPING_FIRST_POSITION = 0
+# 4800 fields the 5200 program edits and reports, which a compiled layout
+#  must load
+REQUIRED_FIELDS_5200 = ['PCN', 'PROVNUM', 'DISDATE', 'SEX', 'ZIP', 'RACE']
+# bump when the compiled layout changes so old pickles are not loaded
+LAYOUT_5200_VERSION = 2
+LAYOUT_5200_FILE = 'layout_5200.pkl'
+
+
+def dtype_4800(categorical=False):
+    """Return the read_csv dtype for 4800 and 4800-like files.
+
+    By default every column is read as str, the fastest parse.  With
+    categorical=True code columns are read as categoricals and every other
+    column as str; columns that are not in the 4800 layout (split file
+    fields, extra client fields) also fall back to str.  That parse is
+    about twice as slow, so the readers read strings and use
+    categorize_4800 instead.
+    """
+    if not categorical:
+        return str
+    return collections.defaultdict(
+        lambda: str, {col: 'category' for col in CATEGORICAL_COLUMNS_4800})
+
+
+def dtype_positional(usecols, names, categorical=False):
+    """Return a read_csv dtype keyed by position for headerless files.
+
+    usecols are the source field indexes and names the 4800 names that
+    are assigned to them after the read (e.g. the 5200 layout).
+    """
+    if not categorical:
+        return str
+    dtypes = dtype_4800(categorical)
+    return {idx: dtypes[name] for idx, name in zip(usecols, names)}
+
+
+def _layout_5200(usecols, names, revenue_positions, source):
+    # the compiled layout, with fields sorted by position like usecols
+    pairs = sorted(zip(usecols, names))
+    usecols = [int(pos) for pos, name in pairs]
+    names = [name for pos, name in pairs]
+    return {'source': source,
+            'usecols': usecols,
+            'names': names,
+            'dtype': dtype_positional(usecols, names),
+            'revenue_positions': (None if revenue_positions is None else
+                                  [tuple(p) for p in revenue_positions]),
+            'columns': list(COLUMNS_4800),
+            'added': [c for c in COLUMNS_4800 if c not in names]}
+
+
+def default_layout_5200():
+    """Return the 5200 layout from USECOLS_5200 and NAMES_5200."""
+    return _layout_5200(USECOLS_5200, NAMES_5200, REVENUE_POSITIONS_5200,
+                        'layout_helper_scripts')
+
+
+def compile_layout_5200(mapping_path):
+    """Read the 5200 layout from the NC5200_to_4800 mapping spreadsheet.
+
+    Returns a dict: source (the mapping file), usecols and names (the
+    loaded 5200 fields and their 4800 names), dtype (the read_csv dtype by
+    position), revenue_positions (None when the mapping has no REVCOD and
+    CHARGE fields), columns (the 4800 output order) and added (4800
+    columns the 5200 does not have).  Needs openpyxl.
+    """
+    mapping = pd.read_excel(mapping_path, sheet_name=MAPPING_SHEET,
+                            dtype=str)
+    mapping = mapping[[MAPPING_POSITION_COLUMN, MAPPING_FIELD_COLUMN]] \
+        .dropna()
+    positions = (mapping[MAPPING_POSITION_COLUMN].astype(float).astype(int)
+                 - MAPPING_FIRST_POSITION).tolist()
+    fields = mapping[MAPPING_FIELD_COLUMN].str.strip().str.upper().tolist()
+
+    usecols, names, revcods, charges = [], [], [], []
+    for pos, field in zip(positions, fields):
+        if field == 'REVCOD':
+            revcods.append(pos)
+        elif field == 'CHARGE':
+            charges.append(pos)
+        elif field in COLUMNS_4800:
+            usecols.append(pos)
+            names.append(field)
+        else:
+            raise ValueError(f'{mapping_path}: 5200 field {pos} is mapped '
+                             f'to {field!r}, which is not a 4800 field')
+    duplicated = sorted({n for n in names if names.count(n) > 1})
+    if duplicated:
+        raise ValueError(f'{mapping_path}: 4800 fields mapped more than '
+                         f'once: {duplicated}')
+    if len(revcods) != len(charges):
+        raise ValueError(f'{mapping_path}: {len(revcods)} REVCOD fields but '
+                         f'{len(charges)} CHARGE fields')
+    revenue_positions = list(zip(sorted(revcods), sorted(charges))) or None
+    return _layout_5200(usecols, names, revenue_positions,
+                        os.path.abspath(mapping_path))
+
+
+def check_layout_5200(compiled):
+    """Return what is wrong with the shape of a compiled 5200 layout.
+
+    A list of text lines, empty when the layout is well formed: as many
+    names as usecols, each 4800 name once, 5200 positions that are
+    distinct non-negative ints, the REQUIRED_FIELDS_5200 loaded and
+    revenue positions that are pairs of other fields.  Which fields are
+    loaded is up to the mapping doc.
+    """
+    usecols, names = compiled['usecols'], compiled['names']
+    pairs = compiled['revenue_positions'] or []
+    problems = []
+    if len(usecols) != len(names):
+        problems.append(f'{len(usecols)} 5200 fields but {len(names)} '
+                        '4800 names')
+    problems += [f'{name} is loaded more than once'
+                 for name in sorted({n for n in names if names.count(n) > 1})]
+    problems += [f'{name} is not loaded'
+                 for name in REQUIRED_FIELDS_5200 if name not in names]
+    if any(len(pair) != 2 for pair in pairs):
+        problems.append('revenue positions are not (REVCOD, CHARGE) pairs')
+    positions = list(usecols) + [pos for pair in pairs for pos in pair]
+    problems += [f'5200 field {pos!r} is not a field position'
+                 for pos in positions
+                 if not isinstance(pos, (int, np.integer)) or pos < 0]
+    problems += [f'5200 field {pos} is used more than once'
+                 for pos in sorted({p for p in positions
+                                    if positions.count(p) > 1})]
+    return problems
+
+
+def load_layout_5200(mapping_path=None, cache_dir=None):
+    """Return the compiled 5200 layout, see compile_layout_5200.
+
+    With cache_dir the layout is pickled there and the spreadsheet is only
+    read again when its size or mtime changes.  When the spreadsheet
+    cannot be found (e.g. the P drive is not mapped) the last pickled
+    layout is used, and without one the layout in this module.  The same
+    layout is used, with a warning, when the spreadsheet does not have the
+    MAPPING_ columns or its layout fails check_layout_5200; it is then not
+    pickled.
+    """
+    pickle_path = cache_dir and os.path.join(cache_dir, LAYOUT_5200_FILE)
+    cached = None
+    if pickle_path and os.path.exists(pickle_path):
+        with open(pickle_path, 'rb') as fp:
+            cached = pickle.load(fp)
+        if cached.get('version') != LAYOUT_5200_VERSION:
+            cached = None
+    if not mapping_path or not os.path.exists(mapping_path):
+        return cached['layout'] if cached else default_layout_5200()
+
+    st = os.stat(mapping_path)
+    stamp = f'{os.path.abspath(mapping_path)}|{st.st_size}|{st.st_mtime_ns}'
+    if cached and cached['stamp'] == stamp:
+        return cached['layout']
+    try:
+        compiled = compile_layout_5200(mapping_path)
+        problems = check_layout_5200(compiled)
+    except (ImportError, IndexError, KeyError, ValueError) as error:
+        problems = [f'{type(error).__name__}: {error}']
+    if problems:
+        fallback = cached['layout'] if cached else default_layout_5200()
+        print(f'WARNING: {mapping_path} is not a well formed 5200 layout, '
+              f"so the layout from {fallback['source']} is used:",
+              *[f'   {problem}' for problem in problems[:20]], sep='\n')
+        return fallback
+    if pickle_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temp file and swap it in so a crash never leaves half
+        #  a file
+        tmp_path = f'{pickle_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump({'version': LAYOUT_5200_VERSION, 'stamp': stamp,
+                         'layout': compiled}, fp)
+        os.replace(tmp_path, pickle_path)
+    return compiled
+
+
+def categorize_4800(df):
+    """Convert the 4800 code columns of an existing df to categoricals.
+
+    Categories are sorted like read_csv's dtype='category'.  A column with
+    more than MAX_CATEGORY_SHARE distinct values per row stays a string
+    column.  Each column is factorized once, which is also the test.
+    """
+    columns = {}
+    for col in CATEGORICAL_COLUMNS_4800:
+        if (col not in df.columns
+                or isinstance(df[col].dtype, pd.CategoricalDtype)):
+            continue
+        codes, uniques = pd.factorize(df[col], sort=True)
+        if len(uniques) <= MAX_CATEGORY_SHARE * len(df):
+            columns[col] = pd.Categorical.from_codes(codes,
+                                                     categories=uniques)
+    if columns:
+        df = df.assign(**columns)
+    return df
+
+
+def decategorize(df):
+    """Return df with every categorical column turned back into strings.
+
+    Use before steps that write new values into code columns
+    (e.g. fillna('')) or that insert row by row into Access.
+    """
+    cols = [c for c in df.columns
+            if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if cols:
+        df = df.astype({c: object for c in cols})
+    return df
+
+
+def concat_4800(frames):
+    """Concatenate 4800 dfs while keeping the code columns categorical.
+
+    pd.concat turns categoricals with different categories into object
+    columns, so the categories are first unioned across all frames.
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS_4800)
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    cats = {}
+    for frame in frames:
+        for col in frame.columns:
+            if isinstance(frame[col].dtype, pd.CategoricalDtype):
+                cats.setdefault(col, pd.Index([]))
+    for col in cats:
+        for frame in frames:
+            if col in frame.columns:
+                values = frame[col]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    new = values.cat.categories
+                else:
+                    new = pd.Index(values.dropna().unique())
+                cats[col] = cats[col].union(new)
+    # one astype per frame with the unioned categories
+    frames = [frame.astype({col: pd.CategoricalDtype(cats[col])
+                            for col in cats if col in frame.columns})
+              for frame in frames]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def recode(series, mapping, regex=False):
+    """Replace code values, like series.replace(mapping, regex=regex).
+
+    For categorical columns only the categories are rewritten, so the
+    work depends on the number of distinct codes and not on the row count.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.replace(mapping, regex=regex)
+    old_cats = series.cat.categories
+    new_cats = pd.Series(old_cats, dtype=object).replace(mapping, regex=regex)
+    cats = pd.Index(new_cats.unique())
+    # old category position -> new category position
+    lookup = cats.get_indexer(new_cats)
+    codes = series.cat.codes.to_numpy()
+    if len(lookup):
+        # an all-null column has no categories and only -1 codes
+        codes = np.where(codes >= 0, lookup[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=cats),
+                     index=series.index, name=series.name)
+
+
+def fill_code(series, value):
+    """fillna for a code column, adding the value as a category if needed."""
+    if (isinstance(series.dtype, pd.CategoricalDtype)
+            and value not in series.cat.categories):
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
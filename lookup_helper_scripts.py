@@ -0,0 +1,136 @@
+##############################################################################
+# 4800 record lookup helper scripts
+# @author: Jim Cheairs
+
+# Random access to single encounters in a large 4800 pipe file.
+#  build_index - writes a sidecar index next to the 4800 file that maps
+#   each PROVNUM + PCN to the byte offset of its line.
+#  fetch - returns the records for one or many PCNs by seeking to their
+#   lines, so a spot check does not load the whole file into pandas.
+#  The sidecar is <4800 file>.pcnidx, a small pipe file.  Its first line
+#  holds the size and mtime of the 4800 file it was built from so a stale
+#  index is rebuilt.  A PCN that is in the file more than once (e.g. a
+#  history before the keep-last dedupe) has one entry per line.
+#  Records are found line by line, so this is for 4800 files written by
+#  these programs (no quoted line breaks inside a field).  Offsets in a
+#  .gz / .zst file are into the decompressed text; as those files cannot
+#  seek, fetch reads forward through them instead.
+#
+# Import from a program in the same folder with:
+#   import lookup_helper_scripts as lookup
+##############################################################################
+import io
+import os
+
+import pandas as pd
+
+import compress_helper_scripts as compress
+import layout_helper_scripts as layout
+
+
+INDEX_SUFFIX = '.pcnidx'
+
+
+def index_path(path):
+    """Return the sidecar index file for a 4800 file."""
+    return f'{path}{INDEX_SUFFIX}'
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return f'#{st.st_size}|{st.st_mtime_ns}'
+
+
+def build_index(path, encoding='utf-8'):
+    """Write the PROVNUM + PCN offset index for a 4800 file.
+
+    Returns the number of records indexed.
+    """
+    provnums, pcns, offsets = [], [], []
+    with compress.open_binary(path) as fp:
+        header = fp.readline()
+        columns = header.rstrip(b'\r\n').decode(encoding).split('|')
+        prov_pos = columns.index('PROVNUM')
+        pcn_pos = columns.index('PCN')
+        last = max(prov_pos, pcn_pos)
+        offset = len(header)
+        for line in fp:
+            # split only up to the key fields
+            fields = line.split(b'|', last + 1)
+            if len(fields) > last:
+                provnums.append(fields[prov_pos])
+                pcns.append(fields[pcn_pos])
+                offsets.append(offset)
+            offset += len(line)
+    idx = pd.DataFrame({'PROVNUM': [v.decode(encoding) for v in provnums],
+                        'PCN': [v.decode(encoding) for v in pcns],
+                        'OFFSET': pd.Series(offsets, dtype='int64')})
+
+    # write to a temp file and swap it in so a crash never leaves half a file
+    tmp_path = f'{index_path(path)}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as fp:
+        fp.write(_stamp(path) + '\n')
+        idx.to_csv(fp, sep='|', index=False, lineterminator='\n')
+    os.replace(tmp_path, index_path(path))
+    return len(idx)
+
+
+def load_index(path):
+    """Return the offset index df for a 4800 file.
+
+    None is returned when the index is missing or was built from an older
+    version of the file.
+    """
+    try:
+        with open(index_path(path), 'r', encoding='utf-8') as fp:
+            if fp.readline().rstrip('\n') != _stamp(path):
+                return None
+            return pd.read_csv(fp, sep='|', keep_default_na=False,
+                               dtype={'PROVNUM': str, 'PCN': str,
+                                      'OFFSET': 'int64'})
+    except FileNotFoundError:
+        return None
+
+
+def fetch(path, keys, encoding='utf-8', categorical=False):
+    """Return the records of a 4800 file for the given keys as a df.
+
+    keys are PCNs or (PROVNUM, PCN) tuples.  Every line of a key is
+    returned in file order, so for a file with repeated PCNs the last
+    row of a PCN is the one a keep='last' dedupe keeps.  The index is
+    built first if it is missing or stale.  Columns are typed like
+    read_helper_scripts.read_4800.
+    """
+    idx = load_index(path)
+    if idx is None:
+        print(f'Building the PCN offset index for {os.path.basename(path)}.')
+        build_index(path, encoding)
+        idx = load_index(path)
+    keys = list(keys)
+    if keys and isinstance(keys[0], tuple):
+        found = pd.MultiIndex.from_frame(idx[['PROVNUM', 'PCN']]).isin(keys)
+    else:
+        found = idx['PCN'].isin(keys)
+    offsets = idx.loc[found, 'OFFSET'].sort_values()
+
+    if compress.compression_of(path) is None:
+        with open(path, 'rb') as fp:
+            lines = [fp.readline()]
+            for offset in offsets:
+                fp.seek(offset)
+                lines.append(fp.readline())
+    else:
+        # a compressed file cannot seek, so read forward to each offset
+        wanted = set(offsets)
+        with compress.open_binary(path) as fp:
+            lines = [fp.readline()]
+            position = len(lines[0])
+            for line in fp:
+                if position in wanted:
+                    lines.append(line)
+                    if len(lines) > len(wanted):
+                        break
+                position += len(line)
+    return pd.read_csv(io.BytesIO(b''.join(lines)), sep='|',
+                       dtype=layout.dtype_4800(categorical),
+                       encoding=encoding)
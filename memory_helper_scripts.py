@@ -0,0 +1,231 @@
+##############################################################################
+# Memory budget planner helper scripts
+# @author: Jim Cheairs
+
+# Picks how a program stage runs from an estimate of the memory it needs,
+#  so a large multi-year file is not read whole into a machine that then
+#  swaps.  The modes, from most to least memory:
+#   'memory'      - the whole file(s) in one df, the programs' normal path.
+#   'chunked'     - streamed a chunk of records at a time (the 5200
+#                   conversion, convert_5200_helper_scripts).
+#   'out_of_core' - polars' streaming engine, which does not hold the full
+#                   records in memory (the append output, read.sink_4800).
+#  plan_stage - samples the first records of each input file: the text
+#   bytes per record give the record count from the file size (unless the
+#   count is already known from validate_helper_scripts), and parsing the
+#   sample gives the df bytes per record.  The estimate is compared with
+#   the memory budget to pick the mode, and a chunk size for 'chunked'.
+#  report - formats a plan for the run log.
+#  The budget defaults to half of the memory free when the program starts.
+#
+# Import from a program in the same folder with:
+#   import memory_helper_scripts as memory
+##############################################################################
+import io
+import itertools
+import os
+
+import pandas as pd
+
+import compress_helper_scripts as compress
+import layout_helper_scripts as layout
+
+
+MODES = ('memory', 'chunked', 'out_of_core')
+
+# records parsed to measure the bytes per record
+SAMPLE_ROWS = 10_000
+# peak memory of a stage as a multiple of its parsed df - the programs
+#  hold a few copies at once (concat, dedupe, reindex and to_csv)
+WORKING_FACTOR = 3
+# share of the free memory used as the budget when none is given
+BUDGET_SHARE = 0.5
+# budget when the free memory cannot be found
+DEFAULT_BUDGET = 4 * 2**30
+# smallest chunk the planner will stream
+MIN_CHUNKSIZE = 10_000
+
+
+def _size(n):
+    if n < 2**30:
+        return f'{n / 2**20:,.1f} MB'
+    return f'{n / 2**30:,.1f} GB'
+
+
+def available_memory():
+    """Return the free physical memory in bytes, or None if unknown."""
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return psutil.virtual_memory().available
+    if os.name == 'nt':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_budget():
+    """Return BUDGET_SHARE of the free memory, or DEFAULT_BUDGET."""
+    free = available_memory()
+    if free is None:
+        return DEFAULT_BUDGET
+    return int(free * BUDGET_SHARE)
+
+
+def sample_file(path, usecols=None, names=None, sample_rows=SAMPLE_ROWS,
+                encoding='utf-8'):
+    """Estimate the record count and bytes per record of a pipe file.
+
+    usecols and names are as in read_helper_scripts.read_4800 (names for
+    the headerless 5200).  The record count of a .gz / .zst file comes
+    from the compression ratio of the sample, so it is approximate.
+    Returns a dict of file_bytes, rows, columns, text_bytes_per_row and
+    df_bytes_per_row.
+    """
+    method = compress.compression_of(path)
+    file_bytes = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        fp = compress.decompress_reader(raw, method)
+        header = fp.readline() if names is None else b''
+        lines = list(itertools.islice(fp, sample_rows))
+        compressed_read = raw.tell()
+    sample = io.BytesIO(header + b''.join(lines))
+    if names is None:
+        df = pd.read_csv(sample, sep='|', usecols=usecols,
+                         dtype=layout.dtype_4800(), encoding=encoding)
+    else:
+        df = pd.read_csv(sample, sep='|', header=None, usecols=usecols,
+                         dtype=layout.dtype_positional(usecols, names),
+                         encoding=encoding)
+
+    n = max(len(lines), 1)
+    text_bytes = sum(len(line) for line in lines)
+    if len(lines) < sample_rows:
+        # the whole file was sampled
+        rows = len(lines)
+    else:
+        text_size = file_bytes
+        if method is not None:
+            # decompressed size from the sample's compression ratio
+            text_size = file_bytes * (len(header) + text_bytes) \
+                / max(compressed_read, 1)
+        rows = int((text_size - len(header)) / (text_bytes / n))
+    return {'file_bytes': file_bytes,
+            'rows': rows,
+            'columns': df.shape[1],
+            'text_bytes_per_row': text_bytes / n,
+            'df_bytes_per_row': float(df.memory_usage(deep=True).sum()) / n}
+
+
+def plan_stage(paths, budget=None, modes=('memory',), usecols=None,
+               names=None, rows=None, working_factor=WORKING_FACTOR,
+               sample_rows=SAMPLE_ROWS, encoding='utf-8'):
+    """Pick the memory, chunked or out-of-core mode for a program stage.
+
+    paths is a file or a list or dict of files read by the stage.  modes
+    are the ones the stage has, in MODES order.  rows gives the known
+    record counts of the files (e.g. validate's 'records'), in the same
+    list or dict form as paths, so only the bytes per record is sampled.
+    budget is in bytes, by default half of the free memory.
+    The stage runs in memory when working_factor times its parsed df
+    fits the budget.  Otherwise the first lower memory mode it has is
+    picked; a stage with only 'memory' runs over budget.
+
+    Returns a dict: mode, budget, files, file_bytes, rows, columns,
+    text_bytes_per_row, df_bytes_per_row, estimated_bytes (of the memory
+    mode), fits (the estimate is within the budget) and chunksize (records
+    per chunk for 'chunked', else None).
+    """
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        raise ValueError(f'modes must be from {MODES}, not {unknown}')
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+        rows = None if rows is None else [rows]
+    if isinstance(paths, dict):
+        paths = list(paths.values())
+        rows = None if rows is None else list(rows.values())
+    if budget is None:
+        budget = default_budget()
+
+    samples = [sample_file(path, usecols, names, sample_rows, encoding)
+               for path in paths]
+    if rows is not None:
+        for sample, count in zip(samples, rows):
+            sample['rows'] = count
+    total_rows = sum(s['rows'] for s in samples)
+    df_bytes = sum(s['rows'] * s['df_bytes_per_row'] for s in samples)
+    text_bytes = sum(s['rows'] * s['text_bytes_per_row'] for s in samples)
+    per_row = df_bytes / total_rows if total_rows else 0
+    estimated = int(df_bytes * working_factor)
+    fits = estimated <= budget
+
+    if fits and 'memory' in modes:
+        mode = 'memory'
+    elif 'chunked' in modes:
+        mode = 'chunked'
+    elif 'out_of_core' in modes:
+        mode = 'out_of_core'
+    else:
+        mode = modes[0]
+    chunksize = None
+    if mode == 'chunked':
+        chunksize = int(budget / max(per_row * working_factor, 1))
+        chunksize = max(MIN_CHUNKSIZE, chunksize // 1000 * 1000)
+    return {'mode': mode,
+            'budget': budget,
+            'files': len(paths),
+            'file_bytes': sum(s['file_bytes'] for s in samples),
+            'rows': total_rows,
+            'columns': max(s['columns'] for s in samples),
+            'text_bytes_per_row': text_bytes / total_rows if total_rows
+                                  else 0,
+            'df_bytes_per_row': per_row,
+            'estimated_bytes': estimated,
+            'fits': fits,
+            'chunksize': chunksize}
+
+
+def report(result):
+    """Return a plan_stage result as text for the run log."""
+    files = 'file' if result['files'] == 1 else 'files'
+    text = [f"Memory budget: {_size(result['budget'])}",
+            f"Input: {result['files']} {files}, "
+            f"{_size(result['file_bytes'])} on disk, about "
+            f"{result['rows']:,} records of {result['columns']} columns",
+            f"Bytes per record: {result['text_bytes_per_row']:,.0f} as text, "
+            f"{result['df_bytes_per_row']:,.0f} in a df",
+            f"Estimated memory to run in memory: "
+            f"{_size(result['estimated_bytes'])}"]
+    if result['mode'] == 'memory':
+        text.append('Plan: read the whole input into memory.')
+    elif result['mode'] == 'chunked':
+        text.append(f"Plan: stream in chunks of {result['chunksize']:,} "
+                    f"records.")
+    else:
+        text.append("Plan: out-of-core with polars' streaming engine.")
+    if not result['fits'] and result['mode'] == 'memory':
+        text.append('WARNING: the estimate is over the memory budget and '
+                    'this stage can only run in memory, expect swapping.')
+    return '\n'.join(text)
@@ -0,0 +1,383 @@
+##############################################################################
+# 4800 file reading helper scripts
+# @author: Jim Cheairs
+
+# Shared reader for the pipe delimited 4800, split and 5200 client files.
+#  read_4800 - reads a pipe file with the selected parser engine:
+#   'c'       - pandas' own C engine (single threaded, always available).
+#   'pyarrow' - pyarrow's multithreaded csv reader (needs pyarrow).
+#   'polars'  - polars' multithreaded csv reader (needs polars & pyarrow).
+#  Every engine returns the same df: the same columns in file order, as
+#  strings like the old pd.read_csv(sep='|', dtype=str) call, with empty
+#  fields as nulls.  categorical=True turns the 4800 code columns into
+#  categoricals with sorted categories after the read, to save memory.
+#  Every engine reads gzip (.gz) and zstd (.zst) files as they are.
+#  fill_4800 - column projection: a program reads only the columns it
+#   uses with usecols and source, and the untouched columns are read for
+#   the surviving rows only when the full record is written out.
+#   fill_4800_frames fills several dfs with one read of each file.
+#  sink_4800 - the out-of-core version of fill_4800 plus to_csv: polars'
+#   streaming engine writes the full records without holding them in
+#   memory (needs polars).
+#  read_4800_files - checks and reads several files at the same time, with
+#   an optional callback as each file is read (e.g. to checkpoint it).
+#  With fingerprint=True read_4800 adds the _FINGERPRINT column, a uint64
+#  hash of each record (dedupe_helper_scripts), for the FULL duplicate
+#  check: of its raw line for a full read, of the loaded fields when
+#  usecols is given, as lines that differ only in fields not read are still
+#  FULL duplicates of what was read.  fingerprint='line' always hashes the
+#  raw line, to find records changed in any field (diff_helper_scripts).
+#  Which of the two was hashed is marked on the df
+#  (dedupe_helper_scripts.mark_fingerprints).
+#  With cache_dir the parsed df is kept in the columnar parsed file cache
+#  (cache_helper_scripts) and an unchanged file is not parsed again.
+#
+# Import from a program in the same folder with:
+#   import read_helper_scripts as read
+##############################################################################
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import cache_helper_scripts as cache
+import compress_helper_scripts as compress
+import dedupe_helper_scripts as dedupe
+import layout_helper_scripts as layout
+import validate_helper_scripts as validate
+
+
+ENGINES = ('c', 'pyarrow', 'polars')
+
+# columns added by read_4800(source=...) that tie a row back to its line
+#  in the source file, used by fill_4800
+SOURCE_COLUMN = '_SOURCE'
+ROW_COLUMN = '_ROW'
+# _SOURCE is 2 bytes, room for 65,536 source files
+SOURCE_DTYPE = np.uint16
+
+# strings read as nulls - the pandas read_csv defaults, given to the
+#  pyarrow and polars engines so every engine finds the same nulls
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+             '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+             'None', 'n/a', 'nan', 'null']
+
+
+def available_engines():
+    """Return the parser engines that can be used on this machine."""
+    engines = ['c']
+    try:
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return engines
+    engines.append('pyarrow')
+    try:
+        import polars  # noqa: F401
+    except ImportError:
+        return engines
+    engines.append('polars')
+    return engines
+
+
+def _read_header(path, encoding):
+    with compress.open_text(path, 'r', encoding=encoding) as fp:
+        return fp.readline().rstrip('\r\n').split('|')
+
+
+def _read_c(path, usecols, names, encoding):
+    if names is None:
+        return pd.read_csv(path, sep='|', usecols=usecols, dtype=str,
+                           encoding=encoding)
+    df = pd.read_csv(path, sep='|', header=None, usecols=usecols, dtype=str,
+                     encoding=encoding)
+    df.columns = names
+    return df
+
+
+def _read_pyarrow(path, usecols, names, encoding):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    if names is None:
+        columns = _read_header(path, encoding)
+        keep = [c for c in columns if usecols is None or c in usecols]
+        read_options = pacsv.ReadOptions(encoding=encoding)
+    else:
+        columns = [f'f{i}' for i in usecols]
+        keep = columns
+        read_options = pacsv.ReadOptions(encoding=encoding,
+                                         autogenerate_column_names=True)
+    table = pacsv.read_csv(
+        path, read_options=read_options,
+        parse_options=pacsv.ParseOptions(delimiter='|'),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=keep,
+            column_types={c: pa.string() for c in keep},
+            null_values=NA_VALUES, strings_can_be_null=True))
+    df = table.to_pandas()
+    if names is not None:
+        df.columns = names
+    return df
+
+
+def _read_polars(path, usecols, names, encoding):
+    import polars as pl
+
+    if encoding.lower().replace('-', '') in ('utf8', 'utf8lossy'):
+        encoding = 'utf8'
+    if names is None:
+        frame = pl.read_csv(path, separator='|', infer_schema_length=0,
+                            columns=usecols, null_values=NA_VALUES,
+                            encoding=encoding)
+        if usecols is not None:
+            # keep the file's column order like read_csv does
+            header = _read_header(path, encoding)
+            frame = frame.select([c for c in header if c in usecols])
+    else:
+        frame = pl.read_csv(path, separator='|', has_header=False,
+                            infer_schema_length=0, columns=list(usecols),
+                            null_values=NA_VALUES, encoding=encoding)
+        frame.columns = list(names)
+    return frame.to_pandas()
+
+
+_READERS = {'c': _read_c, 'pyarrow': _read_pyarrow, 'polars': _read_polars}
+
+
+def read_4800(path, engine='c', usecols=None, names=None, categorical=False,
+              encoding='utf-8', cache_dir=None, source=None,
+              fingerprint=False):
+    """Read a pipe delimited 4800 (or 4800-like) file into a df.
+
+    engine is 'c', 'pyarrow' or 'polars'.  usecols limits the columns read.
+    For a headerless file (the 5200) give names: usecols are then the field
+    positions (ascending) and names the column names given to them.
+    Every column is read as a string like the old pd.read_csv(sep='|',
+    dtype=str) call.  categorical=True then converts the low cardinality
+    code columns to categoricals (layout_helper_scripts.categorize_4800),
+    which costs about a fifth more read time for a third of the memory.
+    cache_dir turns on the parsed file cache: a file already parsed with
+    the same options is loaded from the cache instead of parsed.
+    source (an int id for the file, see source_id) adds the _SOURCE and _ROW
+    columns so the columns not in usecols can be added later with
+    fill_4800.  fingerprint=True adds the _FINGERPRINT column, the hash of
+    each record as read: its raw line for a full read, or the loaded
+    fields with usecols.  fingerprint='line' hashes the whole raw line
+    whatever columns were read.
+    """
+    if engine not in _READERS:
+        raise ValueError(f"engine must be one of {ENGINES}, not {engine!r}")
+    if names is not None and usecols is None:
+        raise ValueError('usecols are required when names are given')
+
+    def parse():
+        df = _READERS[engine](path, usecols, names, encoding)
+        if categorical:
+            # after the read - parsing into categoricals is twice as slow
+            df = layout.categorize_4800(df)
+        if fingerprint and usecols is not None and fingerprint != 'line':
+            # the loaded fields only - continuation lines of the 5200 differ
+            #  in fields that are not read
+            df[dedupe.FINGERPRINT_COLUMN] = dedupe.key_hashes(df)
+        elif fingerprint:
+            hashes = dedupe.file_fingerprints(path, header=names is None)
+            if len(hashes) != len(df):
+                raise ValueError(f'{path} has {len(hashes):,} record lines '
+                                 f'but {len(df):,} records were read, so '
+                                 f'they cannot be fingerprinted by line.')
+            df[dedupe.FINGERPRINT_COLUMN] = hashes
+        return df
+
+    # every engine gives the same df, so the engine is not part of the key
+    df = cache.read_cached(path, parse, cache_dir, usecols=usecols,
+                           names=names, categorical=categorical,
+                           encoding=encoding, fingerprint=fingerprint)
+    if fingerprint:
+        dedupe.mark_fingerprints(
+            df, 'line' if fingerprint == 'line' or usecols is None else
+            [col for col in df.columns if col != dedupe.FINGERPRINT_COLUMN])
+    if source is not None:
+        df[SOURCE_COLUMN] = source_id(source)
+        df[ROW_COLUMN] = np.arange(len(df), dtype=np.int64)
+    return df
+
+
+def source_id(source):
+    """Return source as a _SOURCE value, raising if it does not fit."""
+    largest = np.iinfo(SOURCE_DTYPE).max
+    if not 0 <= source <= largest:
+        raise ValueError(f'source id {source:,} is out of range, the '
+                         f'{SOURCE_COLUMN} column holds 0 to {largest:,}.')
+    return SOURCE_DTYPE(source)
+
+
+def _union_columns(paths, encoding):
+    # the columns of the source files in order, like pd.concat of full reads
+    columns = []
+    for path in paths.values():
+        columns += [c for c in _read_header(path, encoding)
+                    if c not in columns]
+    return columns
+
+
+def fill_4800(df, paths, columns=None, engine='c', categorical=False,
+              encoding='utf-8', cache_dir=None):
+    """Add the columns that were not read back to a projected df.
+
+    df was built from read_4800(usecols=..., source=...) reads and may
+    since have been concatenated, deduped and sorted.  paths maps each
+    source id to its file.  The missing columns are read from one source
+    file at a time and only the rows still in df are kept.  Returns the
+    full records in df's row order with the _SOURCE and _ROW columns
+    dropped.  columns gives the column order; by default it is the
+    columns of the source files in order, like pd.concat of full reads.
+    To fill several dfs from the same files use fill_4800_frames, which
+    reads each file once for all of them.
+    """
+    return fill_4800_frames([df], paths, columns, engine, categorical,
+                            encoding, cache_dir)[0]
+
+
+def fill_4800_frames(frames, paths, columns=None, engine='c',
+                     categorical=False, encoding='utf-8', cache_dir=None):
+    """Return fill_4800 of each df in frames, reading each file once.
+
+    The arguments are those of fill_4800, with a list of projected dfs
+    in place of df.  The missing columns of a source file are read once
+    and the rows of every df are taken from that one read, so filling
+    e.g. the updated records and the final records does not parse the
+    files twice.
+    """
+    if columns is None:
+        columns = _union_columns(paths, encoding)
+    missing = [c for c in columns
+               if any(c not in df.columns for df in frames)]
+    sources = [df[SOURCE_COLUMN].to_numpy() for df in frames]
+    rows = [df[ROW_COLUMN].to_numpy() for df in frames]
+    parts = [[] for df in frames]
+    positions = [[] for df in frames]
+    for source, path in paths.items():
+        wheres = [np.flatnonzero(s == source) for s in sources]
+        if not any(len(where) for where in wheres):
+            continue
+        header = _read_header(path, encoding)
+        rest = read_4800(path, engine=engine,
+                         usecols=[c for c in missing if c in header],
+                         categorical=categorical, encoding=encoding,
+                         cache_dir=cache_dir)
+        for k, where in enumerate(wheres):
+            if len(where):
+                parts[k].append(rest.take(rows[k][where]))
+                positions[k].append(where)
+        del rest
+    filled_frames = []
+    for df, df_parts, df_positions in zip(frames, parts, positions):
+        if df_parts:
+            # put the filled rows back in df's row order
+            order = np.argsort(np.concatenate(df_positions), kind='stable')
+            filled = layout.concat_4800(df_parts).take(order)
+            filled = filled[[c for c in filled.columns
+                             if c not in df.columns]]
+            filled.index = df.index
+        else:
+            filled = pd.DataFrame(index=df.index)
+        df = pd.concat([df.drop(columns=[SOURCE_COLUMN, ROW_COLUMN]),
+                        filled], axis=1)
+        filled_frames.append(df.reindex(columns=columns))
+    return filled_frames
+
+
+def sink_4800(df, paths, path_out, columns=None):
+    """Write the full records of a projected df with polars' streaming engine.
+
+    The out-of-core version of fill_4800 followed by to_csv: df and paths
+    are as in fill_4800, but only df's _SOURCE and _ROW columns are used
+    and the source files are streamed, so the full records are never all
+    in memory.  The records are written in df's row order in the same
+    layout as to_csv(sep='|', index=False, na_rep='').  A .gz / .zst
+    source is decompressed to a temp file first and a .gz / .zst path_out
+    is compressed from one, as polars streams plain files only.  Needs
+    polars.  Returns the number of records written.
+    """
+    import polars as pl
+
+    if columns is None:
+        columns = _union_columns(paths, 'utf-8')
+    keep = pl.DataFrame({SOURCE_COLUMN: df[SOURCE_COLUMN].to_numpy(),
+                         ROW_COLUMN: df[ROW_COLUMN].to_numpy(),
+                         '_ORDER': np.arange(len(df), dtype=np.int64)})
+    out_dir = os.path.dirname(os.path.abspath(path_out))
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+        frames = []
+        for source, path in paths.items():
+            rows = keep.filter(pl.col(SOURCE_COLUMN) == source)
+            if not rows.height:
+                continue
+            if compress.compression_of(path) is not None:
+                plain = os.path.join(tmp_dir, f'{source}.txt')
+                with compress.open_binary(path) as fp_in, \
+                        open(plain, 'wb') as fp_out:
+                    shutil.copyfileobj(fp_in, fp_out, 1 << 20)
+                path = plain
+            frames.append(
+                pl.scan_csv(path, separator='|', infer_schema_length=0,
+                            null_values=NA_VALUES)
+                .with_row_index(ROW_COLUMN)
+                .with_columns(pl.col(ROW_COLUMN).cast(pl.Int64))
+                .join(rows.lazy().drop(SOURCE_COLUMN), on=ROW_COLUMN))
+        if frames:
+            records = pl.concat(frames, how='diagonal').sort('_ORDER') \
+                .select(columns)
+        else:
+            records = pl.LazyFrame(schema={c: pl.String for c in columns})
+
+        # write to a temp file and swap it in so a crash never leaves half
+        #  a file
+        tmp_path = os.path.join(tmp_dir, 'sink.txt')
+        records.sink_csv(tmp_path, separator='|', null_value='')
+        if compress.compression_of(path_out) is None:
+            os.replace(tmp_path, path_out)
+        else:
+            # the temp file gets path_out's extension for its compression
+            packed = tmp_path + os.path.splitext(path_out)[1]
+            with open(tmp_path, 'rb') as fp_in, \
+                    compress.open_binary(packed, 'wb') as fp_out:
+                shutil.copyfileobj(fp_in, fp_out, 1 << 20)
+            os.replace(packed, path_out)
+    return len(df)
+
+
+def _scan_and_read(path, source, on_read, kwargs):
+    check = validate.scan_pipe_file(path)
+    df = read_4800(path, source=source, **kwargs)
+    if on_read is not None:
+        on_read(source, check, df)
+    return check, df
+
+
+def read_4800_files(paths, max_workers=None, on_read=None, **kwargs):
+    """Check and read several 4800 files at the same time.
+
+    paths maps a source id to a file, in "later file wins" order.  Each
+    file is scanned with validate_helper_scripts.scan_pipe_file and read
+    with read_4800(source=id, **kwargs) on a thread pool, so the wall
+    clock time is about that of the largest file.  The parsers and the
+    scan do most of their work outside the GIL.  Returns two dicts, the
+    dfs and the scan results, keyed and ordered like paths whatever order
+    the files finish in.  on_read(source, check, df) is called on the pool
+    thread as each file is read, e.g. to checkpoint it, so the files that
+    were read are kept when a later one fails.
+    """
+    max_workers = max_workers or min(len(paths), os.cpu_count() or 1) or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        futures = {source: pool.submit(_scan_and_read, path, source, on_read,
+                                       kwargs)
+                   for source, path in paths.items()}
+        results = {source: future.result()
+                   for source, future in futures.items()}
+    frames = {source: df for source, (check, df) in results.items()}
+    checks = {source: check for source, (check, df) in results.items()}
+    return frames, checks
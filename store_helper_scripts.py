@@ -0,0 +1,225 @@
+##############################################################################
+# 4800 history store helper scripts
+# @author: Jim Cheairs
+
+# Persistent store of a client's 4800 history, so a refresh does not
+#  rebuild the whole history from the last flat file and every monthly
+#  extract.
+#  The store is a folder of Parquet files, one per discharge month
+#  (YYYYMM.parquet, 000000.parquet for records without a valid DISDATE),
+#  keyed by PROVNUM + PCN, plus keys.parquet, the uint64 key hash
+#  (dedupe_helper_scripts), month and row hash of every stored record.
+#  upsert - adds a monthly file with keep-last: within the file the last
+#   record of a key wins, and a stored record with the same key is
+#   replaced, also when its DISDATE has moved to another month.  Only the
+#   partitions of the file's months (and of moved records) are rewritten,
+#   so the cost is that of the month appended, plus reading the integer
+#   key index.  A record identical to the stored one (same row hash) is
+#   skipped, so a resubmitted month that did not change is not rewritten.
+#  extract - writes the 4800 file for a window of discharge months one
+#   partition at a time, sorted by DISDATE, so memory holds one month.
+#  Files are written to a temp file and swapped in.  The partitions are
+#  written before the key index, so an upsert that was stopped part way
+#  is put right by running it again.
+#  Needs pyarrow.
+#
+# Import from a program in the same folder with:
+#   import store_helper_scripts as store
+##############################################################################
+import os
+
+import numpy as np
+import pandas as pd
+
+import compress_helper_scripts as compress
+import dates_helper_scripts as dates
+import dedupe_helper_scripts as dedupe
+import layout_helper_scripts as layout
+
+
+# columns a stored record is keyed by
+KEY_COLUMNS = ['PROVNUM', 'PCN']
+KEYS_FILE = 'keys.parquet'
+# partition of the records without a valid DISDATE
+NO_MONTH = 0
+
+
+def _partition_path(store_dir, month):
+    return os.path.join(store_dir, f'{month:06d}.parquet')
+
+
+def _tmp_path(path):
+    return f'{path}.{os.getpid()}.tmp'
+
+
+def months_of(series):
+    """Return the YYYYMM discharge month of a MMDDYYYY date column as int32.
+
+    NO_MONTH for null and invalid dates.
+    """
+    days = dates.day_ordinals(series)
+    valid = days != dates.NULL_DAY
+    ym = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    months = (ym // 12 + 1970) * 100 + ym % 12 + 1
+    return np.where(valid, months, NO_MONTH).astype(np.int32)
+
+
+def _load_keys(store_dir):
+    # the key hashes, months and row hashes of the stored records, sorted
+    #  by key hash
+    import pyarrow.parquet as pq
+
+    path = os.path.join(store_dir, KEYS_FILE)
+    if not os.path.exists(path):
+        return (np.array([], dtype=np.uint64), np.array([], dtype=np.int32),
+                np.array([], dtype=np.uint64))
+    table = pq.read_table(path)
+    return (table.column('hash').to_numpy(),
+            table.column('month').to_numpy(),
+            table.column('row').to_numpy())
+
+
+def _save_keys(store_dir, hashes, months, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    order = np.argsort(hashes, kind='stable')
+    path = os.path.join(store_dir, KEYS_FILE)
+    tmp_path = _tmp_path(path)
+    pq.write_table(pa.table({'hash': hashes[order], 'month': months[order],
+                             'row': rows[order]}), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_partition(store_dir, month):
+    import pyarrow.parquet as pq
+
+    path = _partition_path(store_dir, month)
+    if not os.path.exists(path):
+        return None
+    return pq.read_table(path).to_pandas()
+
+
+def _write_partition(store_dir, month, df):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = _partition_path(store_dir, month)
+    if not len(df):
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = _tmp_path(path)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def stored_months(store_dir):
+    """Return the months that have a partition in the store, in order."""
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(int(name[:6]) for name in os.listdir(store_dir)
+                  if name.endswith('.parquet') and name != KEYS_FILE)
+
+
+def upsert(store_dir, df):
+    """Add the records of a 4800 df to the store, the later record wins.
+
+    df holds full 4800 records (read with categorical=False).  Returns a
+    dict with the records given, duplicates (keys repeated in df), inserted
+    (new keys), updated (keys already stored, with a change), unchanged
+    (identical to the stored record, skipped), moved (updated records now
+    in another month) and months (the partitions rewritten).
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    df, dups = dedupe.drop_duplicates(df, KEY_COLUMNS, keep='last')
+    df = df.reindex(columns=layout.COLUMNS_4800)
+    hashes = dedupe.key_hashes(df, KEY_COLUMNS)
+    rows = dedupe.key_hashes(df)
+    months = months_of(df['DISDATE'])
+
+    # where the keys of df are stored now
+    stored_hashes, key_months, key_rows = _load_keys(store_dir)
+    pos = np.searchsorted(stored_hashes, hashes)
+    pos[pos == len(stored_hashes)] = 0
+    found = (stored_hashes[pos] == hashes) if len(stored_hashes) \
+        else np.zeros(len(hashes), dtype=bool)
+    # records identical to the stored ones are not written again
+    unchanged = found & (key_rows[pos] == rows) if len(stored_hashes) \
+        else found
+    if unchanged.any():
+        df = df[~unchanged]
+        hashes, rows, months = (hashes[~unchanged], rows[~unchanged],
+                                months[~unchanged])
+        pos, found = pos[~unchanged], found[~unchanged]
+    old_months = key_months[pos[found]]
+
+    touched = sorted(set(months.tolist()) | set(old_months.tolist()))
+    for month in touched:
+        part = _read_partition(store_dir, month)
+        new = df[months == month]
+        if part is not None:
+            # drop the stored records df replaces
+            part = part[~np.isin(dedupe.key_hashes(part, KEY_COLUMNS),
+                                 hashes)]
+            new = pd.concat([part, new], ignore_index=True)
+        _write_partition(store_dir, month, new)
+        del part, new
+
+    # the key index, last so a stopped upsert can be run again
+    keep = np.ones(len(stored_hashes), dtype=bool)
+    keep[pos[found]] = False
+    _save_keys(store_dir, np.concatenate([stored_hashes[keep], hashes]),
+               np.concatenate([key_months[keep], months]),
+               np.concatenate([key_rows[keep], rows]))
+    return {'records': len(df) + int(unchanged.sum()) + dups['count'],
+            'duplicates': dups['count'],
+            'inserted': int((~found).sum()),
+            'updated': int(found.sum()),
+            'unchanged': int(unchanged.sum()),
+            'moved': int((old_months != months[found]).sum()),
+            'months': touched}
+
+
+def extract(store_dir, path_out, start=None, end=None):
+    """Write the stored records of a window of months to a 4800 file.
+
+    start and end are YYYYMM months (inclusive), None for no limit.  The
+    records without a valid DISDATE are only written when neither is
+    given.  Partitions are written one at a time in month order, each
+    sorted by DISDATE, so memory holds one month.  A .gz / .zst path_out
+    is written compressed.  Returns the number of records written.
+    """
+    months = [month for month in stored_months(store_dir)
+              if (start is None or month >= start)
+              and (end is None or month <= end)
+              and (month != NO_MONTH or (start is None and end is None))]
+    # records without a date go last, like a DISDATE sort puts them
+    months.sort(key=lambda month: (month == NO_MONTH, month))
+    written = 0
+    tmp_path = _tmp_path(path_out)
+    if compress.compression_of(path_out):
+        tmp_path += os.path.splitext(path_out)[1]
+    with compress.open_text(tmp_path, 'w', encoding='utf-8',
+                            newline='') as fp:
+        if not months:
+            fp.write('|'.join(layout.COLUMNS_4800) + os.linesep)
+        for i, month in enumerate(months):
+            df = _read_partition(store_dir, month)
+            order = np.argsort(dates.day_ordinals(df['DISDATE']),
+                               kind='stable')
+            df.take(order).to_csv(fp, index=False, sep='|', na_rep='',
+                                  header=i == 0)
+            written += len(df)
+            del df
+    os.replace(tmp_path, path_out)
+    return written
+
+
+def report(store_dir):
+    """Return the number of stored records by discharge month."""
+    import pyarrow.parquet as pq
+
+    counts = {month: pq.ParquetFile(_partition_path(store_dir, month))
+              .metadata.num_rows for month in stored_months(store_dir)}
+    return pd.Series(counts, name='records', dtype='int64')
@@ -0,0 +1,6 @@
+# The helper scripts are imported by module name from the repo folder, as
+#  the programs do.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
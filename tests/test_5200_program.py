@@ -0,0 +1,58 @@
+import os
+import re
+
+import pandas as pd
+
+import layout_helper_scripts as layout
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                       '4800_From_5200_File_Preprocessing_FirstHealth.py')
+
+
+def _line(pcn, disdate, sex='Female'):
+    fields = [''] * (max(layout.USECOLS_5200) + 1)
+    fields[1], fields[3], fields[13] = pcn, '561936354', sex
+    fields[8] = fields[19] = disdate
+    return '|'.join(fields)
+
+
+def _run(tmp_path, monkeypatch, capsys, **settings):
+    # the program with its own settings, only its files moved to tmp_path
+    lines = [_line('100', '01152023'), _line('100', '01152023'),
+             _line('200', '02012023', 'Male')]
+    (tmp_path / 'in5200.txt').write_text('\n'.join(lines) + '\n',
+                                         encoding='windows-1252')
+    settings = {'path_src': str(tmp_path), 'path_out': str(tmp_path),
+                'file_src': 'in5200.txt', 'file_4800': 'out4800.txt',
+                'mapping_5200': str(tmp_path / 'no_mapping_doc.xlsx'),
+                'cache_dir': str(tmp_path / 'cache'), **settings}
+    with open(PROGRAM, encoding='utf-8') as fp:
+        source = fp.read()
+    for name, value in settings.items():
+        source, n = re.subn(rf'^{name} = (\(.*?\)|.*?)$',
+                            f'{name} = {value!r}', source, count=1,
+                            flags=re.M | re.S)
+        assert n == 1, name
+    monkeypatch.setattr(os, 'getlogin', lambda: 'test')
+    exec(compile(source, PROGRAM, 'exec'), {'__name__': '__main__'})
+    df = pd.read_csv(tmp_path / 'out4800.txt', sep='|', dtype=str)
+    return df, capsys.readouterr().out
+
+
+def test_program_runs_with_its_default_settings(tmp_path, monkeypatch,
+                                                capsys):
+    df, log = _run(tmp_path, monkeypatch, capsys)
+    assert df.columns.tolist() == layout.COLUMNS_4800
+    # the repeated continuation line is dropped as a FULL duplicate
+    assert df['PCN'].tolist() == ['100', '200']
+    assert df['SEX'].tolist() == ['F', 'M']
+    assert 'WARNING' not in log
+
+
+def test_collapse_without_revenue_positions_is_turned_off(tmp_path,
+                                                          monkeypatch,
+                                                          capsys):
+    df, log = _run(tmp_path, monkeypatch, capsys,
+                   collapse_continuations=True)
+    assert 'continuation records are not collapsed' in log
+    assert df['PCN'].tolist() == ['100', '200']
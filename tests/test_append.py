@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+import append_helper_scripts as append
+
+
+def _df(rows):
+    return pd.DataFrame(rows, columns=['PCN', 'DISDATE', 'SEX'])
+
+
+@pytest.fixture
+def frames():
+    old = _df([['100', '11152022', 'F'], ['200', '01102023', 'M'],
+               ['300', '01202023', 'F'], ['200', '01112023', 'M'],
+               ['400', None, 'U']])
+    new1 = _df([['200', '01102023', 'F'], ['500', '01252023', 'M'],
+                ['500', '01262023', 'M']])
+    new2 = _df([['500', '02012023', 'F'], ['600', '02022023', 'F']])
+    return {0: old, 1: new1, 2: new2}
+
+
+def _expected(frames):
+    return pd.concat(list(frames.values())) \
+        .drop_duplicates('PCN', keep='last').reset_index(drop=True)
+
+
+def test_merge_append_matches_concat_and_drop_duplicates(frames):
+    df, stats = append.merge_append(frames, window=False)
+    pd.testing.assert_frame_equal(df.reset_index(drop=True),
+                                  _expected(frames))
+    assert stats['count'] == 4
+    assert stats['dropped'].tolist() == [2, 2, 0]
+    assert stats['kept'].tolist() == [3, 1, 2]
+    assert stats['window_rows'] == 10
+    # rows: the source of the record kept, columns: of the one replaced
+    assert stats['winners'].loc[1].tolist() == [2, 0, 0]
+    assert stats['winners'].loc[2].tolist() == [0, 2, 0]
+
+
+def test_merge_append_window(frames):
+    # the new files cover Jan-Feb 2023, so the November record and its
+    #  later copy are both kept
+    frames[2] = pd.concat([frames[2], _df([['100', '02152023', 'F']])])
+    df, stats = append.merge_append(frames)
+    assert stats['window_rows'] == 4 + 3 + 3
+    assert (stats['first'], stats['last']) \
+        == (pd.Timestamp('2023-01-01'), pd.Timestamp('2023-02-28'))
+    assert df['PCN'].tolist().count('100') == 2
+    # the same as the full check for the records inside the window
+    full, _ = append.merge_append(frames, window=False)
+    assert df[df['PCN'] != '100'].reset_index(drop=True).equals(
+        full[full['PCN'] != '100'].reset_index(drop=True))
+
+
+@pytest.mark.parametrize('final_newline', [True, False])
+def test_sort_file_matches_sort_values(tmp_path, final_newline):
+    rows = [['100', '03012023'], ['200', ''], ['300', '01152022'],
+            ['400', '13012023'], ['500', '03012023'], ['600', '12312022'],
+            ['700', '01152022'], ['800', '02292024']]
+    lines = ['PCN|DISDATE|SEX'] + [f'{pcn}|{day}|F' for pcn, day in rows]
+    path = tmp_path / 'final.txt'
+    path.write_bytes(('\n'.join(lines) + ('\n' if final_newline else ''))
+                     .encode('utf-8'))
+    stats = append.sort_file(str(path), chunksize=3)
+    assert stats == {'records': 8, 'runs': 3}
+
+    df = pd.read_csv(path, sep='|', dtype=str, keep_default_na=False)
+    expected = pd.DataFrame(rows, columns=['PCN', 'DISDATE']).assign(SEX='F')
+    expected = expected.iloc[pd.to_datetime(
+        expected['DISDATE'], format='%m%d%Y', errors='coerce')
+        .reset_index(drop=True).sort_values(kind='stable', na_position='last')
+        .index].reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, expected)
+    # every record is written back with its line break
+    assert path.read_bytes().endswith(b'|F\n')
@@ -0,0 +1,85 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+import cache_helper_scripts as cache
+
+pytest.importorskip('pyarrow')
+
+
+def _entries(cache_dir):
+    return sorted(p.name for p in cache_dir.glob('*.arrow'))
+
+
+def _read(tmp_path, cache_dir, name, rows=10):
+    path = tmp_path / name
+    path.write_text(f'{name}\n' + ''.join(f'{n}\n' for n in range(rows)))
+    return cache.read_cached(str(path), lambda: pd.read_csv(path, dtype=str),
+                             str(cache_dir), usecols=None)
+
+
+def test_read_cached_counts_instead_of_printing(tmp_path, capsys,
+                                                monkeypatch):
+    monkeypatch.setattr(cache, 'stats', cache.collections.Counter())
+    cache_dir = tmp_path / 'cache'
+    first = _read(tmp_path, cache_dir, 'a.txt')
+    second = _read(tmp_path, cache_dir, 'a.txt')
+    pd.testing.assert_frame_equal(first, second)
+    assert capsys.readouterr().out == ''
+    assert [cache.stats[name] for name in ['loaded', 'parsed', 'pruned']] \
+        == [1, 1, 0]
+    assert cache.summary() == ('Parsed file cache: 1 files loaded, 1 parsed '
+                               'and stored, 0 old entries deleted.')
+
+
+def test_prune_deletes_old_entries(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    _read(tmp_path, cache_dir, 'a.txt')
+    _read(tmp_path, cache_dir, 'b.txt')
+    old, new = _entries(cache_dir)
+    stale = time.time() - 40 * 86400
+    os.utime(cache_dir / old, (stale, stale))
+    (cache_dir / f'{old}.123.456.tmp').write_bytes(b'')
+    os.utime(cache_dir / f'{old}.123.456.tmp', (stale, stale))
+    assert cache.prune(str(cache_dir), max_bytes=None, max_age_days=31) == 1
+    assert _entries(cache_dir) == [new]
+    assert not list(cache_dir.glob('*.tmp'))
+    # the index keeps only the file of the entry left
+    assert set(cache._load_index(str(cache_dir)).values()) \
+        == {new.split('_')[0]}
+
+
+def test_prune_keeps_the_most_recently_used_entries(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    for name in ['a.txt', 'b.txt', 'c.txt']:
+        _read(tmp_path, cache_dir, name)
+    entries = _entries(cache_dir)
+    now = time.time()
+    for n, name in enumerate(entries):
+        os.utime(cache_dir / name, (now - 10 * n, now - 10 * n))
+    size = max(os.path.getsize(cache_dir / name) for name in entries)
+    assert cache.prune(str(cache_dir), max_bytes=2 * size,
+                       max_age_days=None) == 1
+    assert _entries(cache_dir) == entries[:2]
+
+
+def test_load_marks_the_entry_used(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    _read(tmp_path, cache_dir, 'a.txt')
+    entry, = _entries(cache_dir)
+    stale = time.time() - 40 * 86400
+    os.utime(cache_dir / entry, (stale, stale))
+    _read(tmp_path, cache_dir, 'a.txt')
+    assert _entries(cache_dir) == [entry]
+    assert os.path.getmtime(cache_dir / entry) > stale + 86400
+
+
+def test_clear_deletes_entries_index_and_temp_files(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    _read(tmp_path, cache_dir, 'a.txt')
+    (cache_dir / 'x_y.arrow.1.2.tmp').write_bytes(b'')
+    (cache_dir / 'layout_5200.pickle').write_bytes(b'')
+    assert cache.clear(str(cache_dir)) == 3
+    assert os.listdir(cache_dir) == ['layout_5200.pickle']
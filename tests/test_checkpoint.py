@@ -0,0 +1,27 @@
+import pandas as pd
+
+import checkpoint_helper_scripts as checkpoint
+
+
+def test_resume_and_clear_only_the_checkpoint_files(tmp_path):
+    data = tmp_path / 'f1.txt'
+    data.write_text('PCN\n100\n')
+    ck = tmp_path / 'ck'
+    ck.mkdir()
+    (ck / 'other.parquet').write_text('not a checkpoint')
+    paths = {1: str(data)}
+    checkpoint.save(str(ck), 1, str(data), {'check': 'ok'}, usecols=['PCN'])
+    assert checkpoint.resume(str(ck), paths, usecols=['PCN']) == {1: {'check': 'ok'}}
+    assert checkpoint.resume(str(ck), paths, usecols=None) == {}
+
+    df = pd.DataFrame({'PCN': ['100']})
+    checkpoint.save_state(str(ck), paths, df, {'count': 0}, usecols=['PCN'])
+    merged, counts = checkpoint.load_state(str(ck), paths, usecols=['PCN'])
+    assert merged.equals(df) and counts == {'count': 0}
+    # another file is not resumed
+    data.write_text('PCN\n100\n200\n')
+    assert checkpoint.resume(str(ck), paths, usecols=['PCN']) == {}
+    assert checkpoint.load_state(str(ck), paths, usecols=['PCN']) is None
+
+    assert checkpoint.clear(str(ck)) == 2
+    assert [p.name for p in ck.iterdir()] == ['other.parquet']
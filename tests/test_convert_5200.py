@@ -0,0 +1,121 @@
+import collections
+
+import pandas as pd
+import pytest
+
+import convert_5200_helper_scripts as convert
+import layout_helper_scripts as layout
+
+
+# a small 5200 layout: PCN, PROVNUM and DISDATE, with one revenue code /
+#  charge pair per line that is not loaded
+USECOLS = [1, 3, 19]
+NAMES = ['PCN', 'PROVNUM', 'DISDATE']
+REVENUE_POSITIONS = [(22, 23)]
+FIELDS = 25
+
+
+def _line(pcn, disdate, revcod='', charge=''):
+    fields = [''] * FIELDS
+    fields[1], fields[3], fields[19] = pcn, '561936354', disdate
+    fields[22], fields[23] = revcod, charge
+    return '|'.join(fields)
+
+
+def _same(left, right):
+    # a null read back from the cache's Arrow file is None, not NaN
+    pd.testing.assert_frame_equal(left.astype(object).where(left.notna()),
+                                  right.astype(object).where(right.notna()))
+
+
+@pytest.fixture
+def file_5200(tmp_path):
+    # encounter 1 has two continuation records, encounter 2 has none
+    lines = [_line('100', '01152023', '0250', '10.00'),
+             _line('100', '01152023', '0300', '20.00'),
+             _line('100', '01152023', '0450', '30.00'),
+             _line('200', '02012023', '0250', '5.00')]
+    path = tmp_path / 'in5200.txt'
+    path.write_text('\n'.join(lines) + '\n', encoding='windows-1252')
+    return str(path)
+
+
+def test_read_5200_through_the_cache(file_5200, tmp_path):
+    pytest.importorskip('pyarrow')
+    cache_dir = tmp_path / 'cache'
+    first = convert.read_5200(file_5200, USECOLS, NAMES, REVENUE_POSITIONS,
+                              cache_dir=str(cache_dir), fingerprint=True)
+    assert list(cache_dir.glob('*.arrow'))
+    second = convert.read_5200(file_5200, USECOLS, NAMES, REVENUE_POSITIONS,
+                               cache_dir=str(cache_dir), fingerprint=True)
+    expected = convert.collapse_5200(file_5200, USECOLS, NAMES,
+                                     REVENUE_POSITIONS, fingerprint=True)
+    pd.testing.assert_frame_equal(first, expected)
+    _same(second, expected)
+    assert first['PCN'].tolist() == ['100', '200']
+
+
+def test_collapse_fills_revcod_and_charge(file_5200):
+    df = convert.collapse_5200(file_5200, USECOLS, NAMES, REVENUE_POSITIONS)
+    assert df['PCN'].tolist() == ['100', '200']
+    assert df.loc[0, ['REVCOD1', 'REVCOD2', 'REVCOD3']].tolist() \
+        == ['0250', '0300', '0450']
+    assert df.loc[0, ['CHARGE1', 'CHARGE2', 'CHARGE3']].tolist() \
+        == ['10.00', '20.00', '30.00']
+    assert df.loc[1, ['REVCOD1', 'CHARGE1']].tolist() == ['0250', '5.00']
+    assert df[['REVCOD4', 'CHARGE4']].isna().all().all()
+    assert df.columns.tolist() == NAMES + layout.CHARGE_COLUMNS_4800
+
+
+def test_collapse_across_blocks(tmp_path):
+    # an encounter split over the chunksize blocks, with a repeated line,
+    #  gives the same records as the whole file read at once
+    lines = [_line('100', '01152023', '0250', '10.00')] * 2 \
+        + [_line('100', '01152023', f'{n:04d}', f'{n}.00')
+           for n in range(300, 360)] \
+        + [_line(str(pcn), '02012023', '0250', '5.00')
+           for pcn in range(200, 210)]
+    path = tmp_path / 'in5200.txt'
+    path.write_text('\n'.join(lines) + '\n\n', encoding='windows-1252')
+    counts = collections.Counter()
+    whole = convert.collapse_5200(str(path), USECOLS, NAMES,
+                                  REVENUE_POSITIONS, counts=counts)
+    chunks = list(convert.collapse_5200(str(path), USECOLS, NAMES,
+                                        REVENUE_POSITIONS, chunksize=7))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole)
+    assert whole['PCN'].tolist() == ['100'] + [str(n) for n in range(200, 210)]
+    # the repeated line is counted once and the detail stops at 50 slots
+    assert whole.loc[0, ['REVCOD1', 'REVCOD2', 'REVCOD50']].tolist() \
+        == ['0250', '0300', '0348']
+    assert counts == {'continuation_lines': 61, 'revenue_overflow': 1}
+
+
+def test_collapse_needs_revenue_positions(file_5200):
+    with pytest.raises(ValueError, match='revenue_positions'):
+        convert.collapse_5200(file_5200, USECOLS, NAMES, None)
+    # () collapses without the charge detail
+    df = convert.collapse_5200(file_5200, USECOLS, NAMES, ())
+    assert df.columns.tolist() == NAMES
+    assert len(df) == 2
+
+
+def test_stream_keeps_separator_characters_in_a_field(tmp_path):
+    # a form feed or file separator in a field is data, not a line break
+    mrns = ['A\x0cB', 'C\x1cD', 'E\x0bF']
+    lines = []
+    for n, mrn in enumerate(mrns):
+        fields = [''] * (max(layout.USECOLS_5200) + 1)
+        fields[1], fields[3], fields[9], fields[13] = \
+            str(100 + n), '561936354', mrn, 'Female'
+        fields[19] = '01152023'
+        lines.append('|'.join(fields))
+    path_in = tmp_path / 'in5200.txt'
+    path_in.write_text('\n'.join(lines) + '\n', encoding='windows-1252')
+    path_out = tmp_path / 'out4800.txt'
+    stats = convert.stream_5200_to_4800(
+        str(path_in), str(path_out), layout.USECOLS_5200, layout.NAMES_5200,
+        2, {'561936354': '340115'}, {'Female': 'F'})
+    assert stats['records_written'] == 3
+    df = pd.read_csv(path_out, sep='|', dtype=str)
+    assert df['MRN'].tolist() == mrns
+    assert df['PROVNUM'].tolist() == ['340115'] * 3
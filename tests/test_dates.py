@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+import dates_helper_scripts as dates
+
+VALUES = ['01152023', '02292024', '02292023', '12312261', '01011678',
+          '13012023', '00102023', '011520234', '01a52023', ' 1152023', '',
+          '07041776', '03012000', '02291900']
+
+
+def _days(values):
+    # day numbers from pandas, NULL_DAY where it cannot parse the date
+    parsed = pd.to_datetime(pd.Series(values), format='%m%d%Y',
+                            errors='coerce')
+    days = (parsed - pd.Timestamp('1970-01-01')).dt.days
+    return days.fillna(dates.NULL_DAY).astype(int).tolist()
+
+
+def test_decode_mmddyyyy_matches_to_datetime():
+    assert dates.decode_mmddyyyy(VALUES).tolist() == _days(VALUES)
+    # pandas reads a 7 digit date as a 3 digit year, MMDDYYYY does not, and
+    #  dates outside the datetime64[ns] range are invalid
+    assert dates.decode_mmddyyyy(['0115202', '12311677', '01012262']) \
+        .tolist() == [dates.NULL_DAY] * 3
+
+
+def test_decode_mmddyyyy_every_day_of_a_leap_and_a_common_year():
+    days = pd.date_range('2023-01-01', '2024-12-31')
+    values = days.strftime('%m%d%Y').tolist()
+    assert dates.decode_mmddyyyy(values).tolist() == _days(values)
+
+
+def test_to_datetime_and_days_between_match_pandas():
+    dates.clear_memo()
+    start = pd.Series(['01152023', '02282024', None, '13012023', '12312022'],
+                      name='ADMDATE')
+    end = pd.Series(['01202023', '03012024', '01012023', '01012023', None],
+                    name='DISDATE', index=[5, 6, 7, 8, 9])
+    expected_start = pd.to_datetime(start, format='%m%d%Y',
+                                    errors='coerce').astype('datetime64[ns]')
+    expected_end = pd.to_datetime(end, format='%m%d%Y', errors='coerce')
+    pd.testing.assert_series_equal(dates.to_datetime(start), expected_start)
+    los = dates.days_between(start, end)
+    expected = (expected_end - expected_start.set_axis(end.index)).dt.days
+    pd.testing.assert_series_equal(los, expected.astype(float),
+                                   check_names=False)
+    # without a missing date it stays int64
+    los = dates.days_between(start[:2], end[:2])
+    assert los.dtype == np.int64
+    assert los.tolist() == [5, 2]
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import dedupe_helper_scripts as dedupe
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(7)
+    return pd.DataFrame({
+        'PCN': rng.integers(0, 40, 200).astype(str),
+        'SEX': rng.choice(['F', 'M', None], 200),
+        'ZIP': rng.choice(['28374', '27514'], 200)},
+        index=np.arange(200) * 3)
+
+
+@pytest.mark.parametrize('keep', ['first', 'last', False])
+def test_find_duplicates_matches_pandas(df, keep):
+    dups = dedupe.find_duplicates(df, 'PCN', keep=keep)
+    expected = df.duplicated('PCN', keep=keep)
+    assert dups['mask'].tolist() == expected.tolist()
+    assert dups['count'] == expected.sum()
+    assert dups['dropped'].tolist() == df.index[expected].tolist()
+    assert dups['repeated'].tolist() \
+        == df.duplicated('PCN', keep=False).tolist()
+    assert dups['keys'] == df['PCN'].nunique()
+
+
+@pytest.mark.parametrize('keep', ['first', 'last'])
+def test_full_check_on_the_repeated_keys_only(df, keep):
+    # a FULL duplicate is also a key duplicate, so checking only the rows
+    #  with a repeated key finds every one
+    repeated = dedupe.find_duplicates(df, 'PCN')['repeated']
+    dups = dedupe.find_duplicates(df, keep=keep, rows=repeated)
+    assert dups['mask'].tolist() == df.duplicated(keep=keep).tolist()
+    assert len(dups['hashes']) == repeated.sum()
+    # rows limits the check: a row outside them is never marked
+    rows = np.arange(len(df)) % 2 == 0
+    dups = dedupe.find_duplicates(df, 'PCN', keep=keep, rows=rows)
+    expected = np.zeros(len(df), dtype=bool)
+    expected[rows] = df[rows].duplicated('PCN', keep=keep)
+    assert dups['mask'].tolist() == expected.tolist()
+
+
+def test_drop_duplicates_matches_pandas(df):
+    result, dups = dedupe.drop_duplicates(df, ['PCN', 'SEX'], keep='last')
+    pd.testing.assert_frame_equal(
+        result, df.drop_duplicates(['PCN', 'SEX'], keep='last'))
+    assert dups['count'] == len(df) - len(result)
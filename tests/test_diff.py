@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import diff_helper_scripts as diff
+import read_helper_scripts as read
+
+HEADER = 'PROVNUM|PCN|SEX|TOTALCLM\n'
+
+
+@pytest.fixture
+def files(tmp_path):
+    old = tmp_path / 'old4800.txt'
+    old.write_text(HEADER + '340115|100|F|10\n340115|200|M|20\n')
+    new = tmp_path / 'new4800.txt'
+    new.write_text(HEADER + '340115|100|F|15\n340115|300|M|30\n')
+    return str(old), str(new)
+
+
+def test_compare_needs_fingerprints_hashed_the_same_way(files):
+    old_path, new_path = files
+    old_df = read.read_4800(old_path, usecols=['PCN', 'SEX'],
+                            fingerprint='line')
+    new_df = read.read_4800(new_path, usecols=['PCN', 'SEX'],
+                            fingerprint=True)
+    with pytest.raises(ValueError, match='cannot be compared'):
+        diff.compare(old_df, new_df)
+    # the loaded fields on both sides miss the TOTALCLM change
+    old_df = read.read_4800(old_path, usecols=['PCN', 'SEX'],
+                            fingerprint=True)
+    assert diff.compare(old_df, new_df)['counts'].tolist() == [1, 0, 1]
+    # the raw lines on both sides find it
+    new_df = read.read_4800(new_path, usecols=['PCN', 'SEX'],
+                            fingerprint='line')
+    old_df = read.read_4800(old_path, usecols=['PCN', 'SEX'],
+                            fingerprint='line')
+    assert diff.compare(old_df, new_df)['counts'].tolist() == [1, 1, 0]
+
+
+def test_compare_on_columns_without_fingerprints(files):
+    old_df, new_df = [read.read_4800(path) for path in files]
+    with pytest.raises(ValueError, match='cannot be compared'):
+        diff.compare(old_df.assign(_FINGERPRINT=0),
+                     new_df.assign(_FINGERPRINT=0))
+    result = diff.compare(old_df, new_df, row=['SEX', 'TOTALCLM'])
+    assert result['status'].tolist() == ['updated', 'inserted']
+    assert result['old_positions'].tolist() == [0, -1]
+
+
+def test_compare_matches_a_pandas_merge():
+    rng = np.random.default_rng(3)
+    old_df = pd.DataFrame({'PCN': rng.integers(0, 60, 100).astype(str),
+                           'SEX': rng.choice(['F', 'M'], 100)})
+    new_df = pd.DataFrame({'PCN': rng.integers(30, 90, 80).astype(str),
+                           'SEX': rng.choice(['F', 'M'], 80)})
+    result = diff.compare(old_df, new_df, row=['PCN', 'SEX'])
+
+    # the last old record of each key, like the keep-last append
+    last = old_df.reset_index().drop_duplicates('PCN', keep='last')
+    merged = new_df.merge(last, on='PCN', how='left',
+                          suffixes=('', '_old'))
+    expected = np.where(merged['index'].isna(), 'inserted',
+                        np.where(merged['SEX'] == merged['SEX_old'],
+                                 'unchanged', 'updated'))
+    assert result['status'].tolist() == expected.tolist()
+    assert result['old_positions'].tolist() \
+        == merged['index'].fillna(-1).astype(int).tolist()
+    assert result['counts'].to_dict() \
+        == pd.Series(expected).value_counts().reindex(
+            diff.STATUSES, fill_value=0).to_dict()
+
+
+def test_field_deltas_and_changes(files):
+    old_df, new_df = [read.read_4800(path) for path in files]
+    result = diff.compare(old_df, new_df, row=['SEX', 'TOTALCLM'])
+    old_updated = old_df.take(result['old_positions'][result['updated']])
+    deltas = diff.field_deltas(old_updated, new_df[result['updated']])
+    assert deltas.to_dict('records') == [
+        {'PCN': '100', 'FIELD': 'TOTALCLM', 'OLD': '10', 'NEW': '15'}]
+    table = diff.changes(new_df, result, deltas)
+    assert table.columns.tolist() == ['PCN', 'CHANGE', 'FIELD', 'OLD', 'NEW']
+    assert table[['PCN', 'CHANGE', 'FIELD']].fillna('').values.tolist() \
+        == [['300', 'inserted', ''], ['100', 'updated', 'TOTALCLM']]
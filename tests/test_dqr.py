@@ -0,0 +1,39 @@
+import ast
+import os
+
+import pandas as pd
+import pytest
+
+import dedupe_helper_scripts as dedupe
+import read_helper_scripts as read
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+
+
+@pytest.mark.parametrize('program', ['4800 DQR_for_Access.py',
+                                     '4800 DQR_for_Access_GPT.py'])
+def test_dqr_fingerprints_the_whole_line(program):
+    # FULL duplicates are judged on every column, as in the full read the
+    #  DQR used before it read only the dqr_columns
+    with open(os.path.join(ROOT, program), encoding='utf-8') as fp:
+        tree = ast.parse(fp.read())
+    calls = [node for node in ast.walk(tree)
+             if isinstance(node, ast.Call)
+             and ast.unparse(node.func) == 'read.read_4800']
+    assert calls
+    for call in calls:
+        keywords = {k.arg: ast.literal_eval(k.value) for k in call.keywords
+                    if k.arg == 'fingerprint'}
+        assert keywords == {'fingerprint': 'line'}
+
+
+def test_line_fingerprints_match_a_full_read(tmp_path):
+    # the second and third records differ only in a column that is not read
+    path = tmp_path / 'in4800.txt'
+    path.write_text('PROVNUM|PCN|REVCOD1\n340115|100|0250\n340115|100|0250\n'
+                    '340115|100|0300\n')
+    df = read.read_4800(str(path), usecols=['PROVNUM', 'PCN'],
+                        fingerprint='line')
+    full = pd.read_csv(path, sep='|', dtype=str)
+    dups = dedupe.find_duplicates(df, dedupe.FINGERPRINT_COLUMN)
+    assert dups['mask'].tolist() == full.duplicated().tolist()
@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+import pytest
+
+import layout_helper_scripts as layout
+
+
+pytest.importorskip('openpyxl')
+
+
+def _write_mapping(path, positions, fields, columns=None):
+    columns = columns or [layout.MAPPING_POSITION_COLUMN,
+                          layout.MAPPING_FIELD_COLUMN]
+    pd.DataFrame({columns[0]: positions, columns[1]: fields}) \
+        .to_excel(path, index=False)
+    return str(path)
+
+
+def test_mapping_with_revenue_fields_is_compiled_and_pickled(tmp_path):
+    positions = layout.USECOLS_5200 + [400, 401, 403, 404, 600]
+    fields = layout.NAMES_5200 + ['REVCOD', 'CHARGE', 'REVCOD', 'CHARGE',
+                                  None]
+    mapping = _write_mapping(tmp_path / 'map.xlsx', positions, fields)
+    compiled = layout.load_layout_5200(mapping, str(tmp_path))
+    assert compiled['usecols'] == layout.USECOLS_5200
+    assert compiled['names'] == layout.NAMES_5200
+    assert compiled['revenue_positions'] == [(400, 401), (403, 404)]
+    assert os.path.exists(tmp_path / layout.LAYOUT_5200_FILE)
+
+
+def test_mapping_with_other_columns_falls_back(tmp_path, capsys):
+    mapping = _write_mapping(tmp_path / 'map.xlsx', layout.USECOLS_5200,
+                             layout.NAMES_5200, ['Field #', 'Maps To'])
+    fallback = layout.load_layout_5200(mapping, str(tmp_path))
+    assert fallback == layout.default_layout_5200()
+    assert 'WARNING' in capsys.readouterr().out
+    assert not os.path.exists(tmp_path / layout.LAYOUT_5200_FILE)
+
+
+def test_mapping_with_other_fields_is_used(tmp_path):
+    # the doc decides which fields are loaded, e.g. one more 5200 field
+    positions = layout.USECOLS_5200 + [600]
+    fields = layout.NAMES_5200 + ['CONMD3']
+    fields[layout.NAMES_5200.index('CONMD3')] = None
+    mapping = _write_mapping(tmp_path / 'map.xlsx', positions, fields)
+    compiled = layout.load_layout_5200(mapping, str(tmp_path))
+    assert compiled['usecols'][-1] == 600
+    assert compiled['names'][-1] == 'CONMD3'
+    assert len(compiled['names']) == len(layout.NAMES_5200)
+    assert os.path.exists(tmp_path / layout.LAYOUT_5200_FILE)
+
+
+def test_malformed_mapping_falls_back(tmp_path, capsys):
+    # PCN is missing and DISDATE's field is also a revenue code field
+    pcn = layout.NAMES_5200.index('PCN')
+    disdate = layout.USECOLS_5200[layout.NAMES_5200.index('DISDATE')]
+    positions = layout.USECOLS_5200 + [disdate, 401]
+    fields = layout.NAMES_5200 + ['REVCOD', 'CHARGE']
+    fields[pcn] = None
+    mapping = _write_mapping(tmp_path / 'map.xlsx', positions, fields)
+    fallback = layout.load_layout_5200(mapping, str(tmp_path))
+    assert fallback == layout.default_layout_5200()
+    log = capsys.readouterr().out
+    assert 'PCN is not loaded' in log
+    assert f'5200 field {disdate} is used more than once' in log
+    assert not os.path.exists(tmp_path / layout.LAYOUT_5200_FILE)
+
+
+def test_recode_categorical_code_columns():
+    df = layout.categorize_4800(pd.DataFrame({
+        'PRDIAGPOA': ['E', 'Y', 'E', None],
+        'SECDX40POA': pd.Series([None] * 4, dtype=object)}))
+    assert isinstance(df['PRDIAGPOA'].dtype, pd.CategoricalDtype)
+    recoded = layout.recode(df['PRDIAGPOA'], {'E': '1'})
+    assert recoded.tolist()[:3] == ['1', 'Y', '1']
+    assert pd.isna(recoded.iloc[3])
+    # an unused position has no categories at all
+    assert layout.recode(df['SECDX40POA'], {'E': '1'}).isna().all()
+    assert layout.decategorize(df).dtypes.tolist() == [object, object]
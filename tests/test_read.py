@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+import dedupe_helper_scripts as dedupe
+import read_helper_scripts as read
+
+
+def test_projected_read_fingerprints_the_loaded_fields(tmp_path):
+    # a record and its continuation line, which differ only in field 3
+    #  that is not read
+    path = tmp_path / 'in5200.txt'
+    path.write_text('x|100|01152023|0250\nx|100|01152023|0300\n')
+    kwargs = dict(usecols=[1, 2], names=['PCN', 'DISDATE'])
+    df = read.read_4800(str(path), fingerprint=True, **kwargs)
+    assert df[dedupe.FINGERPRINT_COLUMN].nunique() == 1
+    assert dedupe.find_duplicates(df, dedupe.FINGERPRINT_COLUMN)['count'] == 1
+    # 'line' hashes the whole line, for the change report
+    df = read.read_4800(str(path), fingerprint='line', **kwargs)
+    assert df[dedupe.FINGERPRINT_COLUMN].nunique() == 2
+
+
+def test_source_ids_past_one_byte(tmp_path):
+    path = tmp_path / 'in.txt'
+    path.write_text('PCN|DISDATE\n100|01152023\n')
+    df = read.read_4800(str(path), source=300)
+    assert df[read.SOURCE_COLUMN].tolist() == [300]
+    with pytest.raises(ValueError, match='out of range'):
+        read.read_4800(str(path), source=70_000)
+
+
+def test_fill_frames_reads_each_file_once(tmp_path, monkeypatch):
+    paths = {}
+    for i, rows in enumerate([['1|01152023|A', '2|01162023|B'],
+                              ['2|02012023|C', '3|02022023|D']]):
+        path = tmp_path / f'f{i}.txt'
+        path.write_text('\n'.join(['PCN|DISDATE|SEX'] + rows) + '\n')
+        paths[i] = str(path)
+    df = pd.concat([read.read_4800(path, usecols=['PCN'], source=i)
+                    for i, path in paths.items()], ignore_index=True)
+    final = df.take([3, 0, 2])
+    updated = df.take([1])
+    expected = [read.fill_4800(final, paths), read.fill_4800(updated, paths)]
+
+    reads = []
+    read_4800 = read.read_4800
+    monkeypatch.setattr(read, 'read_4800',
+                        lambda path, **kwargs: reads.append(path)
+                        or read_4800(path, **kwargs))
+    filled = read.fill_4800_frames([final, updated], paths)
+    assert sorted(reads) == sorted(paths.values())
+    for left, right in zip(filled, expected):
+        pd.testing.assert_frame_equal(left, right)
+    assert filled[0]['SEX'].tolist() == ['D', 'A', 'C']
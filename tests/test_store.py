@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+import store_helper_scripts as store
+
+pytest.importorskip('pyarrow')
+
+COLUMNS = ['PROVNUM', 'PCN', 'DISDATE', 'SEX']
+
+
+def _df(rows):
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def _extract(store_dir, path, **window):
+    written = store.extract(store_dir, str(path), **window)
+    df = pd.read_csv(path, sep='|', dtype=str)
+    assert len(df) == written
+    return df[COLUMNS]
+
+
+def test_upsert_and_extract_match_the_keep_last_append(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    jan = _df([['340115', '100', '01152023', 'F'],
+               ['340115', '200', '01202023', 'M'],
+               ['340115', '200', '01212023', 'M'],
+               ['340116', '100', '01302023', 'F']])
+    stats = store.upsert(store_dir, jan)
+    assert {k: stats[k] for k in ['records', 'duplicates', 'inserted',
+                                  'updated', 'unchanged']} \
+        == {'records': 4, 'duplicates': 1, 'inserted': 3, 'updated': 0,
+            'unchanged': 0}
+    # a resubmission: one record unchanged, one moved to February, one
+    #  without a DISDATE
+    feb = _df([['340115', '100', '01152023', 'F'],
+               ['340115', '200', '02052023', 'U'],
+               ['340115', '300', None, 'F'],
+               ['340115', '400', '02102023', 'M']])
+    stats = store.upsert(store_dir, feb)
+    assert {k: stats[k] for k in ['inserted', 'updated', 'unchanged',
+                                  'moved', 'months']} \
+        == {'inserted': 2, 'updated': 1, 'unchanged': 1, 'moved': 1,
+            'months': [0, 202301, 202302]}
+    assert store.stored_months(store_dir) == [0, 202301, 202302]
+    assert store.report(store_dir).tolist() == [1, 2, 2]
+
+    expected = pd.concat([jan, feb]) \
+        .drop_duplicates(['PROVNUM', 'PCN'], keep='last')
+    expected = expected.iloc[pd.to_datetime(
+        expected['DISDATE'], format='%m%d%Y', errors='coerce')
+        .reset_index(drop=True).sort_values(kind='stable', na_position='last')
+        .index].reset_index(drop=True)
+    pd.testing.assert_frame_equal(_extract(store_dir, tmp_path / 'all.txt'),
+                                  expected)
+    feb_only = _extract(store_dir, tmp_path / 'feb.txt', start=202302,
+                        end=202302)
+    pd.testing.assert_frame_equal(
+        feb_only, expected[expected['DISDATE'].str.startswith('02', na=False)]
+        .reset_index(drop=True))
@@ -0,0 +1,49 @@
+import gzip
+
+import pytest
+
+import validate_helper_scripts as validate
+
+HEADER = b'PROVNUM|PCN|DISDATE'
+
+
+def _lines(data):
+    # what an editor shows: a last line without a line break still counts
+    return len(data.splitlines())
+
+
+@pytest.mark.parametrize('data', [
+    HEADER + b'\n340115|100|01152023\n340115|200|02012023\n',
+    HEADER + b'\n340115|100|01152023\n340115|200|02012023',
+    HEADER + b'\r\n340115|100|01152023\r\n\r\n340115|200\r\n',
+    HEADER + b'\n',
+    HEADER,
+    b'',
+])
+def test_scan_pipe_file_counts_lines_like_the_file(tmp_path, data):
+    for path, write in [(tmp_path / 'in4800.txt', open),
+                        (tmp_path / 'in4800.txt.gz', gzip.open)]:
+        with write(path, 'wb') as fp:
+            fp.write(data)
+        result = validate.scan_pipe_file(str(path))
+        assert result['lines'] == _lines(data)
+        assert result['final_newline'] == (not data or data.endswith(b'\n'))
+        body = data.splitlines()[1:]
+        assert result['records'] == sum(1 for line in body if line.strip())
+
+
+def test_scan_pipe_file_finds_bad_lines(tmp_path):
+    path = tmp_path / 'in4800.txt'
+    path.write_bytes(HEADER + b'\n340115|100|01152023\n\n340115|200\n'
+                     b'340115|300|01|2023')
+    result = validate.scan_pipe_file(str(path), block_size=8)
+    assert result['lines'] == 5
+    assert result['records'] == 3
+    assert result['blank_lines'] == [3]
+    assert result['malformed'].to_dict() == {4: 1, 5: 3}
+    assert result['delimiter_counts'].to_dict() == {1: 1, 2: 1, 3: 1}
+    # a headerless file (the 5200) expects the most common count
+    path.write_bytes(b'1|2|3\n4|5|6\n7|8\n')
+    result = validate.scan_pipe_file(str(path), header=False)
+    assert result['expected_delimiters'] == [2]
+    assert result['malformed'].to_dict() == {3: 1}
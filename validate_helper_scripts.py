@@ -0,0 +1,164 @@
+##############################################################################
+# Pipe file validation helper scripts
+# @author: Jim Cheairs
+
+# Structural check of a pipe delimited client file before it is parsed.
+#  scan_pipe_file - memory maps the file and counts the newlines and the
+#   pipe delimiters on every line with numpy, a block at a time, so it runs
+#   at close to disk speed without parsing any fields.  Lines with the wrong
+#   number of delimiters (a stray pipe in an MRN, a short 5200 record...)
+#   are reported by line number instead of being silently padded by
+#   read_csv.  It also gives the line count the programs log before reading.
+#   Compressed (.gz / .zst) files are decompressed as a stream instead.
+#  report - formats a scan result for the run log.
+#
+# Import from a program in the same folder with:
+#   import validate_helper_scripts as validate
+##############################################################################
+import mmap
+
+import numpy as np
+import pandas as pd
+
+import compress_helper_scripts as compress
+
+
+NEWLINE = ord('\n')
+PIPE = ord('|')
+
+
+def _scan(blocks):
+    # pipe count and end offset of every line, one block at a time
+    counts, ends = [], []
+    carry = 0  # pipes seen so far on the line that spans into the next block
+    start = 0
+    last_byte = NEWLINE
+    for block in blocks:
+        if not len(block):
+            continue
+        is_pipe = block == PIPE
+        newlines = np.flatnonzero(block == NEWLINE)
+        if len(newlines):
+            # sum the pipes between each pair of line breaks
+            line_starts = np.concatenate([[0], newlines[:-1] + 1])
+            per_line = np.add.reduceat(is_pipe[:newlines[-1] + 1],
+                                       line_starts, dtype=np.int64)
+            per_line[0] += carry
+            carry = int(np.count_nonzero(is_pipe[newlines[-1] + 1:]))
+            counts.append(per_line)
+            ends.append(newlines + start)
+        else:
+            carry += int(np.count_nonzero(is_pipe))
+        start += len(block)
+        last_byte = block[-1]
+    final_newline = last_byte == NEWLINE
+    if not final_newline:
+        # last line without a line break
+        counts.append(np.array([carry]))
+        ends.append(np.array([start]))
+    if not counts:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), True
+    return np.concatenate(counts), np.concatenate(ends), final_newline
+
+
+def _mapped_blocks(data, block_size):
+    # blocks of a memory mapped plain file
+    for start in range(0, len(data), block_size):
+        yield data[start:start + block_size]
+
+
+def _stream_blocks(fp, block_size):
+    # blocks of a compressed file, decompressed as a stream
+    while True:
+        block = fp.read(block_size)
+        if not block:
+            return
+        yield np.frombuffer(block, dtype=np.uint8)
+
+
+def scan_pipe_file(path, header=True, expected=None, block_size=1 << 20):
+    """Check the delimiter count of every line of a pipe file.
+
+    expected is the number of pipes a good line has (an int or a list of
+    ints).  By default it is the header's count, or for a headerless file
+    (the 5200) the most common count.  Line numbers are 1 based like an
+    editor's, with the header as line 1.  The file is scanned block_size
+    bytes at a time, small enough to stay in the cpu cache.  Plain files
+    are memory mapped; .gz and .zst files are decompressed as a stream.
+
+    Returns a dict:
+      lines - all lines, the same as counting the lines of the file.
+      records - lines that are not the header or blank.
+      expected_delimiters - the good delimiter count(s).
+      delimiter_counts - number of lines for each delimiter count.
+      malformed - Series of delimiter counts indexed by line number for
+                  the lines with the wrong count.
+      blank_lines - line numbers of empty lines.
+      final_newline - False when the last line has no line break.
+    """
+    if compress.compression_of(path) is None:
+        with open(path, 'rb') as fp:
+            try:
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file cannot be memory mapped
+                mm = None
+            if mm is None:
+                counts, ends, final_newline = _scan([])
+            else:
+                with mm:
+                    data = np.frombuffer(mm, dtype=np.uint8)
+                    counts, ends, final_newline = _scan(
+                        _mapped_blocks(data, block_size))
+                    del data
+    else:
+        with compress.open_binary(path) as fp:
+            counts, ends, final_newline = _scan(_stream_blocks(fp,
+                                                               block_size))
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts
+    # a blank line has no pipes and at most a carriage return
+    blank = (counts == 0) & (lengths <= 1)
+
+    line_numbers = np.arange(1, len(counts) + 1)
+    body = ~blank
+    if header and len(counts):
+        body[0] = False
+    if expected is None:
+        if header and len(counts):
+            expected = int(counts[0])
+        elif body.any():
+            expected = int(np.bincount(counts[body]).argmax())
+        else:
+            expected = 0
+    expected = [expected] if np.isscalar(expected) else list(expected)
+    bad = body & ~np.isin(counts, expected)
+
+    return {'lines': len(counts),
+            'records': int(body.sum()),
+            'expected_delimiters': expected,
+            'delimiter_counts': pd.Series(counts[body]).value_counts()
+                                  .sort_index(),
+            'malformed': pd.Series(counts[bad], index=line_numbers[bad],
+                                   name='delimiters'),
+            'blank_lines': line_numbers[blank].tolist(),
+            'final_newline': bool(final_newline)}
+
+
+def report(result, max_lines=20):
+    """Return a scan_pipe_file result as text for the run log."""
+    expected = ' or '.join(str(e) for e in result['expected_delimiters'])
+    malformed = result['malformed']
+    text = [f"Records: {result['records']:,g}",
+            f'Expected delimiters per line: {expected}',
+            f'Malformed lines: {len(malformed):,g}']
+    if len(malformed):
+        text.append(f'  first {min(len(malformed), max_lines)} '
+                    f'(line number: delimiters found):')
+        text += [f'  {line:,g}: {count}' for line, count
+                 in malformed.head(max_lines).items()]
+    if result['blank_lines']:
+        text.append(f"Blank lines: {len(result['blank_lines']):,g}")
+    if not result['final_newline']:
+        text.append('The last line has no line break.')
+    return '\n'.join(text)